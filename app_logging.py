@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Доля успешных быстрых запросов, попадающих в access-лог
+ACCESS_LOG_SAMPLE_RATE = float(os.getenv("ACCESS_LOG_SAMPLE_RATE", "0.1"))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", "500"))
+
+# Идентификатор запроса или фоновой задачи, попадает в каждую запись лога
+correlation_id: ContextVar[Optional[str]] = ContextVar("correlation_id", default=None)
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "correlation_id"}
+
+
+def new_correlation_id(prefix: str = "") -> str:
+    value = f"{prefix}{uuid.uuid4().hex}"
+    correlation_id.set(value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "correlation_id", None):
+            entry["correlation_id"] = record.correlation_id
+        # Всё, что передано через extra=..., становится полями записи
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Кладёт запись в очередь и сразу возвращает управление циклу событий.
+
+    Форматирование и запись в поток выполняет QueueListener в отдельном
+    потоке. Если очередь переполнена (медленный приёмник), запись
+    отбрасывается, а не блокирует обработку запросов.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # В отличие от стандартного prepare() ничего не форматируем здесь
+        record.correlation_id = correlation_id.get()
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("logging.dropped")
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging() -> None:
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    sink = logging.StreamHandler(sys.stdout)
+    sink.setFormatter(JsonFormatter())
+    _listener = QueueListener(log_queue, sink, respect_handler_level=False)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers = [NonBlockingQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL)
+    # Uvicorn пишет свой access-лог синхронно — его заменяет AccessLogMiddleware
+    logging.getLogger("uvicorn.access").disabled = True
+    for name in ("uvicorn", "uvicorn.error", "apscheduler"):
+        logging.getLogger(name).handlers = []
+        logging.getLogger(name).propagate = True
+
+
+def shutdown_logging() -> None:
+    global _listener
+    if _listener is not None:
+        # Дописывает всё, что осталось в очереди
+        _listener.stop()
+        _listener = None
+
+
+access_logger = logging.getLogger("access")
+
+
+class AccessLogMiddleware:
+    """Назначает correlation id запросу и пишет выборочный access-лог.
+
+    Ошибки и медленные запросы пишутся всегда, остальные — с вероятностью
+    ACCESS_LOG_SAMPLE_RATE.
+    """
+
+    def __init__(self, app, sample_rate: float = ACCESS_LOG_SAMPLE_RATE,
+                 slow_ms: float = ACCESS_LOG_SLOW_MS):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        request_id = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        token = correlation_id.set(request_id)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            if scope.get("client_disconnected"):
+                # Клиент ушёл до ответа (как 499 в nginx)
+                status_code = 499
+            if (
+                status_code >= 500
+                or duration_ms >= self.slow_ms
+                or random.random() < self.sample_rate
+            ):
+                access_logger.info(
+                    "request",
+                    extra={
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status": status_code,
+                        "duration_ms": round(duration_ms, 2),
+                    }
+                )
+            correlation_id.reset(token)
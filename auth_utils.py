@@ -1,6 +1,6 @@
 # auth_utils.py
 from passlib.context import CryptContext
-from jose import JWTError, jwt
+from jose import JWTError, jwt, jwk
 from datetime import datetime, timedelta
 from typing import Optional
 import os
@@ -10,7 +10,16 @@ load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 часа
+# Режим без обращения к БД: пользователь восстанавливается из claims токена
+AUTH_STATELESS = os.getenv("AUTH_STATELESS", "0") == "1"
+# В stateless-режиме access-токен короткий (15 минут), продлевается через /auth/refresh
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv(
+    "ACCESS_TOKEN_EXPIRE_MINUTES", "15" if AUTH_STATELESS else str(60 * 24)
+))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+
+# Ключ собирается один раз, а не при каждой проверке подписи
+_signing_key = jwk.construct(SECRET_KEY, ALGORITHM)
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -27,12 +36,34 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.setdefault("type", "access")
+    encoded_jwt = jwt.encode(to_encode, _signing_key, algorithm=ALGORITHM)
     return encoded_jwt
 
+def create_token_pair(user) -> dict:
+    # Access-токен несёт всё, что нужно обработчикам без запроса к БД;
+    # refresh-токен — только id и эпоху, он проверяется по БД в /auth/refresh
+    epoch = user.token_epoch or 0
+    access_token = create_access_token(data={
+        "sub": str(user.id),
+        "role": user.role.value,
+        "tz": user.timezone,
+        "ep": epoch,
+    })
+    refresh_token = create_access_token(
+        data={"sub": str(user.id), "ep": epoch, "type": "refresh"},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    }
+
 def decode_access_token(token: str) -> Optional[dict]:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, _signing_key, algorithms=[ALGORITHM])
         return payload
     except JWTError:
         return None
\ No newline at end of file
@@ -0,0 +1,244 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+from pydantic import ValidationError
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from calendar_rollup import invalidate_rollups
+from models.task import Task
+from models.user import User, UserRole
+from schemas import TaskCreate
+from shards import shard_map
+from utils import calculate_urgency, determine_quadrant
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "5000"))
+# Сколько тела запроса держать в памяти, прежде чем сбросить на диск
+IMPORT_SPOOL_MAX_MEMORY = int(os.getenv("IMPORT_SPOOL_MAX_MEMORY", str(8 * 1024 * 1024)))
+IMPORT_MAX_ERRORS = 20
+# Больше этого тело запроса не принимаем (413), в том числе без Content-Length
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(100 * 1024 * 1024)))
+
+EXPORT_COLUMNS = [
+    "id", "title", "description", "is_important", "is_urgent", "quadrant",
+    "completed", "created_at", "completed_at", "deadline_at", "user_id",
+]
+
+STAGING_TABLE = "tasks_import_staging"
+STAGING_COLUMNS = ["title", "description", "is_important", "is_urgent", "quadrant", "deadline_at"]
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def stream_tasks_export(current_user: User, fmt: str) -> AsyncIterator[bytes]:
+    # Отдельная сессия живёт ровно столько, сколько идёт отдача ответа
+    statement = select(*[getattr(Task, name) for name in EXPORT_COLUMNS]).order_by(Task.id)
+    if current_user.role == UserRole.ADMIN:
+        # Админ выгружает задачи всех шардов по очереди
+        shards = shard_map.shards
+    else:
+        statement = statement.where(Task.user_id == current_user.id)
+        shards = [shard_map.shard_for_user(current_user.id)]
+
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        yield buffer.getvalue().encode("utf-8")
+
+    for shard in shards:
+        async with shard.session() as session:
+            # Серверный курсор: строки приходят порциями, память не растёт
+            result = await session.stream(
+                statement.execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+
+            async for rows in result.partitions():
+                buffer = io.StringIO()
+                if fmt == "csv":
+                    writer = csv.writer(buffer)
+                    for row in rows:
+                        writer.writerow(["" if v is None else _export_value(v) for v in row])
+                else:
+                    for row in rows:
+                        record = {name: _export_value(v) for name, v in zip(EXPORT_COLUMNS, row)}
+                        buffer.write(json.dumps(record, ensure_ascii=False))
+                        buffer.write("\n")
+                yield buffer.getvalue().encode("utf-8")
+
+
+def _too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Файл импорта больше {IMPORT_MAX_BYTES} байт"
+    )
+
+
+async def _spool_body(request: Request) -> tempfile.SpooledTemporaryFile:
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > IMPORT_MAX_BYTES:
+        raise _too_large()
+
+    spool = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_MAX_MEMORY)
+    size = 0
+    async for chunk in request.stream():
+        # Content-Length может отсутствовать (chunked) или быть неверным
+        size += len(chunk)
+        if size > IMPORT_MAX_BYTES:
+            spool.close()
+            raise _too_large()
+        spool.write(chunk)
+    spool.seek(0)
+    return spool
+
+
+def _iter_rows(stream: io.TextIOBase, fmt: str) -> Iterator[Tuple[int, object]]:
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Пустые ячейки CSV означают отсутствие значения
+            yield reader.line_num, {k: (v if v != "" else None) for k, v in row.items() if k}
+    else:
+        for line_num, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_num, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_num, e
+
+
+def _to_record(task_data: TaskCreate) -> tuple:
+    deadline_at = task_data.deadline_at
+    if deadline_at is not None and deadline_at.tzinfo is None:
+        deadline_at = deadline_at.replace(tzinfo=timezone.utc)
+    is_urgent = calculate_urgency(deadline_at)
+    return (
+        task_data.title,
+        task_data.description,
+        task_data.is_important,
+        is_urgent,
+        determine_quadrant(task_data.is_important, is_urgent),
+        deadline_at,
+    )
+
+
+def _parse_batch(rows: Iterator[Tuple[int, object]], errors: List[dict]) -> Tuple[List[tuple], bool]:
+    # Разбор и проверка схемой — чистый CPU, поэтому идут в потоке по
+    # IMPORT_BATCH_SIZE строк, а цикл событий тем временем обслуживает запросы.
+    # Возвращает проверенные строки и признак конца разбора.
+    batch: List[tuple] = []
+    for line_num, row in rows:
+        try:
+            if isinstance(row, Exception):
+                raise ValueError(str(row))
+            task_data = TaskCreate.model_validate(row)
+        except (ValidationError, ValueError) as e:
+            errors.append({"line": line_num, "error": str(e)})
+            if len(errors) >= IMPORT_MAX_ERRORS:
+                return batch, True
+            continue
+
+        if errors:
+            # После первой ошибки только проверяем оставшиеся строки
+            continue
+        batch.append(_to_record(task_data))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            return batch, False
+    return batch, True
+
+
+async def import_tasks(
+    request: Request,
+    fmt: str,
+    db: AsyncSession,
+    current_user: User
+) -> dict:
+    spool = await _spool_body(request)
+    stream = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+
+    # Временная таблица живёт до конца транзакции
+    await db.execute(text(
+        f"CREATE TEMP TABLE {STAGING_TABLE} ("
+        "title TEXT NOT NULL, description TEXT, is_important BOOLEAN NOT NULL, "
+        "is_urgent BOOLEAN NOT NULL, quadrant VARCHAR(2) NOT NULL, "
+        "deadline_at TIMESTAMPTZ"
+        ") ON COMMIT DROP"
+    ))
+    connection = await db.connection()
+    raw_connection = await connection.get_raw_connection()
+    driver_connection = raw_connection.driver_connection
+
+    errors: List[dict] = []
+    total = 0
+    earliest_deadline: Optional[datetime] = None
+    rows = _iter_rows(stream, fmt)
+
+    try:
+        done = False
+        while not done:
+            batch, done = await asyncio.to_thread(_parse_batch, rows, errors)
+            if not batch or errors:
+                continue
+            for record in batch:
+                deadline_at = record[-1]
+                if deadline_at is not None and (earliest_deadline is None or deadline_at < earliest_deadline):
+                    earliest_deadline = deadline_at
+            await driver_connection.copy_records_to_table(
+                STAGING_TABLE, records=batch, columns=STAGING_COLUMNS
+            )
+            total += len(batch)
+    except UnicodeDecodeError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail="Файл должен быть в кодировке UTF-8")
+    finally:
+        stream.close()
+
+    if errors:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"message": "Импорт отменён: найдены некорректные строки", "errors": errors}
+        )
+
+    # Переносим проверенные строки из временной таблицы одной командой.
+    # INSERT ... SELECT минует flush сессии, поэтому переходы "create" для
+    # журнала quadrant_history пишем здесь же, из RETURNING
+    await db.execute(
+        text(
+            f"WITH imported AS ("
+            f"INSERT INTO tasks (title, description, is_important, is_urgent, quadrant, "
+            f"completed, deadline_at, user_id, quadrant_changed_at) "
+            f"SELECT title, description, is_important, is_urgent, quadrant, "
+            f"FALSE, deadline_at, :user_id, now() FROM {STAGING_TABLE} "
+            f"RETURNING id, quadrant, quadrant_changed_at) "
+            f"INSERT INTO task_quadrant_transitions "
+            f"(task_id, user_id, from_quadrant, to_quadrant, changed_at, cause) "
+            f"SELECT id, :user_id, NULL, quadrant, quadrant_changed_at, 'create' FROM imported"
+        ),
+        {"user_id": current_user.id}
+    )
+    await invalidate_rollups(db, current_user.id, earliest_deadline)
+    await db.commit()
+    return {"message": "Импорт завершён", "imported": total}
+
+
+def detect_format(fmt: Optional[str], content_type: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    if content_type and "csv" in content_type:
+        return "csv"
+    return "ndjson"
@@ -0,0 +1,165 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Response
+
+from metrics import metrics
+from models.user import User, UserRole
+
+load_dotenv()
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "30"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "50000"))
+
+# Версия данных, от которой зависят выборки администратора (все задачи)
+ALL_USERS_SCOPE = "all"
+
+
+class CacheBackend:
+    """Хранилище готовых ответов и версий данных пользователей.
+
+    По умолчанию всё хранится в памяти воркера. Для нескольких воркеров
+    нужно общее хранилище (например, Redis) — иначе запись в одном воркере
+    не сбросит кэш в другом.
+    """
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        raise NotImplementedError
+
+    async def get_version(self, scope: str) -> int:
+        raise NotImplementedError
+
+    async def bump_versions(self, scopes: Iterable[str]) -> None:
+        raise NotImplementedError
+
+
+class InMemoryCacheBackend(CacheBackend):
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size_bytes = 0
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._versions: Dict[str, int] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        if len(value) > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self.size_bytes += len(value)
+        # Вытесняем давно не использованные записи (LRU)
+        while self._entries and (
+            self.size_bytes > self.max_bytes or len(self._entries) > self.max_entries
+        ):
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            metrics.inc("result_cache.evicted")
+
+    async def get_version(self, scope: str) -> int:
+        return self._versions.get(scope, 0)
+
+    async def bump_versions(self, scopes: Iterable[str]) -> None:
+        for scope in scopes:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self.size_bytes -= len(value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _user_scope(user_id) -> str:
+    return f"user:{user_id}"
+
+
+class ResultCache:
+    def __init__(self, backend: CacheBackend):
+        self.backend = backend
+
+    async def get_or_set(
+        self,
+        current_user: User,
+        route: str,
+        params: str,
+        producer: Callable[[], Awaitable[bytes]],
+        ttl: float = RESULT_CACHE_TTL
+    ) -> Response:
+        if not RESULT_CACHE_ENABLED:
+            return self._response(await producer())
+
+        # Администратор видит все задачи, поэтому зависит от общей версии
+        scope = ALL_USERS_SCOPE if current_user.role == UserRole.ADMIN else _user_scope(current_user.id)
+        version = await self.backend.get_version(scope)
+        key = f"{current_user.id}:{version}:{route}:{params}"
+
+        body = await self.backend.get(key)
+        if body is not None:
+            metrics.inc("result_cache.hit")
+            return self._response(body)
+
+        metrics.inc("result_cache.miss")
+        body = await producer()
+        await self.backend.set(key, body, ttl)
+        return self._response(body)
+
+    async def invalidate_users(self, user_ids: Iterable[Optional[int]]) -> None:
+        # Любая запись меняет и данные владельца, и общую выборку админа
+        scopes = {_user_scope(user_id) for user_id in user_ids if user_id is not None}
+        scopes.add(ALL_USERS_SCOPE)
+        await self.backend.bump_versions(scopes)
+
+    async def invalidate_user(self, user_id: Optional[int]) -> None:
+        await self.invalidate_users([user_id])
+
+    async def user_version(self, user_id: int) -> int:
+        # Версия данных пользователя; по ней же сверяется рабочий набор task_cache
+        return await self.backend.get_version(_user_scope(user_id))
+
+    def stats(self) -> dict:
+        hits = metrics.get("result_cache.hit")
+        misses = metrics.get("result_cache.miss")
+        total = hits + misses
+        stats = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "evicted": metrics.get("result_cache.evicted"),
+        }
+        if isinstance(self.backend, InMemoryCacheBackend):
+            stats["entries"] = len(self.backend)
+            stats["size_bytes"] = self.backend.size_bytes
+        return stats
+
+    @staticmethod
+    def _response(body: bytes) -> Response:
+        return Response(content=body, media_type="application/json")
+
+
+result_cache = ResultCache(InMemoryCacheBackend())
+
+
+def set_cache_backend(backend: CacheBackend) -> None:
+    result_cache.backend = backend
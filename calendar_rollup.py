@@ -0,0 +1,232 @@
+from datetime import date, datetime, time, timedelta, timezone
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import text, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.rollup import CalendarRollup, CalendarRollupState
+
+QUADRANTS = ("Q1", "Q2", "Q3", "Q4")
+
+# Дневные счётчики дедлайнов и завершений по "сырым" задачам за [start_ts, end_ts)
+_RAW_DAILY_SQL = """
+    SELECT day, quadrant, SUM(deadlines) AS deadlines, SUM(completions) AS completions
+    FROM (
+        SELECT CAST(timezone(:tz, deadline_at) AS date) AS day, quadrant,
+               1 AS deadlines, 0 AS completions
+        FROM tasks
+        WHERE user_id = :user_id AND deadline_at >= :{start} AND deadline_at < :{end}
+        UNION ALL
+        SELECT CAST(timezone(:tz, completed_at) AS date) AS day, quadrant,
+               0 AS deadlines, 1 AS completions
+        FROM tasks
+        WHERE user_id = :user_id AND completed = true
+          AND completed_at >= :{start} AND completed_at < :{end}
+    ) AS raw_events
+    GROUP BY day, quadrant
+"""
+
+_FILL_ROLLUP_SQL = text(
+    "INSERT INTO task_calendar_rollups (user_id, day, quadrant, deadlines, completions) "
+    "SELECT :user_id, day, quadrant, deadlines, completions FROM ("
+    + _RAW_DAILY_SQL.format(start="start_ts", end="end_ts")
+    + ") AS daily "
+    "ON CONFLICT (user_id, day, quadrant) DO UPDATE "
+    "SET deadlines = EXCLUDED.deadlines, completions = EXCLUDED.completions"
+)
+
+# Заполнение и сброс агрегатов одного пользователя выполняются по очереди:
+# рекомендательная блокировка держится до конца транзакции. Первый ключ
+# отделяет эти блокировки от других pg_advisory_lock в приложении.
+_ROLLUP_LOCK_SQL = text("SELECT pg_advisory_xact_lock(:namespace, :user_id)")
+ROLLUP_LOCK_NAMESPACE = 1
+
+# Один запрос: ряд корзин generate_series + закрытые дни из rollup-таблицы
+# + открытые (сегодня и позже) дни по сырым задачам
+_CALENDAR_SQL = text(
+    """
+    WITH buckets AS (
+        SELECT CAST(generate_series(
+            date_trunc(:bucket, CAST(:from_day AS timestamp)),
+            CAST(:to_day AS timestamp),
+            CAST(:step AS interval)
+        ) AS date) AS bucket_start
+    ),
+    daily AS (
+        SELECT day, quadrant, deadlines, completions
+        FROM task_calendar_rollups
+        WHERE user_id = :user_id AND day BETWEEN CAST(:from_day AS date) AND CAST(:closed_to AS date)
+        UNION ALL
+        SELECT day, quadrant, deadlines, completions FROM (
+    """
+    + _RAW_DAILY_SQL.format(start="open_start_ts", end="open_end_ts")
+    + """
+        ) AS open_daily
+    )
+    SELECT b.bucket_start, d.quadrant,
+           COALESCE(SUM(d.deadlines), 0) AS deadlines,
+           COALESCE(SUM(d.completions), 0) AS completions
+    FROM buckets b
+    LEFT JOIN daily d
+        ON CAST(date_trunc(:bucket, CAST(d.day AS timestamp)) AS date) = b.bucket_start
+    GROUP BY b.bucket_start, d.quadrant
+    ORDER BY b.bucket_start
+    """
+)
+
+
+def local_midnight(day: date, tz: ZoneInfo) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=tz)
+
+
+async def _lock_rollups(db: AsyncSession, user_id: int) -> None:
+    await db.execute(_ROLLUP_LOCK_SQL, {"namespace": ROLLUP_LOCK_NAMESPACE, "user_id": user_id})
+
+
+def _rollup_covers(state: Optional[CalendarRollupState], tz_name: str,
+                   from_day: date, closed_to: date) -> bool:
+    return (
+        state is not None
+        and state.timezone == tz_name
+        and state.rolled_from <= from_day
+        and closed_to <= state.rolled_through
+    )
+
+
+async def _ensure_rollup(
+    db: AsyncSession,
+    user_id: int,
+    tz_name: str,
+    from_day: date,
+    closed_to: date
+) -> None:
+    if closed_to < from_day:
+        return
+
+    tz = ZoneInfo(tz_name)
+    state = await db.get(CalendarRollupState, user_id)
+    if _rollup_covers(state, tz_name, from_day, closed_to):
+        return
+
+    # Под блокировкой состояние перечитывается: его мог обновить параллельный
+    # запрос или сбросить запись, закоммиченная, пока мы ждали
+    await _lock_rollups(db, user_id)
+    state = await db.get(CalendarRollupState, user_id, populate_existing=True)
+    if state is not None and state.timezone != tz_name:
+        # Пользователь сменил часовой пояс — старые корзины не подходят
+        await db.execute(delete(CalendarRollup).where(CalendarRollup.user_id == user_id))
+        await db.delete(state)
+        await db.flush()
+        state = None
+
+    if state is None:
+        ranges = [(from_day, closed_to)]
+        state = CalendarRollupState(
+            user_id=user_id, timezone=tz_name, rolled_from=from_day, rolled_through=closed_to
+        )
+        db.add(state)
+    else:
+        ranges = []
+        if from_day < state.rolled_from:
+            ranges.append((from_day, state.rolled_from - timedelta(days=1)))
+            state.rolled_from = from_day
+        if closed_to > state.rolled_through:
+            ranges.append((state.rolled_through + timedelta(days=1), closed_to))
+            state.rolled_through = closed_to
+
+    for first_day, last_day in ranges:
+        await db.execute(_FILL_ROLLUP_SQL, {
+            "user_id": user_id,
+            "tz": tz_name,
+            "start_ts": local_midnight(first_day, tz),
+            "end_ts": local_midnight(last_day + timedelta(days=1), tz),
+        })
+    await db.commit()
+
+
+async def get_calendar(
+    db: AsyncSession,
+    user_id: int,
+    tz_name: str,
+    from_day: date,
+    to_day: date,
+    bucket: str
+) -> List[dict]:
+    tz = ZoneInfo(tz_name)
+    today = datetime.now(tz).date()
+    # Закрытые дни (до вчерашнего включительно) берём из rollup-таблицы
+    closed_to = min(to_day, today - timedelta(days=1))
+    await _ensure_rollup(db, user_id, tz_name, from_day, closed_to)
+
+    open_from = max(from_day, today)
+    result = await db.execute(_CALENDAR_SQL, {
+        "user_id": user_id,
+        "tz": tz_name,
+        "bucket": bucket,
+        "step": timedelta(weeks=1) if bucket == "week" else timedelta(days=1),
+        "from_day": from_day,
+        "to_day": to_day,
+        "closed_to": closed_to,
+        "open_start_ts": local_midnight(open_from, tz),
+        "open_end_ts": local_midnight(to_day + timedelta(days=1), tz),
+    })
+
+    buckets = {}
+    for row in result:
+        item = buckets.setdefault(row.bucket_start, {
+            "start": row.bucket_start,
+            "deadlines": dict.fromkeys(QUADRANTS, 0),
+            "completions": dict.fromkeys(QUADRANTS, 0),
+        })
+        if row.quadrant in QUADRANTS:
+            item["deadlines"][row.quadrant] += int(row.deadlines)
+            item["completions"][row.quadrant] += int(row.completions)
+    return list(buckets.values())
+
+
+async def invalidate_rollups(
+    db: AsyncSession,
+    user_id: Optional[int],
+    *moments: Optional[datetime]
+) -> None:
+    """Сбрасывает закрытые корзины, которые могли измениться.
+
+    Вызывается до commit при изменении задачи с прошедшим дедлайном или
+    датой завершения. Запас в один день покрывает любой часовой пояс.
+    Блокировка агрегатов пользователя держится до commit, поэтому
+    параллельное заполнение увидит уже записанное изменение.
+    """
+    now = datetime.now(timezone.utc)
+    past = []
+    for moment in moments:
+        if moment is None:
+            continue
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        if moment < now:
+            past.append(moment)
+    if user_id is None or not past:
+        return
+
+    cut = min(past).date() - timedelta(days=2)
+    await _lock_rollups(db, user_id)
+    await db.execute(
+        delete(CalendarRollup).where(CalendarRollup.user_id == user_id, CalendarRollup.day > cut)
+    )
+    await db.execute(
+        delete(CalendarRollupState).where(
+            CalendarRollupState.user_id == user_id, CalendarRollupState.rolled_from > cut
+        )
+    )
+    await db.execute(
+        update(CalendarRollupState)
+        .where(CalendarRollupState.user_id == user_id, CalendarRollupState.rolled_through > cut)
+        .values(rolled_through=cut)
+    )
+
+
+async def reset_rollups(db: AsyncSession, user_id: int) -> None:
+    await _lock_rollups(db, user_id)
+    await db.execute(delete(CalendarRollup).where(CalendarRollup.user_id == user_id))
+    await db.execute(delete(CalendarRollupState).where(CalendarRollupState.user_id == user_id))
@@ -1,5 +1,6 @@
 import os
-from typing import AsyncGenerator
+import logging
+from typing import AsyncGenerator, List, Tuple
 from dotenv import load_dotenv
 
 from sqlalchemy.ext.asyncio import (
@@ -7,7 +8,8 @@ from sqlalchemy.ext.asyncio import (
     AsyncSession,
     async_sessionmaker
 )
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import Index, event, text
+from sqlalchemy.orm import DeclarativeBase, Session
 
 try:
     from models import Base, Task
@@ -17,28 +19,138 @@ except ImportError:
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Размер пула соединений (используется и ограничителем конкурентности)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
 engine = create_async_engine(
     DATABASE_URL,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
     connect_args={"statement_cache_size": 0}
 )
 
+# Таймауты SQL-запросов по маршрутам (мс, 0 — без ограничения).
+# Применяются через SET LOCAL, то есть до конца текущей транзакции.
+STATEMENT_TIMEOUT_DEFAULT_MS = int(os.getenv("STATEMENT_TIMEOUT_DEFAULT_MS", "5000"))
+STATEMENT_TIMEOUTS_MS = {
+    "tasks_list": int(os.getenv("STATEMENT_TIMEOUT_TASKS_LIST_MS", "5000")),
+    "tasks_search": int(os.getenv("STATEMENT_TIMEOUT_SEARCH_MS", "2000")),
+    "stats": int(os.getenv("STATEMENT_TIMEOUT_STATS_MS", "5000")),
+    "stats_timing": int(os.getenv("STATEMENT_TIMEOUT_STATS_TIMING_MS", "5000")),
+    "stats_users": int(os.getenv("STATEMENT_TIMEOUT_STATS_USERS_MS", "10000")),
+}
+
+def set_statement_timeout(session: AsyncSession, route: str) -> None:
+    # Таймаут ставится в начале каждой транзакции сессии, отдельного запроса сейчас нет
+    session.info["statement_timeout_ms"] = STATEMENT_TIMEOUTS_MS.get(route, STATEMENT_TIMEOUT_DEFAULT_MS)
+
+@event.listens_for(Session, "after_begin")
+def _apply_statement_timeout(session, transaction, connection):
+    timeout_ms = session.info.get("statement_timeout_ms")
+    if timeout_ms is not None:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+
 AsyncSessionLocal = async_sessionmaker(
     bind=engine,
     autoflush=False,
     expire_on_commit=False
 )
 
-async def init_db():
-    async with engine.begin() as conn:
+# Изменения существующих таблиц, которые create_all не применяет.
+# Каждая команда должна быть идемпотентной и быстрой: долгие миграции
+# (пересоздание внешних ключей, построение индексов) выполняет schema_tools.py.
+SCHEMA_PATCHES = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone VARCHAR(64) NOT NULL DEFAULT 'UTC'",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT true",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS token_epoch INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS token_epoch_changed_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS deletion_requested_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS series_id INTEGER "
+    "REFERENCES task_series(id) ON DELETE SET NULL",
+    # Для существующих задач время входа в квадрант неизвестно: колонка остаётся
+    # NULL, и quadrant_history берёт время создания. Без UPDATE по всей таблице
+    # оба ALTER меняют только каталог; default — для новых строк
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = 'tasks' AND column_name = 'quadrant_changed_at'
+        ) THEN
+            ALTER TABLE tasks ADD COLUMN quadrant_changed_at TIMESTAMP WITH TIME ZONE;
+            ALTER TABLE tasks ALTER COLUMN quadrant_changed_at SET DEFAULT now();
+        END IF;
+    END $$
+    """,
+]
+
+# Внешние ключи на users, которым нужен ON DELETE CASCADE (в базах, созданных
+# до удаления пользователей, они без него) — см. python schema_tools.py cascade-fks
+CASCADE_USER_FKS = [
+    ("tasks", "tasks_user_id_fkey"),
+    ("task_calendar_rollups", "task_calendar_rollups_user_id_fkey"),
+    ("task_calendar_rollup_state", "task_calendar_rollup_state_user_id_fkey"),
+]
+
+async def _warn_missing_cascade(conn) -> None:
+    result = await conn.execute(
+        text("SELECT conname FROM pg_constraint WHERE conname = ANY(:names) AND confdeltype <> 'c'"),
+        {"names": [constraint for _, constraint in CASCADE_USER_FKS]}
+    )
+    missing = result.scalars().all()
+    if missing:
+        logger.warning(
+            "Внешние ключи без ON DELETE CASCADE: удаление пользователей не будет работать. "
+            "Выполните python schema_tools.py cascade-fks",
+            extra={"constraints": missing}
+        )
+
+async def find_missing_indexes(conn) -> List[Tuple[Index, bool]]:
+    # create_all не добавляет новые индексы в уже существующие таблицы.
+    # Возвращает индексы моделей, которых нет в базе или которые остались
+    # невалидными после прерванного CREATE INDEX CONCURRENTLY (второй элемент — True)
+    indexes = {
+        str(index.name): index
+        for table in Base.metadata.sorted_tables
+        for index in table.indexes
+    }
+    result = await conn.execute(
+        text(
+            "SELECT c.relname, i.indisvalid FROM pg_index i "
+            "JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = ANY(:names)"
+        ),
+        {"names": list(indexes)}
+    )
+    valid = dict(result.all())
+    return [(index, name in valid) for name, index in indexes.items() if not valid.get(name)]
+
+async def _warn_missing_indexes(conn) -> None:
+    # Построение индекса на большой таблице блокирует запись, поэтому при запуске
+    # его не делаем — только напоминаем про python schema_tools.py indexes
+    missing = await find_missing_indexes(conn)
+    if missing:
+        logger.warning(
+            "В базе нет индексов моделей. Выполните python schema_tools.py indexes",
+            extra={"indexes": [str(index.name) for index, _ in missing]}
+        )
+
+async def init_db(target_engine=None):
+    async with (target_engine or engine).begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    print("База данных инициализирована!")
+        for patch in SCHEMA_PATCHES:
+            await conn.execute(text(patch))
+        await _warn_missing_indexes(conn)
+        await _warn_missing_cascade(conn)
+    logger.info("База данных инициализирована!")
 
 async def drop_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.drop_all)
-    print("Все таблицы удалены!")
+    logger.info("Все таблицы удалены!")
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with AsyncSessionLocal() as session:
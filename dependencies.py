@@ -1,34 +1,72 @@
+from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from database import get_async_session
 from models.user import User, UserRole
-from auth_utils import decode_access_token
+from auth_utils import decode_access_token, AUTH_STATELESS
+from token_epochs import token_epochs
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v3/auth/login")
 
-async def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: AsyncSession = Depends(get_async_session)
-) -> User:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Неверные учетные данные",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def _access_claims(token: str) -> dict:
     payload = decode_access_token(token)
-    if payload is None:
-        raise credentials_exception
+    # Refresh-токен нельзя использовать вместо access-токена
+    if payload is None or payload.get("type", "access") != "access" or payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+class Principal:
+    """Пользователь, восстановленный из проверенного токена без запроса к БД.
+
+    Содержит только то, что нужно обработчикам задач и статистики;
+    для профиля и смены пароля используется get_current_db_user.
+    """
+
+    __slots__ = ("id", "role", "timezone")
+
+    def __init__(self, id: int, role: UserRole, timezone: str):
+        self.id = id
+        self.role = role
+        self.timezone = timezone
+
+async def get_current_db_user(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_session)
+) -> User:
+    payload = _access_claims(token)
     user_id: Optional[int] = payload.get("sub")
-    if user_id is None:
-        raise credentials_exception
     result = await db.execute(select(User).where(User.id == int(user_id)))
     user = result.scalar_one_or_none()
-    if user is None:
-        raise credentials_exception
+    if user is None or not user.is_active or payload.get("ep", 0) != user.token_epoch:
+        raise _credentials_exception()
     return user
 
+async def get_token_principal(
+    token: str = Depends(oauth2_scheme)
+) -> Principal:
+    payload = _access_claims(token)
+    try:
+        user_id = int(payload["sub"])
+        role = UserRole(payload["role"])
+    except (KeyError, ValueError):
+        raise _credentials_exception()
+    # Отзыв: эпоха в токене сверяется с периодически обновляемой картой в памяти
+    if not token_epochs.is_current(user_id, payload.get("ep", 0)):
+        raise _credentials_exception()
+    return Principal(user_id, role, payload.get("tz", "UTC"))
+
+# В stateless-режиме (AUTH_STATELESS=1) обычные запросы не читают users
+get_current_user = get_token_principal if AUTH_STATELESS else get_current_db_user
+
 async def get_current_admin(
     current_user: User = Depends(get_current_user)
 ) -> User:
@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import os
+import smtplib
+import time
+from datetime import date, datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+from sqlalchemy import select, func, or_, and_, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app_logging import new_correlation_id
+from metrics import metrics
+from models.digest_run import DigestRun
+from models.task import Task
+from models.user import User
+from shards import shard_map
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Выключен по умолчанию: рассылку включают явно там, где настроен outbox
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "0") == "1"
+DIGEST_OUTBOX = os.getenv("DIGEST_OUTBOX", "file")  # file или smtp
+DIGEST_OUTBOX_PATH = os.getenv("DIGEST_OUTBOX_PATH", "digest_outbox.ndjson")
+DIGEST_SMTP_HOST = os.getenv("DIGEST_SMTP_HOST", "localhost")
+DIGEST_SMTP_PORT = int(os.getenv("DIGEST_SMTP_PORT", "1025"))
+DIGEST_SMTP_FROM = os.getenv("DIGEST_SMTP_FROM", "todo@localhost")
+DIGEST_BATCH_SIZE = int(os.getenv("DIGEST_BATCH_SIZE", "1000"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "20"))
+# Сколько задач каждого раздела попадает в письмо
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "20"))
+
+# Задача стала срочной со вчерашнего запуска, если до дедлайна от 3 до 4 дней
+# (см. calculate_urgency: срочно, когда до дедлайна не больше 3 полных дней)
+URGENT_WINDOW = (timedelta(days=3), timedelta(days=4))
+
+# Несколько воркеров (и хостов) запускают планировщик одновременно — рассылку
+# делает тот, кто взял рекомендательную блокировку на основной базе.
+# Пространство ключей отличается от ROLLUP_LOCK_NAMESPACE в calendar_rollup
+DIGEST_LOCK_NAMESPACE = 2
+_DIGEST_TRY_LOCK_SQL = text("SELECT pg_try_advisory_lock(:namespace, 0)")
+_DIGEST_UNLOCK_SQL = text("SELECT pg_advisory_unlock(:namespace, 0)")
+
+
+class DigestOutbox:
+    """Куда отправляются готовые дайджесты."""
+
+    async def send(self, recipient: dict, digest: dict) -> None:
+        raise NotImplementedError
+
+
+class FileOutbox(DigestOutbox):
+    # Одна строка NDJSON на письмо — удобно для тестов и разбора вручную
+    def __init__(self, path: str = DIGEST_OUTBOX_PATH):
+        self.path = path
+        self._lock = asyncio.Lock()
+
+    async def send(self, recipient: dict, digest: dict) -> None:
+        line = json.dumps({"to": recipient["email"], **digest}, ensure_ascii=False, default=str)
+        async with self._lock:
+            await asyncio.to_thread(self._append, line)
+
+    def _append(self, line: str) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class SmtpOutbox(DigestOutbox):
+    # По умолчанию localhost:1025 — локальный отладочный SMTP-сервер вместо настоящего
+    def __init__(self, host: str = DIGEST_SMTP_HOST, port: int = DIGEST_SMTP_PORT,
+                 sender: str = DIGEST_SMTP_FROM):
+        self.host = host
+        self.port = port
+        self.sender = sender
+
+    async def send(self, recipient: dict, digest: dict) -> None:
+        message = EmailMessage()
+        message["From"] = self.sender
+        message["To"] = recipient["email"]
+        message["Subject"] = f"Ваши задачи на {digest['date']}"
+        message.set_content(render_digest(recipient, digest))
+        await asyncio.to_thread(self._send, message)
+
+    def _send(self, message: EmailMessage) -> None:
+        with smtplib.SMTP(self.host, self.port, timeout=10) as smtp:
+            smtp.send_message(message)
+
+
+def _build_outbox() -> DigestOutbox:
+    if DIGEST_OUTBOX == "smtp":
+        return SmtpOutbox()
+    return FileOutbox()
+
+
+digest_outbox = _build_outbox()
+
+
+def set_digest_outbox(outbox: DigestOutbox) -> None:
+    global digest_outbox
+    digest_outbox = outbox
+
+
+def render_digest(recipient: dict, digest: dict) -> str:
+    sections = [
+        ("Важные и срочные (Q1)", digest["q1"]),
+        ("Стали срочными", digest["newly_urgent"]),
+        ("Просрочены", digest["overdue"]),
+    ]
+    lines = [f"Здравствуйте, {recipient['nickname']}!", ""]
+    for caption, items in sections:
+        if not items:
+            continue
+        lines.append(f"{caption}:")
+        for item in items:
+            deadline = f" (до {item['deadline_at']})" if item["deadline_at"] else ""
+            lines.append(f"  • {item['title']}{deadline}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+# ---------- Контрольная точка ----------
+
+# Контрольная точка — строка digest_runs в основной базе: её видят все хосты,
+# а пишет только владелец блокировки рассылки
+
+_CHECKPOINT_FIELDS = ("last_user_id", "users", "sent", "completed")
+
+
+async def _read_checkpoint(conn: AsyncConnection, run_date: date) -> Optional[dict]:
+    result = await conn.execute(
+        select(*[getattr(DigestRun, name) for name in _CHECKPOINT_FIELDS])
+        .where(DigestRun.run_date == run_date)
+    )
+    row = result.first()
+    return {"run_date": run_date, **row._mapping} if row else None
+
+
+async def _write_checkpoint(conn: AsyncConnection, state: dict) -> None:
+    statement = pg_insert(DigestRun).values(**state)
+    await conn.execute(statement.on_conflict_do_update(
+        index_elements=[DigestRun.run_date],
+        set_={
+            **{name: statement.excluded[name] for name in _CHECKPOINT_FIELDS},
+            "updated_at": func.now(),
+        }
+    ))
+    # Каждая пачка фиксируется сразу: после сбоя рассылка продолжится с неё
+    await conn.commit()
+
+
+async def digest_pending(run_date: Optional[date] = None) -> bool:
+    # Есть ли незавершённый (прерванный) запуск за сегодня — на любом хосте
+    run_date = run_date or datetime.now(timezone.utc).date()
+    async with shard_map.primary.engine.connect() as conn:
+        state = await _read_checkpoint(conn, run_date)
+    return bool(state and not state["completed"])
+
+
+async def resume_digest() -> None:
+    # Разовая задача при запуске: продолжает рассылку, прерванную падением процесса
+    if DIGEST_ENABLED and await digest_pending():
+        await run_daily_digest()
+
+
+# ---------- Сборка дайджестов ----------
+
+async def _fetch_digest_rows(shard, user_ids: List[int], now: datetime) -> list:
+    # Один запрос на шард для всей пачки пользователей: открытые задачи Q1,
+    # ставшие срочными и просроченные, не больше DIGEST_MAX_ITEMS на пользователя
+    is_overdue = Task.deadline_at < now
+    is_newly_urgent = and_(
+        Task.deadline_at >= now + URGENT_WINDOW[0],
+        Task.deadline_at < now + URGENT_WINDOW[1]
+    )
+    ranked = (
+        select(
+            Task.user_id, Task.id, Task.title, Task.quadrant, Task.deadline_at,
+            is_overdue.label("is_overdue"),
+            is_newly_urgent.label("is_newly_urgent"),
+            func.row_number().over(
+                partition_by=Task.user_id,
+                order_by=Task.deadline_at.asc().nulls_last()
+            ).label("position")
+        )
+        .where(
+            Task.user_id.in_(user_ids),
+            Task.completed == False,
+            or_(Task.quadrant == "Q1", is_overdue, is_newly_urgent)
+        )
+        .subquery()
+    )
+    async with shard.session() as db:
+        result = await db.execute(
+            select(ranked)
+            .where(ranked.c.position <= 3 * DIGEST_MAX_ITEMS)
+            .order_by(ranked.c.user_id, ranked.c.position)
+        )
+        return result.all()
+
+
+def _build_digests(users: List[dict], rows: list) -> Dict[int, dict]:
+    digests: Dict[int, dict] = {}
+    by_id = {user["id"]: user for user in users}
+    for row in rows:
+        digest = digests.get(row.user_id)
+        if digest is None:
+            user = by_id[row.user_id]
+            local_date = datetime.now(ZoneInfo(user["timezone"])).date()
+            digest = digests[row.user_id] = {
+                "user_id": row.user_id,
+                "date": local_date.isoformat(),
+                "q1": [],
+                "newly_urgent": [],
+                "overdue": [],
+            }
+        item = {"id": row.id, "title": row.title, "deadline_at": row.deadline_at}
+        # Задача может попасть в несколько разделов (например, Q1 и просрочена)
+        for section, matches in (
+            ("q1", row.quadrant == "Q1"),
+            ("newly_urgent", row.is_newly_urgent),
+            ("overdue", row.is_overdue),
+        ):
+            if matches and len(digest[section]) < DIGEST_MAX_ITEMS:
+                digest[section].append(item)
+    return digests
+
+
+async def _process_batch(users: List[dict], now: datetime, semaphore: asyncio.Semaphore) -> int:
+    by_shard: Dict[int, List[int]] = {}
+    for user in users:
+        by_shard.setdefault(shard_map.index_for_user(user["id"]), []).append(user["id"])
+    groups = await asyncio.gather(*(
+        _fetch_digest_rows(shard_map.shards[index], user_ids, now)
+        for index, user_ids in by_shard.items()
+    ))
+    digests = _build_digests(users, [row for rows in groups for row in rows])
+
+    recipients = {user["id"]: user for user in users}
+
+    async def deliver(digest: dict) -> bool:
+        async with semaphore:
+            try:
+                await digest_outbox.send(recipients[digest["user_id"]], digest)
+                return True
+            except Exception:
+                metrics.inc("digest.failed")
+                logger.exception("Не удалось отправить дайджест", extra={"user_id": digest["user_id"]})
+                return False
+
+    delivered = await asyncio.gather(*(deliver(digest) for digest in digests.values()))
+    return sum(delivered)
+
+
+async def _iter_user_batches(after_id: int):
+    # Keyset-пагинация по id: каждая пачка — один индексный запрос без OFFSET
+    last_id = after_id
+    while True:
+        async with shard_map.primary.session() as db:
+            result = await db.execute(
+                select(User.id, User.email, User.nickname, User.timezone)
+                .where(User.id > last_id, User.is_active == True)
+                .order_by(User.id)
+                .limit(DIGEST_BATCH_SIZE)
+            )
+            users = [dict(row._mapping) for row in result]
+        if not users:
+            return
+        yield users
+        last_id = users[-1]["id"]
+
+
+async def run_daily_digest() -> None:
+    if not DIGEST_ENABLED:
+        return
+    new_correlation_id("digest-")
+
+    # Блокировка сессионная: держится на отдельном соединении всё время рассылки
+    # и снимается явно — пул не сбрасывает её при возврате соединения
+    async with shard_map.primary.engine.connect() as conn:
+        locked = await conn.scalar(_DIGEST_TRY_LOCK_SQL, {"namespace": DIGEST_LOCK_NAMESPACE})
+        # Не держим соединение в открытой транзакции, блокировка переживает commit
+        await conn.commit()
+        if not locked:
+            logger.info("Дайджест уже формирует другой процесс")
+            return
+        try:
+            await _run_digest(conn)
+        finally:
+            await conn.execute(_DIGEST_UNLOCK_SQL, {"namespace": DIGEST_LOCK_NAMESPACE})
+            await conn.commit()
+
+
+async def _run_digest(conn: AsyncConnection) -> None:
+    now = datetime.now(timezone.utc)
+    run_date = now.date()
+    state = await _read_checkpoint(conn, run_date)
+    # Соединение держит блокировку всю рассылку — без открытой транзакции
+    await conn.commit()
+    if state is not None:
+        if state["completed"]:
+            logger.info("Дайджест за %s уже отправлен", run_date)
+            return
+        # Продолжаем после сбоя; пачка, на которой он случился, уйдёт повторно
+        logger.info("Продолжение рассылки дайджеста", extra={"after_user_id": state["last_user_id"]})
+    else:
+        state = {"run_date": run_date, "last_user_id": 0, "users": 0, "sent": 0, "completed": False}
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(DIGEST_CONCURRENCY)
+    batches = 0
+    processed = 0  # только в этом запуске, для скорости
+    async for users in _iter_user_batches(state["last_user_id"]):
+        sent = await _process_batch(users, now, semaphore)
+        batches += 1
+        processed += len(users)
+        state["last_user_id"] = users[-1]["id"]
+        state["users"] += len(users)
+        state["sent"] += sent
+        metrics.inc("digest.users", len(users))
+        metrics.inc("digest.sent", sent)
+        await _write_checkpoint(conn, state)
+
+        if batches % 10 == 0:
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "Дайджест: обработано пользователей %s", state["users"],
+                extra={"users": state["users"], "sent": state["sent"],
+                       "users_per_second": round(processed / elapsed, 1) if elapsed else None}
+            )
+
+    state["completed"] = True
+    await _write_checkpoint(conn, state)
+    elapsed = time.perf_counter() - started
+    logger.info(
+        "Дайджест отправлен",
+        extra={
+            "run_date": run_date.isoformat(),
+            "users": state["users"],
+            "sent": state["sent"],
+            "batches": batches,
+            "duration_s": round(elapsed, 2),
+            "users_per_second": round(processed / elapsed, 1) if elapsed else None,
+        }
+    )
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# GET-маршруты, которые пишут в БД (заполнение rollup-таблиц календаря),
+# дорабатывают до конца даже после отключения клиента
+DEFAULT_EXEMPT_PATHS = ("/api/v3/stats/calendar",)
+
+
+class DisconnectCancelMiddleware:
+    """Отменяет обработку GET/HEAD-запроса, если клиент отключился.
+
+    Отмена доходит до ожидающего db.execute: asyncpg отправляет PostgreSQL
+    запрос отмены (CancelRequest), а сессия при выходе из зависимости
+    откатывает транзакцию и возвращает соединение в пул (или сбрасывает его,
+    если оно осталось в неопределённом состоянии). Изменяющие запросы и
+    GET-маршруты из exempt_paths не отменяются, чтобы не оборвать их
+    посреди транзакции.
+    """
+
+    def __init__(self, app, exempt_paths=DEFAULT_EXEMPT_PATHS):
+        self.app = app
+        self.exempt_paths = frozenset(exempt_paths)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] not in ("GET", "HEAD")
+            or scope["path"].rstrip("/") in self.exempt_paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        # У GET нет тела: первое сообщение — пустой http.request,
+        # все следующие вызовы receive() ждут только отключения клиента
+        first_message = await receive()
+        if first_message["type"] == "http.disconnect":
+            return
+
+        disconnected = asyncio.Event()
+        first_delivered = False
+        response_sent = False
+
+        async def wrapped_receive():
+            nonlocal first_delivered
+            if not first_delivered:
+                first_delivered = True
+                return first_message
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def wrapped_send(message):
+            nonlocal response_sent
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_sent = True
+
+        app_task = asyncio.ensure_future(self.app(scope, wrapped_receive, wrapped_send))
+
+        async def watch_disconnect():
+            message = await receive()
+            while message["type"] != "http.disconnect":
+                message = await receive()
+            disconnected.set()
+            # После полного ответа отключение — обычное завершение соединения,
+            # а обработчик лишь освобождает ресурсы (закрывает сессию)
+            if not app_task.done() and not response_sent:
+                app_task.cancel()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            current = asyncio.current_task()
+            if not disconnected.is_set() or (current is not None and current.cancelling()):
+                raise
+            metrics.inc("requests.cancelled_on_disconnect")
+            scope["client_disconnected"] = True
+            logger.info("Клиент отключился, обработка запроса отменена", extra={"path": scope["path"]})
+        finally:
+            watcher.cancel()
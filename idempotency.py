@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, Response, status
+from pydantic import BaseModel
+
+from metrics import metrics
+from models.user import User
+
+load_dotenv()
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 60 * 60)))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000"))
+
+
+@dataclass
+class IdempotencyRecord:
+    fingerprint: str
+    status_code: int
+    body: bytes
+    expires_at: float
+    headers: Optional[Dict[str, str]] = None
+
+
+class IdempotencyStore:
+    """Хранилище сохранённых ответов по ключу идемпотентности.
+
+    Для нескольких воркеров подключается общее хранилище с TTL
+    (например, Redis) через set_idempotency_store().
+    """
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        raise NotImplementedError
+
+    async def put(self, key: str, record: IdempotencyRecord) -> None:
+        raise NotImplementedError
+
+
+class InMemoryIdempotencyStore(IdempotencyStore):
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._records: "OrderedDict[str, IdempotencyRecord]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[IdempotencyRecord]:
+        record = self._records.get(key)
+        if record is not None and record.expires_at < time.time():
+            del self._records[key]
+            return None
+        return record
+
+    async def put(self, key: str, record: IdempotencyRecord) -> None:
+        self._records[key] = record
+        self._records.move_to_end(key)
+        # TTL у всех записей одинаковый, поэтому самые старые — в начале
+        now = time.time()
+        while self._records:
+            oldest_key, oldest = next(iter(self._records.items()))
+            if oldest.expires_at >= now and len(self._records) <= self.max_entries:
+                break
+            del self._records[oldest_key]
+
+
+def request_fingerprint(request: Request, payload: Optional[BaseModel] = None) -> str:
+    body = payload.model_dump_json(exclude_unset=True) if payload is not None else ""
+    raw = f"{request.method} {request.url.path} {body}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class IdempotencyManager:
+    def __init__(self, store: IdempotencyStore):
+        self.store = store
+        # Запросы с ключом, которые выполняются прямо сейчас в этом воркере
+        self._in_flight: Dict[str, asyncio.Future] = {}
+
+    async def run(
+        self,
+        key: Optional[str],
+        current_user: User,
+        fingerprint: str,
+        perform: Callable[[], Awaitable[Any]],
+        serialize: Callable[[Any], bytes],
+        status_code: int = status.HTTP_200_OK
+    ):
+        if not key:
+            return await perform()
+
+        scoped_key = f"{current_user.id}:{key}"
+        while True:
+            record = await self.store.get(scoped_key)
+            if record is not None:
+                return self._replay(record, fingerprint)
+            pending = self._in_flight.get(scoped_key)
+            if pending is None:
+                break
+            # Повтор пришёл, пока оригинал ещё выполняется — ждём его результат
+            metrics.inc("idempotency.waited")
+            await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[scoped_key] = future
+        try:
+            try:
+                result = await perform()
+            except HTTPException as e:
+                # Ошибки клиента (404, 403) воспроизводим так же, как успех
+                if e.status_code < 500:
+                    body = json.dumps({"detail": e.detail}, ensure_ascii=False).encode("utf-8")
+                    await self._save(scoped_key, fingerprint, e.status_code, body, e.headers)
+                raise
+            body = serialize(result)
+            await self._save(scoped_key, fingerprint, status_code, body)
+            return Response(content=body, status_code=status_code, media_type="application/json")
+        finally:
+            del self._in_flight[scoped_key]
+            future.set_result(None)
+
+    async def _save(self, key, fingerprint, status_code, body, headers=None):
+        await self.store.put(key, IdempotencyRecord(
+            fingerprint=fingerprint,
+            status_code=status_code,
+            body=body,
+            expires_at=time.time() + IDEMPOTENCY_TTL,
+            headers=dict(headers) if headers else None,
+        ))
+
+    @staticmethod
+    def _replay(record: IdempotencyRecord, fingerprint: str) -> Response:
+        if record.fingerprint != fingerprint:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail="Ключ Idempotency-Key уже использован с другими параметрами запроса"
+            )
+        metrics.inc("idempotency.replayed")
+        headers = dict(record.headers or {})
+        headers["Idempotent-Replayed"] = "true"
+        return Response(
+            content=record.body,
+            status_code=record.status_code,
+            media_type="application/json",
+            headers=headers
+        )
+
+
+idempotency = IdempotencyManager(InMemoryIdempotencyStore())
+
+
+def set_idempotency_store(store: IdempotencyStore) -> None:
+    idempotency.store = store
@@ -1,27 +1,53 @@
-from fastapi import FastAPI
+import logging
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DBAPIError
 from contextlib import asynccontextmanager
-from database import init_db
+from shards import init_shards
 from routers import tasks, stats, auth
 from scheduler import start_scheduler
+from rate_limit import ConcurrencyLimitMiddleware
+from write_coalescer import write_coalescer
+from app_logging import setup_logging, shutdown_logging, AccessLogMiddleware
+from disconnect import DisconnectCancelMiddleware
+from metrics import metrics
+from auth_utils import AUTH_STATELESS
+from token_epochs import token_epochs
+from user_deletion import resume_deletion_jobs, stop_deletion_jobs
+
+logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Код ДО yield выполняется при ЗАПУСКЕ
-    print("🚀 Запуск приложения...")
-    print("🔄 Инициализация базы данных...")
-    await init_db()
+    # Логи пишутся из очереди отдельным потоком и не блокируют цикл событий
+    setup_logging()
+    logger.info("Запуск приложения...")
+    logger.info("Инициализация базы данных...")
+    await init_shards()
+    if AUTH_STATELESS:
+        # Карта отозванных токенов нужна до первого запроса
+        await token_epochs.refresh()
+    # Удаления пользователей, прерванные прошлой остановкой
+    await resume_deletion_jobs()
 
     # Запускаем планировщик задач
-    print("⏰ Запуск планировщика задач...")
+    logger.info("Запуск планировщика задач...")
     scheduler = start_scheduler()
 
-    print("✅ Приложение готово к работе!")
+    # Групповая запись изменений задач (включается WRITE_COALESCING=1)
+    write_coalescer.start()
+
+    logger.info("Приложение готово к работе!")
     yield  # Здесь приложение работает
 
     # Код ПОСЛЕ yield выполняется при ОСТАНОВКЕ
-    print("🛑 Остановка приложения...")
+    logger.info("Остановка приложения...")
+    await write_coalescer.stop()
+    await stop_deletion_jobs()
     scheduler.shutdown(wait=False)
-    print("👋 Планировщик остановлен.")
+    logger.info("Планировщик остановлен.")
+    shutdown_logging()
 
 app = FastAPI(
     title="ToDo лист API",
@@ -30,6 +56,32 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Отмена чтения (и SQL-запроса) при отключении клиента
+app.add_middleware(DisconnectCancelMiddleware)
+# Глобальное ограничение конкурентности: 503 + Retry-After до исчерпания пула БД
+app.add_middleware(ConcurrencyLimitMiddleware)
+# Correlation id и выборочный access-лог (внешний слой — видит и отказы 503)
+app.add_middleware(AccessLogMiddleware)
+
+# SQLSTATE 57014: запрос отменён сервером по statement_timeout
+QUERY_CANCELED_SQLSTATE = "57014"
+
+@app.exception_handler(DBAPIError)
+async def database_error_handler(request: Request, exc: DBAPIError):
+    if getattr(exc.orig, "sqlstate", None) == QUERY_CANCELED_SQLSTATE:
+        metrics.inc("db.statement_timeouts")
+        logger.warning("Превышен таймаут SQL-запроса", extra={"path": request.url.path})
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Запрос выполнялся слишком долго. Попробуйте сузить выборку"},
+            headers={"Retry-After": "5"}
+        )
+    logger.error("Ошибка базы данных", exc_info=exc, extra={"path": request.url.path})
+    return JSONResponse(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"detail": "Internal Server Error"}
+    )
+
 app.include_router(auth.router, prefix="/api/v3")
 app.include_router(tasks.router, prefix="/api/v3")
 app.include_router(stats.router, prefix="/api/v3")
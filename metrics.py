@@ -0,0 +1,21 @@
+from collections import defaultdict
+from typing import Dict
+
+
+class Metrics:
+    """Простые счётчики внутри процесса (на один воркер)."""
+
+    def __init__(self):
+        self._counters: Dict[str, int] = defaultdict(int)
+
+    def inc(self, name: str, value: int = 1) -> None:
+        self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        return dict(sorted(self._counters.items()))
+
+
+metrics = Metrics()
@@ -1,9 +1,23 @@
 from .user import User, UserRole
 from .task import Task
+from .rollup import CalendarRollup, CalendarRollupState
+from .shard import UserShardOverride
+from .series import TaskSeries
+from .quadrant_history import QuadrantTransition, QuadrantDwell
+from .deleted_user import DeletedUser
+from .digest_run import DigestRun
 
 # Экспортируем для удобного импорта
 __all__ = [
     "User",
     "UserRole", 
     "Task",
+    "CalendarRollup",
+    "CalendarRollupState",
+    "UserShardOverride",
+    "TaskSeries",
+    "QuadrantTransition",
+    "QuadrantDwell",
+    "DeletedUser",
+    "DigestRun",
 ]
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sqlalchemy import Integer, DateTime
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from database import Base
+
+class DeletedUser(Base):
+    # Недавно удалённые пользователи: их access-токены ещё не истекли, и
+    # stateless-проверка (token_epochs) должна отклонять их во всех воркерах.
+    # Строки старше срока жизни access-токена удаляются при следующем удалении.
+    __tablename__ = "deleted_users"
+
+    user_id = mapped_column(Integer, primary_key=True)
+    deleted_at = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+    def __repr__(self) -> str:
+        return f"<DeletedUser(user_id={self.user_id})>"
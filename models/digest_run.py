@@ -0,0 +1,20 @@
+from sqlalchemy import Boolean, Date, DateTime, Integer
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from database import Base
+
+class DigestRun(Base):
+    # Контрольная точка ежедневной рассылки дайджеста, одна строка на день.
+    # Хранится в основной базе (шард 0) и пишется под блокировкой рассылки, поэтому
+    # прерванную рассылку продолжит любой хост, а завершённую не повторит никто.
+    __tablename__ = "digest_runs"
+
+    run_date = mapped_column(Date, primary_key=True)
+    last_user_id = mapped_column(Integer, nullable=False, default=0)
+    users = mapped_column(Integer, nullable=False, default=0)
+    sent = mapped_column(Integer, nullable=False, default=0)
+    completed = mapped_column(Boolean, nullable=False, default=False)
+    updated_at = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<DigestRun(run_date={self.run_date}, completed={self.completed})>"
@@ -0,0 +1,38 @@
+from sqlalchemy import BigInteger, Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy.orm import mapped_column
+from database import Base
+
+class QuadrantTransition(Base):
+    # Журнал переходов задач между квадрантами (только дописывается).
+    # from_quadrant пуст при создании/возобновлении, to_quadrant — при завершении/удалении.
+    __tablename__ = "task_quadrant_transitions"
+    __table_args__ = (
+        Index("ix_task_quadrant_transitions_task", "task_id", "changed_at"),
+    )
+
+    id = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # Без внешнего ключа на tasks: история остаётся после удаления задачи
+    task_id = mapped_column(Integer, nullable=False)
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    from_quadrant = mapped_column(String(2), nullable=True)
+    to_quadrant = mapped_column(String(2), nullable=True)
+    changed_at = mapped_column(DateTime(timezone=True), nullable=False)
+    # create, update, urgency, complete, reopen, delete
+    cause = mapped_column(String(16), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<QuadrantTransition(task_id={self.task_id}, {self.from_quadrant}->{self.to_quadrant})>"
+
+class QuadrantDwell(Base):
+    # Накопительные агрегаты: сколько раз задачи покидали квадрант и сколько в нём пробыли.
+    # exit_to — квадрант назначения, completed или deleted.
+    __tablename__ = "task_quadrant_dwell"
+
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    quadrant = mapped_column(String(2), primary_key=True)
+    exit_to = mapped_column(String(9), primary_key=True)
+    transitions = mapped_column(Integer, nullable=False, default=0)
+    dwell_seconds = mapped_column(Float, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<QuadrantDwell(user_id={self.user_id}, {self.quadrant}->{self.exit_to})>"
@@ -0,0 +1,28 @@
+from sqlalchemy import Integer, String, Date, ForeignKey
+from sqlalchemy.orm import mapped_column
+from database import Base
+
+class CalendarRollup(Base):
+    # Дневные агрегаты по закрытым (прошедшим) дням в часовом поясе пользователя
+    __tablename__ = "task_calendar_rollups"
+
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = mapped_column(Date, primary_key=True)
+    quadrant = mapped_column(String(2), primary_key=True)
+    deadlines = mapped_column(Integer, nullable=False, default=0)
+    completions = mapped_column(Integer, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"<CalendarRollup(user_id={self.user_id}, day={self.day}, quadrant='{self.quadrant}')>"
+
+class CalendarRollupState(Base):
+    # Непрерывный диапазон дней, уже посчитанных в task_calendar_rollups
+    __tablename__ = "task_calendar_rollup_state"
+
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    timezone = mapped_column(String(64), nullable=False)
+    rolled_from = mapped_column(Date, nullable=False)
+    rolled_through = mapped_column(Date, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<CalendarRollupState(user_id={self.user_id}, {self.rolled_from}..{self.rolled_through})>"
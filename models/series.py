@@ -0,0 +1,27 @@
+from sqlalchemy import Integer, String, Boolean, DateTime, Text, ForeignKey, true
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from database import Base
+
+class TaskSeries(Base):
+    # Шаблон повторяющейся задачи: в tasks хранится только текущий повтор,
+    # следующий создаётся при его завершении
+    __tablename__ = "task_series"
+
+    id = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    title = mapped_column(Text, nullable=False)
+    description = mapped_column(Text, nullable=True)
+    is_important = mapped_column(Boolean, nullable=False, default=False)
+    rrule = mapped_column(String(255), nullable=False)
+    dtstart = mapped_column(DateTime(timezone=True), nullable=False)
+    # Часовой пояс, в котором считаются повторы (копия users.timezone на момент создания)
+    timezone = mapped_column(String(64), nullable=False, default="UTC")
+    # Дедлайн последнего созданного повтора
+    last_occurrence_at = mapped_column(DateTime(timezone=True), nullable=True)
+    # False, когда правило исчерпано (COUNT/UNTIL)
+    active = mapped_column(Boolean, nullable=False, default=True, server_default=true())
+    created_at = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<TaskSeries(id={self.id}, title='{self.title}', rrule='{self.rrule}')>"
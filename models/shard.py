@@ -0,0 +1,16 @@
+from sqlalchemy import Integer, DateTime
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.sql import func
+from database import Base
+
+class UserShardOverride(Base):
+    # Пользователи, перенесённые на шард, отличный от вычисленного по user_id.
+    # Таблица читается только из основной базы (шард 0).
+    __tablename__ = "user_shard_overrides"
+
+    user_id = mapped_column(Integer, primary_key=True)
+    shard = mapped_column(Integer, nullable=False)
+    moved_at = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<UserShardOverride(user_id={self.user_id}, shard={self.shard})>"
@@ -1,10 +1,18 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, Index, text
 from sqlalchemy.orm import relationship, mapped_column
 from sqlalchemy.sql import func
 from database import Base
 
 class Task(Base):
     __tablename__ = "tasks"
+    __table_args__ = (
+        # Частичные индексы открытых задач в порядке приоритета (квадрант, дедлайн)
+        # для /tasks/next: ORDER BY quadrant, deadline_at LIMIT k
+        Index("ix_tasks_open_user_next", "user_id", "quadrant", "deadline_at",
+              postgresql_where=text("completed = false")),
+        Index("ix_tasks_open_next", "quadrant", "deadline_at",
+              postgresql_where=text("completed = false")),
+    )
     
     id = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
     title = mapped_column(Text, nullable=False)
@@ -16,8 +24,14 @@ class Task(Base):
     created_at = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=False)
     completed_at = mapped_column(DateTime(timezone=True), nullable=True)
     deadline_at = mapped_column(DateTime(timezone=True), nullable=True)
+    # С какого момента задача находится в текущем квадранте (см. quadrant_history.py)
+    quadrant_changed_at = mapped_column(DateTime(timezone=True), server_default=func.now(), nullable=True)
     
-    user_id = mapped_column(Integer, ForeignKey("users.id"), nullable=True)
+    user_id = mapped_column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
+    # Повтор серии (task_series); после удаления серии задача остаётся обычной
+    series_id = mapped_column(
+        Integer, ForeignKey("task_series.id", ondelete="SET NULL"), nullable=True, index=True
+    )
     owner = relationship("User", back_populates="tasks")
     
     # Конструктор не нужен при использовании mapped_column с default
@@ -37,5 +51,6 @@ class Task(Base):
             "created_at": self.created_at,
             "completed_at": self.completed_at,
             "deadline_at": self.deadline_at,
-            "user_id": self.user_id
+            "user_id": self.user_id,
+            "series_id": self.series_id
         }
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Enum as SQLEnum, true, text
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -15,11 +15,21 @@ class User(Base):
     email = Column(String(100), unique=True, nullable=False, index=True)
     hashed_password = Column(String(255), nullable=False)
     role = Column(SQLEnum(UserRole), nullable=False, default=UserRole.USER)
+    timezone = Column(String(64), nullable=False, default="UTC", server_default="UTC")
+    is_active = Column(Boolean, nullable=False, default=True, server_default=true())
+    # Увеличивается при смене пароля, роли и деактивации — старые токены отзываются
+    token_epoch = Column(Integer, nullable=False, default=0, server_default=text("0"))
+    # Когда эпоха менялась в последний раз: воркеры перечитывают только недавние изменения
+    token_epoch_changed_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    # Удаление запрошено, но ещё не завершено (задачи удаляются в фоне порциями)
+    deletion_requested_at = Column(DateTime(timezone=True), nullable=True)
 
     tasks = relationship(
         "Task",
         back_populates="owner",
-        cascade="all, delete-orphan"
+        cascade="all, delete-orphan",
+        # Задачи удаляет сама БД (ON DELETE CASCADE), ORM не загружает их перед удалением
+        passive_deletes=True
     )
 
     def __repr__(self) -> str:
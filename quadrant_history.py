@@ -0,0 +1,176 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, inspect, insert, select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from models.quadrant_history import QuadrantTransition, QuadrantDwell
+from models.task import Task
+
+# Переходы собираются из изменённых задач перед flush и пишутся одной пачкой
+# после него, вместе с приращениями агрегатов, — в той же транзакции, что и
+# сами изменения. Так журнал пополняют все пути записи: обработчики,
+# пакетная запись (write_coalescer), повторы серий и планировщик.
+
+_PENDING_KEY = "quadrant_transitions"
+_CAUSE_KEY = "quadrant_cause"
+
+EXIT_COMPLETED = "completed"
+EXIT_DELETED = "deleted"
+
+
+def set_transition_cause(db: AsyncSession, cause: str) -> None:
+    # Причина смены квадранта для всех задач этой сессии (по умолчанию update)
+    db.info[_CAUSE_KEY] = cause
+
+
+def _old_value(task: Task, attribute: str):
+    history = inspect(task).attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+
+def _entered_at(task: Task) -> Optional[datetime]:
+    # У задач, созданных до появления журнала, quadrant_changed_at пуст — считаем
+    # от создания (так не нужен UPDATE всей таблицы при миграции)
+    return task.quadrant_changed_at or task.created_at
+
+
+def _changed(task: Task, attribute: str) -> bool:
+    history = inspect(task).attrs[attribute].history
+    return bool(history.added) and history.added[0] != _old_value(task, attribute)
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_transitions(session, flush_context, instances):
+    now = datetime.now(timezone.utc)
+    cause = session.info.get(_CAUSE_KEY, "update")
+    pending = session.info.setdefault(_PENDING_KEY, [])
+
+    for obj in session.new:
+        if isinstance(obj, Task) and obj.user_id is not None and not obj.completed:
+            obj.quadrant_changed_at = now
+            pending.append((obj, None, obj.quadrant, None, "create", now))
+
+    for obj in session.dirty:
+        if not isinstance(obj, Task) or obj.user_id is None:
+            continue
+        entered_at = _entered_at(obj)
+        was_completed = _old_value(obj, "completed")
+        old_quadrant = _old_value(obj, "quadrant")
+
+        if was_completed and not obj.completed:
+            obj.quadrant_changed_at = now
+            pending.append((obj, None, obj.quadrant, None, "reopen", now))
+        elif not was_completed and _changed(obj, "quadrant"):
+            # Пока задача открыта, время в прежнем квадранте идёт в агрегаты
+            pending.append((obj, old_quadrant, obj.quadrant, entered_at, cause, now))
+            entered_at = obj.quadrant_changed_at = now
+        if not was_completed and obj.completed:
+            pending.append((obj, obj.quadrant, None, entered_at, "complete", now))
+
+    for obj in session.deleted:
+        if isinstance(obj, Task) and obj.user_id is not None and not obj.completed:
+            pending.append((obj, obj.quadrant, None, _entered_at(obj), "delete", now))
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _write_transitions(session, flush_context):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+
+    rows = []
+    dwell: Dict[tuple, List[float]] = {}
+    for task, from_quadrant, to_quadrant, entered_at, cause, changed_at in pending:
+        # id новых задач известен только после flush
+        rows.append({
+            "task_id": task.id,
+            "user_id": task.user_id,
+            "from_quadrant": from_quadrant,
+            "to_quadrant": to_quadrant,
+            "changed_at": changed_at,
+            "cause": cause,
+        })
+        if from_quadrant is None or entered_at is None:
+            continue
+        exit_to = to_quadrant or (EXIT_DELETED if cause == "delete" else EXIT_COMPLETED)
+        totals = dwell.setdefault((task.user_id, from_quadrant, exit_to), [0, 0.0])
+        totals[0] += 1
+        totals[1] += max((changed_at - entered_at).total_seconds(), 0.0)
+
+    dwell_table = QuadrantDwell.__table__
+    connection = session.connection()
+    connection.execute(insert(QuadrantTransition.__table__), rows)
+    if dwell:
+        statement = pg_insert(dwell_table).values([
+            {
+                "user_id": user_id,
+                "quadrant": quadrant,
+                "exit_to": exit_to,
+                "transitions": count,
+                "dwell_seconds": seconds,
+            }
+            for (user_id, quadrant, exit_to), (count, seconds) in dwell.items()
+        ])
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[dwell_table.c.user_id, dwell_table.c.quadrant, dwell_table.c.exit_to],
+            set_={
+                "transitions": dwell_table.c.transitions + statement.excluded.transitions,
+                "dwell_seconds": dwell_table.c.dwell_seconds + statement.excluded.dwell_seconds,
+            }
+        ))
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_transitions(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+async def fetch_dwell_rows(db: AsyncSession, user_id: Optional[int] = None) -> list:
+    statement = select(
+        QuadrantDwell.quadrant,
+        QuadrantDwell.exit_to,
+        func.sum(QuadrantDwell.transitions).label("transitions"),
+        func.sum(QuadrantDwell.dwell_seconds).label("dwell_seconds")
+    ).group_by(QuadrantDwell.quadrant, QuadrantDwell.exit_to)
+    if user_id is not None:
+        statement = statement.where(QuadrantDwell.user_id == user_id)
+    result = await db.execute(statement)
+    return result.all()
+
+
+def summarize_dwell(rows: list) -> List[dict]:
+    # Строки могут прийти с нескольких шардов — складываем по (quadrant, exit_to)
+    quadrants: Dict[str, dict] = {}
+    for row in rows:
+        entry = quadrants.setdefault(row.quadrant, {"exits": 0, "dwell_seconds": 0.0, "exits_to": {}})
+        entry["exits"] += row.transitions
+        entry["dwell_seconds"] += row.dwell_seconds
+        target = entry["exits_to"].setdefault(row.exit_to, {"count": 0, "dwell_seconds": 0.0})
+        target["count"] += row.transitions
+        target["dwell_seconds"] += row.dwell_seconds
+
+    def hours(seconds: float, count: int) -> Optional[float]:
+        return round(seconds / count / 3600, 2) if count else None
+
+    return [
+        {
+            "quadrant": quadrant,
+            "exits": entry["exits"],
+            "avg_dwell_hours": hours(entry["dwell_seconds"], entry["exits"]),
+            "exits_to": {
+                exit_to: {
+                    "count": target["count"],
+                    "avg_dwell_hours": hours(target["dwell_seconds"], target["count"]),
+                }
+                for exit_to, target in sorted(entry["exits_to"].items())
+            },
+        }
+        for quadrant, entry in sorted(quadrants.items())
+    ]
@@ -0,0 +1,159 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, status
+
+from database import DB_POOL_SIZE, DB_MAX_OVERFLOW
+from dependencies import get_current_user
+from metrics import metrics
+from models.user import User
+
+load_dotenv()
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") == "1"
+
+# Бюджеты токенов: скорость пополнения (токенов в секунду) и размер "ведра"
+CHEAP_RATE = float(os.getenv("RATE_LIMIT_CHEAP_RATE", "10"))
+CHEAP_BURST = float(os.getenv("RATE_LIMIT_CHEAP_BURST", "40"))
+EXPENSIVE_RATE = float(os.getenv("RATE_LIMIT_EXPENSIVE_RATE", "1"))
+EXPENSIVE_BURST = float(os.getenv("RATE_LIMIT_EXPENSIVE_BURST", "5"))
+
+# Глобальный лимит одновременных запросов (по умолчанию = ёмкость пула БД)
+MAX_CONCURRENT_REQUESTS = int(
+    os.getenv("MAX_CONCURRENT_REQUESTS", str(DB_POOL_SIZE + DB_MAX_OVERFLOW))
+)
+CONCURRENCY_QUEUE_TIMEOUT = float(os.getenv("CONCURRENCY_QUEUE_TIMEOUT", "0.5"))
+
+
+class RateLimitBackend:
+    """Хранилище счётчиков token bucket.
+
+    Для нескольких воркеров можно подключить общее хранилище (например, Redis),
+    реализовав метод take() и передав его в set_rate_limit_backend().
+    """
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Списывает cost токенов. Возвращает 0, если запрос разрешён,
+        иначе — сколько секунд подождать до появления токенов."""
+        raise NotImplementedError
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+        if tokens >= cost:
+            tokens -= cost
+            retry_after = 0.0
+        else:
+            retry_after = (cost - tokens) / rate if rate > 0 else float(capacity)
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        # Вытесняем самые давно неиспользуемые "вёдра"
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+_backend: RateLimitBackend = InMemoryRateLimitBackend()
+
+
+def set_rate_limit_backend(backend: RateLimitBackend) -> None:
+    global _backend
+    _backend = backend
+
+
+async def _check_budget(scope: str, user: User, rate: float, capacity: float) -> None:
+    if not RATE_LIMIT_ENABLED:
+        return
+    retry_after = await _backend.take(f"{scope}:{user.id}", rate, capacity)
+    if retry_after > 0:
+        metrics.inc(f"rate_limit.rejected.{scope}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Слишком много запросов. Повторите попытку позже",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+async def limit_cheap(current_user: User = Depends(get_current_user)) -> None:
+    # Дешёвые запросы: одна задача, фильтры с индексом
+    await _check_budget("cheap", current_user, CHEAP_RATE, CHEAP_BURST)
+
+
+async def limit_expensive(current_user: User = Depends(get_current_user)) -> None:
+    # Дорогие запросы: полные списки, поиск, статистика
+    await _check_budget("expensive", current_user, EXPENSIVE_RATE, EXPENSIVE_BURST)
+
+
+class ConcurrencyLimitMiddleware:
+    """Ограничивает число одновременно обрабатываемых запросов.
+
+    Лишние запросы ждут не дольше queue_timeout, а затем получают 503 с
+    Retry-After — до того, как закончатся соединения в пуле БД.
+    """
+
+    def __init__(self, app, limit: int = MAX_CONCURRENT_REQUESTS,
+                 queue_timeout: float = CONCURRENCY_QUEUE_TIMEOUT):
+        self.app = app
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.limit <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+
+        # Очередь ожидания не больше самого лимита — остальное сразу отбрасываем
+        if self._semaphore.locked() and self._waiting >= self.limit:
+            await self._reject(send)
+            return
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            await self._reject(send)
+            return
+        finally:
+            self._waiting -= 1
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._semaphore.release()
+
+    async def _reject(self, send):
+        metrics.inc("concurrency.rejected")
+        body = json.dumps(
+            {"detail": "Сервер перегружен. Повторите попытку позже"},
+            ensure_ascii=False,
+        ).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_503_SERVICE_UNAVAILABLE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", b"1"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
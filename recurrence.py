@@ -0,0 +1,172 @@
+import calendar
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+# Поддерживаемое подмножество RRULE (RFC 5545):
+#   FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL=n, BYDAY=MO,TU,... (только WEEKLY),
+#   COUNT=n или UNTIL=YYYYMMDD[THHMMSSZ]
+# Повторы считаются по местному времени пользователя, поэтому "каждый день в 09:00"
+# остаётся 09:00 и после перехода на летнее/зимнее время.
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+# Верхние границы: больший INTERVAL уводит повторы за datetime.max (год 9999),
+# а COUNT перебирается с начала серии при каждом расчёте следующего повтора
+MAX_INTERVAL = 1000
+MAX_COUNT = 10000
+
+
+def _parse_until(value: str) -> datetime:
+    try:
+        if "T" in value:
+            return datetime.strptime(value.rstrip("Z"), "%Y%m%dT%H%M%S").replace(tzinfo=timezone.utc)
+        # Дата без времени включает весь день
+        day = datetime.strptime(value, "%Y%m%d")
+        return day.replace(hour=23, minute=59, second=59, tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError(f"Неверный UNTIL: {value}")
+
+
+def _as_utc(moment: datetime) -> datetime:
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+@dataclass(frozen=True)
+class RecurrenceRule:
+    freq: str
+    interval: int = 1
+    by_day: Tuple[int, ...] = ()
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+
+    @classmethod
+    def parse(cls, value: str) -> "RecurrenceRule":
+        parts = {}
+        for part in value.strip().upper().removeprefix("RRULE:").split(";"):
+            if not part:
+                continue
+            name, sep, part_value = part.partition("=")
+            if not sep or not part_value:
+                raise ValueError(f"Неверная часть правила: {part}")
+            parts[name] = part_value
+
+        unknown = parts.keys() - {"FREQ", "INTERVAL", "BYDAY", "COUNT", "UNTIL"}
+        if unknown:
+            raise ValueError(f"Неподдерживаемые части правила: {', '.join(sorted(unknown))}")
+
+        freq = parts.get("FREQ")
+        if freq not in FREQUENCIES:
+            raise ValueError("FREQ должен быть DAILY, WEEKLY или MONTHLY")
+
+        try:
+            interval = int(parts.get("INTERVAL", "1"))
+            count = int(parts["COUNT"]) if "COUNT" in parts else None
+        except ValueError:
+            raise ValueError("INTERVAL и COUNT должны быть целыми числами")
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError("INTERVAL и COUNT должны быть положительными")
+        if interval > MAX_INTERVAL or (count is not None and count > MAX_COUNT):
+            raise ValueError(f"INTERVAL не больше {MAX_INTERVAL}, COUNT не больше {MAX_COUNT}")
+
+        if "COUNT" in parts and "UNTIL" in parts:
+            raise ValueError("COUNT и UNTIL нельзя указывать вместе")
+        until = _parse_until(parts["UNTIL"]) if "UNTIL" in parts else None
+
+        by_day: Tuple[int, ...] = ()
+        if "BYDAY" in parts:
+            if freq != "WEEKLY":
+                raise ValueError("BYDAY поддерживается только для FREQ=WEEKLY")
+            try:
+                by_day = tuple(sorted({WEEKDAYS.index(day) for day in parts["BYDAY"].split(",")}))
+            except ValueError:
+                raise ValueError("BYDAY: используйте MO, TU, WE, TH, FR, SA, SU")
+
+        return cls(freq=freq, interval=interval, by_day=by_day, count=count, until=until)
+
+    def _period_candidates(self, local_start: datetime, period: int) -> List[datetime]:
+        # Кандидаты одного периода (день, неделя или месяц) в местном времени
+        if self.freq == "DAILY":
+            return [local_start + timedelta(days=period * self.interval)]
+        if self.freq == "WEEKLY":
+            week_start = local_start - timedelta(days=local_start.weekday())
+            week_start += timedelta(weeks=period * self.interval)
+            days = self.by_day or (local_start.weekday(),)
+            return [week_start + timedelta(days=day) for day in days]
+        month_index = local_start.month - 1 + period * self.interval
+        year, month = local_start.year + month_index // 12, month_index % 12 + 1
+        # Как в RFC 5545: месяцы без такого числа (31-е, 30 февраля) пропускаются
+        if local_start.day > calendar.monthrange(year, month)[1]:
+            return []
+        return [local_start.replace(year=year, month=month)]
+
+    def _skip_periods(self, local_start: datetime, local_from: datetime) -> int:
+        # Сколько периодов целиком лежат до local_from (с запасом в один)
+        if local_from <= local_start:
+            return 0
+        if self.freq == "DAILY":
+            periods = (local_from - local_start).days // self.interval
+        elif self.freq == "WEEKLY":
+            periods = (local_from - local_start).days // (7 * self.interval)
+        else:
+            months = (local_from.year - local_start.year) * 12 + local_from.month - local_start.month
+            periods = months // self.interval
+        return max(periods - 1, 0)
+
+    def occurrences(self, dtstart: datetime, tz: ZoneInfo,
+                    start: Optional[datetime] = None) -> Iterator[datetime]:
+        """Повторы в UTC по возрастанию, не раньше start.
+
+        Без COUNT и UNTIL последовательность бесконечна — вызывающий сам
+        прекращает перебор.
+        """
+        local_start = _as_utc(dtstart).astimezone(tz).replace(tzinfo=None)
+        start = _as_utc(start) if start is not None else None
+        period = 0
+        if start is not None and self.count is None:
+            # Для COUNT нужен номер повтора, поэтому пропускать периоды нельзя
+            period = self._skip_periods(local_start, start.astimezone(tz).replace(tzinfo=None))
+
+        emitted = 0
+        while True:
+            try:
+                candidates = [
+                    (local, local.replace(tzinfo=tz).astimezone(timezone.utc))
+                    for local in self._period_candidates(local_start, period)
+                ]
+            except (OverflowError, ValueError):
+                # Повторы дошли до границы datetime — серия исчерпана
+                return
+            for local, moment in candidates:
+                if local < local_start:
+                    continue
+                if self.until is not None and moment > self.until:
+                    return
+                if self.count is not None and emitted >= self.count:
+                    return
+                emitted += 1
+                if start is None or moment >= start:
+                    yield moment
+            period += 1
+
+    def next_after(self, dtstart: datetime, tz: ZoneInfo,
+                   moment: Optional[datetime]) -> Optional[datetime]:
+        # Первый повтор строго после moment (или самый первый, если moment не задан)
+        for occurrence in self.occurrences(dtstart, tz, moment):
+            if moment is None or occurrence > _as_utc(moment):
+                return occurrence
+        return None
+
+    def between(self, dtstart: datetime, tz: ZoneInfo, start: datetime,
+                end: datetime, limit: int) -> List[datetime]:
+        # Повторы в [start, end), не больше limit штук
+        result = []
+        end = _as_utc(end)
+        for occurrence in self.occurrences(dtstart, tz, start):
+            if occurrence >= end or len(result) >= limit:
+                break
+            result.append(occurrence)
+        return result
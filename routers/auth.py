@@ -1,13 +1,27 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from database import get_async_session
 from models.user import User, UserRole
-from schemas_auth import UserCreate, UserResponse, Token, ChangePasswordRequest, AdminUserResponse
-from auth_utils import verify_password, get_password_hash, create_access_token
-from dependencies import get_current_user, get_current_admin
+from schemas_auth import (
+    UserCreate, UserResponse, Token, ChangePasswordRequest, AdminUserResponse, TimezoneUpdateRequest,
+    TimezoneUpdateResponse, RefreshRequest, RoleUpdateRequest
+)
+from auth_utils import verify_password, get_password_hash, create_token_pair, decode_access_token
+from dependencies import get_current_db_user, get_current_admin
+from token_epochs import token_epochs, bump_token_epoch
 from models.task import Task
+from shards import ensure_user_on_shard, count_tasks_by_user
+from cache import result_cache
+from user_deletion import (
+    DeletionJob, deletion_jobs, count_user_tasks, delete_user_rows, start_deletion_job,
+    USER_DELETE_SYNC_LIMIT
+)
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
@@ -39,6 +53,7 @@ async def register(
     db.add(new_user)
     await db.commit()
     await db.refresh(new_user)
+    await ensure_user_on_shard(new_user)
     return new_user
 
 @router.post("/login", response_model=Token)
@@ -48,27 +63,43 @@ async def login(
 ):
     result = await db.execute(select(User).where(User.email == form_data.username))
     user = result.scalar_one_or_none()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    if not user or not user.is_active or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный email или пароль",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(
-        data={"sub": str(user.id), "role": user.role.value}
+    return create_token_pair(user)
+
+@router.post("/refresh", response_model=Token)
+async def refresh_tokens(
+    data: RefreshRequest,
+    db: AsyncSession = Depends(get_async_session)
+):
+    # Единственная точка, где токен сверяется с БД: раз в срок жизни access-токена
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Недействительный refresh-токен",
+        headers={"WWW-Authenticate": "Bearer"},
     )
-    return {"access_token": access_token, "token_type": "bearer"}
+    payload = decode_access_token(data.refresh_token)
+    if payload is None or payload.get("type") != "refresh" or payload.get("sub") is None:
+        raise credentials_exception
+    user = await db.get(User, int(payload["sub"]))
+    if user is None or not user.is_active or payload.get("ep", 0) != user.token_epoch:
+        raise credentials_exception
+    return create_token_pair(user)
 
 @router.get("/me", response_model=UserResponse)
 async def get_me(
-    current_user: User = Depends(get_current_user)
+    current_user: User = Depends(get_current_db_user)
 ):
     return current_user
 
 @router.patch("/change-password", status_code=status.HTTP_200_OK)
 async def change_password(
     passwords: ChangePasswordRequest,
-    current_user: User = Depends(get_current_user),
+    current_user: User = Depends(get_current_db_user),
     db: AsyncSession = Depends(get_async_session)
 ):
     if not verify_password(passwords.old_password, current_user.hashed_password):
@@ -77,20 +108,44 @@ async def change_password(
             detail="Старый пароль неверен"
         )
     current_user.hashed_password = get_password_hash(passwords.new_password)
+    # Все выданные ранее токены (в том числе этот) перестают действовать
+    bump_token_epoch(current_user)
     await db.commit()
+    token_epochs.remember(current_user)
     return {"message": "Пароль успешно изменён"}
 
+@router.patch("/timezone", response_model=TimezoneUpdateResponse)
+async def change_timezone(
+    data: TimezoneUpdateRequest,
+    current_user: User = Depends(get_current_db_user),
+    db: AsyncSession = Depends(get_async_session)
+):
+    try:
+        ZoneInfo(data.timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Неизвестный часовой пояс"
+        )
+    current_user.timezone = data.timezone
+    await db.commit()
+    # Старый access-токен несёт прежний пояс; клиент сразу переходит на новую пару,
+    # чтобы запросы со старым и новым поясом не перестраивали агрегаты календаря
+    return {
+        **UserResponse.model_validate(current_user).model_dump(),
+        **create_token_pair(current_user),
+    }
+
 # Эндпоинт для администраторов
 @router.get("/admin/users", response_model=list[AdminUserResponse])
 async def get_all_users(
     db: AsyncSession = Depends(get_async_session),
     admin_user: User = Depends(get_current_admin)
 ):
-    from sqlalchemy.orm import joinedload
-    result = await db.execute(
-        select(User).options(joinedload(User.tasks))
-    )
-    users = result.unique().scalars().all()
+    # Задачи лежат на шардах — считаем их там, не загружая сами строки
+    result = await db.execute(select(User).order_by(User.id))
+    users = result.scalars().all()
+    task_counts = await count_tasks_by_user()
     response = []
     for user in users:
         response.append(
@@ -99,7 +154,107 @@ async def get_all_users(
                 nickname=user.nickname,
                 email=user.email,
                 role=user.role.value,
-                task_count=len(user.tasks)
+                task_count=task_counts.get(user.id, 0),
+                is_active=user.is_active
             )
         )
-    return response
\ No newline at end of file
+    return response
+
+async def _get_managed_user(user_id: int, admin_user: User, db: AsyncSession) -> User:
+    if user_id == admin_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Нельзя удалить, деактивировать или изменить роль самому себе"
+        )
+    user = await db.get(User, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    return user
+
+@router.patch("/admin/users/{user_id}/deactivate", response_model=AdminUserResponse)
+async def deactivate_user(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_session),
+    admin_user: User = Depends(get_current_admin)
+):
+    user = await _get_managed_user(user_id, admin_user, db)
+    user.is_active = False
+    bump_token_epoch(user)
+    await db.commit()
+    token_epochs.remember(user)
+    return AdminUserResponse(
+        id=user.id,
+        nickname=user.nickname,
+        email=user.email,
+        role=user.role.value,
+        task_count=await count_user_tasks(user.id),
+        is_active=user.is_active
+    )
+
+@router.patch("/admin/users/{user_id}/role", response_model=AdminUserResponse)
+async def change_user_role(
+    user_id: int,
+    data: RoleUpdateRequest,
+    db: AsyncSession = Depends(get_async_session),
+    admin_user: User = Depends(get_current_admin)
+):
+    user = await _get_managed_user(user_id, admin_user, db)
+    new_role = UserRole(data.role)
+    if user.role != new_role:
+        user.role = new_role
+        # Роль зашита в токен — старые токены отзываем
+        bump_token_epoch(user)
+        await db.commit()
+        token_epochs.remember(user)
+        await result_cache.invalidate_user(user.id)
+    return AdminUserResponse(
+        id=user.id,
+        nickname=user.nickname,
+        email=user.email,
+        role=user.role.value,
+        task_count=await count_user_tasks(user.id),
+        is_active=user.is_active
+    )
+
+@router.delete("/admin/users/{user_id}")
+async def delete_user(
+    user_id: int,
+    db: AsyncSession = Depends(get_async_session),
+    admin_user: User = Depends(get_current_admin)
+):
+    job = deletion_jobs.get(user_id)
+    if job is not None and job.status == "running":
+        return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job.to_dict()))
+
+    user = await _get_managed_user(user_id, admin_user, db)
+    task_count = await count_user_tasks(user_id)
+
+    # Сразу блокируем вход и отзываем токены (в stateless-режиме строку users
+    # не читают, поэтому одного удаления строки недостаточно). Отметка об
+    # удалении позволяет довести его до конца после перезапуска
+    user.is_active = False
+    user.deletion_requested_at = datetime.now(timezone.utc)
+    bump_token_epoch(user)
+    await db.commit()
+    token_epochs.remember(user)
+    await result_cache.invalidate_user(user_id)
+
+    if task_count <= USER_DELETE_SYNC_LIMIT:
+        # Немного задач — одна команда DELETE, задачи удалит ON DELETE CASCADE
+        await delete_user_rows(user_id)
+        return {"message": "Пользователь удалён", "id": user_id, "deleted_tasks": task_count}
+
+    # Много задач: удаляем их в фоне порциями
+    job = DeletionJob(user_id=user_id, total_tasks=task_count)
+    start_deletion_job(job)
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content=jsonable_encoder(job.to_dict()))
+
+@router.get("/admin/users/{user_id}/deletion")
+async def get_user_deletion_progress(
+    user_id: int,
+    admin_user: User = Depends(get_current_admin)
+):
+    job = deletion_jobs.get(user_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Удаление этого пользователя не запускалось")
+    return job.to_dict()
\ No newline at end of file
@@ -1,23 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func, case, and_
-from datetime import datetime, timezone
+from datetime import datetime, timezone, date
 from database import get_async_session
 from models.task import Task
 from models.user import User, UserRole
-from schemas import TimingStatsResponse
+from schemas import TimingStatsResponse, CalendarStatsResponse
 from dependencies import get_current_user, get_current_admin
+from rate_limit import limit_expensive
+from metrics import metrics
+from cache import result_cache
+from task_cache import task_cache
+from calendar_rollup import get_calendar
+from quadrant_history import fetch_dwell_rows, summarize_dwell
+from shards import shard_map, get_shard_session, get_shard_session_with_timeout, count_tasks_by_user
 
 router = APIRouter(
     prefix="/stats",
     tags=["statistics"]
 )
 
-@router.get("/", response_model=dict)
+@router.get("/", response_model=dict, dependencies=[Depends(limit_expensive)])
 async def get_tasks_stats(
-    db: AsyncSession = Depends(get_async_session),
+    db: AsyncSession = Depends(get_shard_session_with_timeout("stats")),
     current_user: User = Depends(get_current_user)
 ):
+    async def load() -> bytes:
+        if current_user.role == UserRole.ADMIN:
+            # Считаем на каждом шарде и складываем
+            parts = await shard_map.scatter(
+                lambda shard_db: collect_tasks_stats(shard_db, current_user), timeout_route="stats"
+            )
+            stats = merge_tasks_stats(parts)
+        else:
+            stats = await collect_tasks_stats(db, current_user)
+        return json.dumps(stats, ensure_ascii=False).encode("utf-8")
+
+    return await result_cache.get_or_set(current_user, "tasks_stats", "", load)
+
+async def collect_tasks_stats(db: AsyncSession, current_user: User) -> dict:
     # 1. Определяем условия фильтрации в зависимости от роли
     if current_user.role == UserRole.ADMIN:
         # Админ - видит все задачи
@@ -65,9 +87,19 @@ async def get_tasks_stats(
         "user_id": current_user.id
     }
 
-@router.get("/timing", response_model=TimingStatsResponse)
+def merge_tasks_stats(parts: list) -> dict:
+    stats = parts[0]
+    for part in parts[1:]:
+        stats["total_tasks"] += part["total_tasks"]
+        for key, value in part["by_quadrant"].items():
+            stats["by_quadrant"][key] += value
+        for key, value in part["by_status"].items():
+            stats["by_status"][key] += value
+    return stats
+
+@router.get("/timing", response_model=TimingStatsResponse, dependencies=[Depends(limit_expensive)])
 async def get_deadline_stats(
-    db: AsyncSession = Depends(get_async_session),
+    db: AsyncSession = Depends(get_shard_session_with_timeout("stats_timing")),
     current_user: User = Depends(get_current_user)
 ):
     now_utc = datetime.now(timezone.utc)
@@ -116,35 +148,78 @@ async def get_deadline_stats(
         ).label("overdue_pending")
     ).where(base_condition)
     
-    # 3. Выполняем запрос
-    result = await db.execute(statement)
-    stats_row = result.one()
+    # 3. Выполняем запрос (для админа — на всех шардах)
+    async def fetch(shard_db: AsyncSession):
+        result = await shard_db.execute(statement)
+        return result.one()
+
+    if current_user.role == UserRole.ADMIN:
+        rows = await shard_map.scatter(fetch, timeout_route="stats_timing")
+    else:
+        rows = [await fetch(db)]
     
     # 4. Возвращаем результат
     return TimingStatsResponse(
-        completed_on_time=stats_row.completed_on_time or 0,
-        completed_late=stats_row.completed_late or 0,
-        on_plan_pending=stats_row.on_plan_pending or 0,
-        overdue_pending=stats_row.overdue_pending or 0
+        completed_on_time=sum(row.completed_on_time or 0 for row in rows),
+        completed_late=sum(row.completed_late or 0 for row in rows),
+        on_plan_pending=sum(row.on_plan_pending or 0 for row in rows),
+        overdue_pending=sum(row.overdue_pending or 0 for row in rows)
+    )
+
+CALENDAR_MAX_DAYS = 731
+
+@router.get("/calendar", response_model=CalendarStatsResponse, dependencies=[Depends(limit_expensive)])
+async def get_calendar_stats(
+    date_from: date = Query(..., alias="from"),
+    date_to: date = Query(..., alias="to"),
+    bucket: str = Query("day", pattern="^(day|week)$"),
+    db: AsyncSession = Depends(get_shard_session),
+    current_user: User = Depends(get_current_user)
+):
+    if date_to < date_from:
+        raise HTTPException(status_code=400, detail="Дата 'to' раньше даты 'from'")
+    if (date_to - date_from).days > CALENDAR_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Период не может превышать {CALENDAR_MAX_DAYS} дней")
+
+    # Дни считаются в часовом поясе пользователя; прошедшие дни берутся из агрегатов
+    buckets = await get_calendar(
+        db, current_user.id, current_user.timezone, date_from, date_to, bucket
+    )
+    return CalendarStatsResponse(
+        date_from=date_from,
+        date_to=date_to,
+        bucket=bucket,
+        timezone=current_user.timezone,
+        buckets=buckets
     )
 
-@router.get("/users")
+@router.get("/quadrants/dwell", response_model=dict, dependencies=[Depends(limit_expensive)])
+async def get_quadrant_dwell_stats(
+    db: AsyncSession = Depends(get_shard_session_with_timeout("stats")),
+    current_user: User = Depends(get_current_user)
+):
+    # Сколько открытые задачи проводят в квадранте и куда из него уходят.
+    # Считается по накопительным агрегатам task_quadrant_dwell, а не по журналу.
+    async def load() -> bytes:
+        if current_user.role == UserRole.ADMIN:
+            parts = await shard_map.scatter(fetch_dwell_rows, timeout_route="stats")
+            rows = [row for part in parts for row in part]
+        else:
+            rows = await fetch_dwell_rows(db, current_user.id)
+        return json.dumps({"quadrants": summarize_dwell(rows)}, ensure_ascii=False).encode("utf-8")
+
+    return await result_cache.get_or_set(current_user, "quadrant_dwell", "", load)
+
+@router.get("/users", dependencies=[Depends(limit_expensive)])
 async def get_users_stats(
     current_user: User = Depends(get_current_admin),  # ТОЛЬКО ДЛЯ АДМИНОВ
     db: AsyncSession = Depends(get_async_session)
 ):
-    # 1. Запрос для получения всех пользователей с количеством их задач
+    # 1. Пользователи хранятся в основной базе, задачи — на шардах
     result = await db.execute(
-        select(
-            User.id,
-            User.nickname,
-            User.email,
-            User.role,
-            func.count(Task.id).label('task_count')
-        ).outerjoin(Task, User.id == Task.user_id)
-         .group_by(User.id)
-         .order_by(User.id)
+        select(User.id, User.nickname, User.email, User.role).order_by(User.id)
     )
+    task_counts = await count_tasks_by_user(timeout_route="stats_users")
     
     # 2. Формируем ответ
     users_stats = []
@@ -154,11 +229,34 @@ async def get_users_stats(
             "nickname": row.nickname,
             "email": row.email,
             "role": row.role.value,
-            "task_count": row.task_count
+            "task_count": task_counts.get(row.id, 0)
         })
     
     # 3. Возвращаем результат
     return {
         "total_users": len(users_stats),
         "users": users_stats
-    }
\ No newline at end of file
+    }
+
+@router.get("/metrics")
+async def get_service_metrics(
+    current_user: User = Depends(get_current_admin)  # ТОЛЬКО ДЛЯ АДМИНОВ
+):
+    # Счётчики текущего воркера (лимиты запросов, перегрузка и т.д.)
+    return metrics.snapshot()
+
+
+@router.get("/cache")
+async def get_cache_stats(
+    current_user: User = Depends(get_current_admin)  # ТОЛЬКО ДЛЯ АДМИНОВ
+):
+    # Эффективность кэша ответов (hit rate, объём) в текущем воркере
+    return result_cache.stats()
+
+
+@router.get("/cache/tasks")
+async def get_task_cache_stats(
+    current_user: User = Depends(get_current_admin)  # ТОЛЬКО ДЛЯ АДМИНОВ
+):
+    # Рабочий набор задач в текущем воркере: объём, число пользователей, hit rate
+    return task_cache.stats()
\ No newline at end of file
@@ -1,45 +1,365 @@
-from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+import json
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, or_
+import os
 from typing import List, Optional
+from zoneinfo import ZoneInfo
+from pydantic import TypeAdapter
 from datetime import datetime, timezone, timedelta
-from database import get_async_session
+from shards import shard_map, get_shard_session, get_shard_session_with_timeout, get_task_shard_session
+from models.series import TaskSeries
 from models.task import Task
 from models.user import User, UserRole
-from schemas import TaskCreate, TaskUpdate, TaskResponse
+from recurrence import RecurrenceRule
+from schemas import (
+    TaskCreate, TaskUpdate, TaskResponse, TaskSeriesCreate, TaskSeriesResponse, OccurrenceResponse
+)
 from utils import calculate_urgency, determine_quadrant, calculate_days_until_deadline
 from dependencies import get_current_user, get_current_admin
+from rate_limit import limit_cheap, limit_expensive
+from bulk_io import stream_tasks_export, import_tasks, detect_format
+from cache import result_cache
+from task_cache import task_cache
+from calendar_rollup import invalidate_rollups
+from idempotency import idempotency, request_fingerprint
+from task_mutations import (
+    check_task_access, apply_task_update, apply_task_complete, apply_task_delete,
+    materialize_next_occurrence
+)
+from write_coalescer import write_coalescer
 
 router = APIRouter(
     prefix="/tasks",
     tags=["tasks"]
 )
 
-@router.get("", response_model=List[TaskResponse])
+_task_list_adapter = TypeAdapter(List[TaskResponse])
+_occurrence_list_adapter = TypeAdapter(List[OccurrenceResponse])
+
+# Ограничения развёртки повторов в /tasks/occurrences
+OCCURRENCES_MAX_DAYS = int(os.getenv("OCCURRENCES_MAX_DAYS", "366"))
+OCCURRENCES_MAX_PER_SERIES = int(os.getenv("OCCURRENCES_MAX_PER_SERIES", "500"))
+
+def dump_task(task) -> bytes:
+    return TaskResponse.model_validate(task).model_dump_json().encode("utf-8")
+
+def dump_json(data) -> bytes:
+    return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+def dump_series(series_response: TaskSeriesResponse) -> bytes:
+    return series_response.model_dump_json().encode("utf-8")
+
+def as_utc(moment: datetime) -> datetime:
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+def dump_tasks(tasks) -> bytes:
+    # Готовые байты ответа, которые можно положить в кэш
+    return _task_list_adapter.dump_json(
+        _task_list_adapter.validate_python(tasks, from_attributes=True)
+    )
+
+@router.get("", response_model=List[TaskResponse], dependencies=[Depends(limit_expensive)])
 async def get_all_tasks(
-    db: AsyncSession = Depends(get_async_session),
+    db: AsyncSession = Depends(get_shard_session_with_timeout("tasks_list")),
+    current_user: User = Depends(get_current_user)
+):
+    if current_user.role == UserRole.ADMIN:
+        # Админ видит все задачи (со всех шардов)
+        return await shard_map.scatter_scalars(select(Task), timeout_route="tasks_list")
+
+    # Обычный пользователь видит только свои задачи (рабочий набор в памяти воркера)
+    task_set = await task_cache.user_tasks(db, current_user.id)
+    return task_set.all()
+
+@router.get("/export", dependencies=[Depends(limit_expensive)])
+async def export_tasks(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: User = Depends(get_current_user)
+):
+    # Потоковая выгрузка: задачи читаются серверным курсором порциями
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        stream_tasks_export(current_user, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="tasks.{format}"'}
+    )
+
+@router.post("/import", status_code=201, dependencies=[Depends(limit_expensive)])
+async def import_tasks_bulk(
+    request: Request,
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv)$"),
+    db: AsyncSession = Depends(get_shard_session),
+    current_user: User = Depends(get_current_user)
+):
+    # Строки проверяются схемой TaskCreate и загружаются через COPY
+    fmt = detect_format(format, request.headers.get("content-type"))
+    result = await import_tasks(request, fmt, db, current_user)
+    await result_cache.invalidate_user(current_user.id)
+    return result
+
+_FAR_FUTURE = datetime.max.replace(tzinfo=timezone.utc)
+
+@router.get("/next", response_model=List[TaskResponse], dependencies=[Depends(limit_cheap)])
+async def get_next_tasks(
+    k: int = Query(10, ge=1, le=100),
+    quadrant: Optional[str] = Query(None, pattern="^Q[1-4]$"),
+    horizon_days: Optional[int] = Query(None, ge=0, le=365),
+    db: AsyncSession = Depends(get_shard_session),
+    current_user: User = Depends(get_current_user)
+):
+    # Q1 < Q2 < Q3 < Q4 и при сортировке строк, поэтому порядок совпадает
+    # с индексом ix_tasks_open_(user_)next и хватает LIMIT без полной сортировки
+    statement = select(Task).where(Task.completed == False)
+    if current_user.role != UserRole.ADMIN:
+        statement = statement.where(Task.user_id == current_user.id)
+    if quadrant:
+        statement = statement.where(Task.quadrant == quadrant)
+    if horizon_days is not None:
+        horizon = datetime.now(timezone.utc) + timedelta(days=horizon_days)
+        statement = statement.where(Task.deadline_at <= horizon)
+    statement = statement.order_by(Task.quadrant, Task.deadline_at).limit(k)
+
+    if current_user.role == UserRole.ADMIN:
+        # Top-K с каждого шарда, затем общий top-K (NULL-дедлайны в конце)
+        tasks = await shard_map.scatter_scalars(statement)
+        tasks.sort(key=lambda t: (t.quadrant, t.deadline_at is None, t.deadline_at or _FAR_FUTURE))
+        return tasks[:k]
+
+    result = await db.execute(statement)
+    return result.scalars().all()
+
+@router.post("/recurring", response_model=TaskSeriesResponse, status_code=201, dependencies=[Depends(limit_cheap)])
+async def create_recurring_task(
+    series_data: TaskSeriesCreate,
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_shard_session),
+    current_user: User = Depends(get_current_user)
+):
+    async def perform():
+        # В tasks создаётся только первый повтор, остальные — по мере завершения
+        series = TaskSeries(
+            user_id=current_user.id,
+            title=series_data.title,
+            description=series_data.description,
+            is_important=series_data.is_important,
+            rrule=series_data.rrule,
+            dtstart=as_utc(series_data.dtstart),
+            timezone=current_user.timezone,
+            active=True
+        )
+        db.add(series)
+        await db.flush()
+        next_task = await materialize_next_occurrence(db, series)
+        await db.commit()
+        await result_cache.invalidate_user(current_user.id)
+        await task_cache.write_through(db)
+
+        response = TaskSeriesResponse.model_validate(series)
+        if next_task is not None:
+            response.next_task = TaskResponse.model_validate(next_task)
+        return response
+
+    # Повтор с тем же Idempotency-Key получает сохранённый ответ без обращения к БД
+    return await idempotency.run(
+        idempotency_key, current_user, request_fingerprint(request, series_data),
+        perform, dump_series,
+        status_code=201
+    )
+
+@router.delete("/recurring/{series_id}", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_cheap)])
+async def delete_recurring_task(
+    series_id: int,
+    db: AsyncSession = Depends(get_shard_session),
+    current_user: User = Depends(get_current_user)
+):
+    # Серия перестаёт порождать повторы; уже созданные задачи остаются (series_id = NULL)
+    series = await db.get(TaskSeries, series_id)
+    if series is None or series.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Серия задач не найдена")
+
+    await db.delete(series)
+    await db.commit()
+    await result_cache.invalidate_user(current_user.id)
+    return {"message": "Повторение задачи остановлено", "id": series_id}
+
+@router.get("/occurrences", response_model=List[OccurrenceResponse], dependencies=[Depends(limit_expensive)])
+async def get_occurrences(
+    date_from: datetime = Query(..., alias="from"),
+    date_to: datetime = Query(..., alias="to"),
+    db: AsyncSession = Depends(get_shard_session_with_timeout("tasks_list")),
+    current_user: User = Depends(get_current_user)
+):
+    # Задачи пользователя с дедлайном в [from, to) и ещё не созданные повторы серий.
+    # Виртуальные повторы считаются по правилу и в БД не сохраняются.
+    # Выборка только по своим задачам, в том числе для администратора.
+    date_from, date_to = as_utc(date_from), as_utc(date_to)
+    if date_to <= date_from:
+        raise HTTPException(status_code=400, detail="Параметр to должен быть позже from")
+    if date_to - date_from > timedelta(days=OCCURRENCES_MAX_DAYS):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Окно не может быть больше {OCCURRENCES_MAX_DAYS} дней"
+        )
+
+    async def load() -> bytes:
+        result = await db.execute(
+            select(Task).where(
+                Task.user_id == current_user.id,
+                Task.deadline_at >= date_from,
+                Task.deadline_at < date_to
+            )
+        )
+        occurrences = [
+            OccurrenceResponse(
+                task_id=task.id,
+                series_id=task.series_id,
+                title=task.title,
+                description=task.description,
+                is_important=task.is_important,
+                quadrant=task.quadrant,
+                deadline_at=task.deadline_at,
+                completed=task.completed,
+                is_virtual=False
+            )
+            for task in result.scalars().all()
+        ]
+
+        result = await db.execute(
+            select(TaskSeries).where(
+                TaskSeries.user_id == current_user.id,
+                TaskSeries.active == True
+            )
+        )
+        for series in result.scalars().all():
+            # Повторы до last_occurrence_at включительно уже есть в tasks
+            start = date_from
+            if series.last_occurrence_at is not None:
+                start = max(start, series.last_occurrence_at + timedelta(microseconds=1))
+            try:
+                rule = RecurrenceRule.parse(series.rrule)
+            except ValueError:
+                # Правило вне нынешних ограничений: серия остановится при следующем повторе
+                continue
+            for moment in rule.between(
+                series.dtstart, ZoneInfo(series.timezone), start, date_to, OCCURRENCES_MAX_PER_SERIES
+            ):
+                is_urgent = calculate_urgency(moment)
+                occurrences.append(OccurrenceResponse(
+                    series_id=series.id,
+                    title=series.title,
+                    description=series.description,
+                    is_important=series.is_important,
+                    quadrant=determine_quadrant(series.is_important, is_urgent),
+                    deadline_at=moment,
+                    completed=False,
+                    is_virtual=True
+                ))
+
+        occurrences.sort(key=lambda o: o.deadline_at)
+        return _occurrence_list_adapter.dump_json(occurrences)
+
+    return await result_cache.get_or_set(
+        current_user, "tasks_occurrences", f"{date_from.isoformat()}|{date_to.isoformat()}", load
+    )
+
+@router.get("/today", response_model=List[TaskResponse], dependencies=[Depends(limit_cheap)])
+async def get_tasks_due_today(
+    db: AsyncSession = Depends(get_shard_session),
+    current_user: User = Depends(get_current_user)
+):
+    from datetime import datetime, timezone
+    
+    now = datetime.now(timezone.utc)
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
+    
+    async def load() -> bytes:
+        if current_user.role == UserRole.ADMIN:
+            tasks = await shard_map.scatter_scalars(
+                select(Task).where(
+                    Task.deadline_at.between(today_start, today_end),
+                    Task.completed == False
+                )
+            )
+            tasks.sort(key=lambda t: t.deadline_at)
+        else:
+            result = await db.execute(
+                select(Task).where(
+                    Task.user_id == current_user.id,
+                    Task.deadline_at.between(today_start, today_end),
+                    Task.completed == False
+                ).order_by(Task.deadline_at)
+            )
+            tasks = result.scalars().all()
+        
+        # Добавляем расчет дней до дедлайна
+        response_tasks = []
+        for task in tasks:
+            days_deadline = calculate_days_until_deadline(task.deadline_at)
+            task_dict = task.to_dict()
+            task_dict['days_until_deadline'] = days_deadline
+            task_dict['status_message'] = "Срок истекает сегодня!"
+            response_tasks.append(TaskResponse(**task_dict))
+        return _task_list_adapter.dump_json(response_tasks)
+    
+    # Дата входит в ключ, чтобы кэш не пережил смену дня
+    return await result_cache.get_or_set(
+        current_user, "tasks_due_today", today_start.date().isoformat(), load
+    )
+
+@router.get("/search", response_model=List[TaskResponse], dependencies=[Depends(limit_expensive)])
+async def search_tasks(
+    q: str = Query(..., min_length=2),
+    db: AsyncSession = Depends(get_shard_session_with_timeout("tasks_search")),
     current_user: User = Depends(get_current_user)
 ):
+    keyword = f"%{q.lower()}%"
+    
     if current_user.role == UserRole.ADMIN:
-        # Админ видит все задачи
-        result = await db.execute(select(Task))
+        tasks = await shard_map.scatter_scalars(
+            select(Task).where(
+                or_(
+                    Task.title.ilike(keyword),
+                    Task.description.ilike(keyword)
+                )
+            ),
+            timeout_route="tasks_search"
+        )
     else:
-        # Обычный пользователь видит только свои задачи
         result = await db.execute(
-            select(Task).where(Task.user_id == current_user.id)
+            select(Task).where(
+                Task.user_id == current_user.id,
+                or_(
+                    Task.title.ilike(keyword),
+                    Task.description.ilike(keyword)
+                )
+            )
         )
+        tasks = result.scalars().all()
+    
+    if not tasks:
+        raise HTTPException(status_code=404, detail="По данному запросу ничего не найдено")
     
-    tasks = result.scalars().all()
     return tasks
 
-@router.get("/{task_id}", response_model=TaskResponse)
+
+@router.get("/{task_id}", response_model=TaskResponse, dependencies=[Depends(limit_cheap)])
 async def get_task_by_id(
     task_id: int,
-    db: AsyncSession = Depends(get_async_session),
+    db: AsyncSession = Depends(get_task_shard_session),
     current_user: User = Depends(get_current_user)
 ):
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
+    task = None
+    if current_user.role != UserRole.ADMIN:
+        task_set = await task_cache.peek(current_user.id)
+        task = task_set.get(task_id) if task_set is not None else None
+    if task is None:
+        # Чужие и несуществующие задачи проверяются по БД (403/404)
+        result = await db.execute(select(Task).where(Task.id == task_id))
+        task = result.scalar_one_or_none()
     
     if not task:
         raise HTTPException(status_code=404, detail="Задача не найдена")
@@ -65,6 +385,7 @@ async def get_task_by_id(
         "completed_at": task.completed_at,
         "deadline_at": task.deadline_at,
         "user_id": task.user_id,
+        "series_id": task.series_id,
         "days_until_deadline": days_deadline,
         "status_message": "Задача просрочена" if (task.deadline_at and days_deadline and days_deadline < 0) else "Все идет по плану!"
     }
@@ -72,69 +393,30 @@ async def get_task_by_id(
     return TaskResponse(**task_dict)
 
 
-@router.get("/search", response_model=List[TaskResponse])
-async def search_tasks(
-    q: str = Query(..., min_length=2),
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
-):
-    keyword = f"%{q.lower()}%"
-    
-    if current_user.role == UserRole.ADMIN:
-        result = await db.execute(
-            select(Task).where(
-                or_(
-                    Task.title.ilike(keyword),
-                    Task.description.ilike(keyword)
-                )
-            )
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.user_id == current_user.id,
-                or_(
-                    Task.title.ilike(keyword),
-                    Task.description.ilike(keyword)
-                )
-            )
-        )
-    
-    tasks = result.scalars().all()
-    if not tasks:
-        raise HTTPException(status_code=404, detail="По данному запросу ничего не найдено")
-    
-    return tasks
-
-
-@router.get("/quadrant/{quadrant}", response_model=List[TaskResponse])
+@router.get("/quadrant/{quadrant}", response_model=List[TaskResponse], dependencies=[Depends(limit_cheap)])
 async def get_tasks_by_quadrant(
     quadrant: str,
-    db: AsyncSession = Depends(get_async_session),
+    db: AsyncSession = Depends(get_shard_session),
     current_user: User = Depends(get_current_user)
 ):
     if quadrant not in ["Q1", "Q2", "Q3", "Q4"]:
         raise HTTPException(status_code=400, detail="Неверный квадрат. Используйте: Q1, Q2, Q3, Q4")
     
-    if current_user.role == UserRole.ADMIN:
-        result = await db.execute(
-            select(Task).where(Task.quadrant == quadrant)
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.user_id == current_user.id,
-                Task.quadrant == quadrant
-            )
-        )
-    
-    tasks = result.scalars().all()
-    return tasks
+    async def load() -> bytes:
+        if current_user.role == UserRole.ADMIN:
+            return dump_tasks(await shard_map.scatter_scalars(
+                select(Task).where(Task.quadrant == quadrant)
+            ))
+        # Фильтр по индексу квадрантов рабочего набора
+        task_set = await task_cache.user_tasks(db, current_user.id)
+        return dump_tasks(task_set.quadrant(quadrant))
+
+    return await result_cache.get_or_set(current_user, "tasks_by_quadrant", quadrant, load)
 
-@router.get("/status/{status}", response_model=List[TaskResponse])
+@router.get("/status/{status}", response_model=List[TaskResponse], dependencies=[Depends(limit_cheap)])
 async def get_tasks_by_status(
     status: str,
-    db: AsyncSession = Depends(get_async_session),
+    db: AsyncSession = Depends(get_shard_session),
     current_user: User = Depends(get_current_user)
 ):
     if status not in ["completed", "pending"]:
@@ -142,179 +424,152 @@ async def get_tasks_by_status(
     
     is_completed = (status == "completed")
     
-    if current_user.role == UserRole.ADMIN:
-        result = await db.execute(
-            select(Task).where(Task.completed == is_completed)
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.user_id == current_user.id,
-                Task.completed == is_completed
-            )
-        )
-    
-    tasks = result.scalars().all()
-    return tasks
+    async def load() -> bytes:
+        if current_user.role == UserRole.ADMIN:
+            return dump_tasks(await shard_map.scatter_scalars(
+                select(Task).where(Task.completed == is_completed)
+            ))
+        task_set = await task_cache.user_tasks(db, current_user.id)
+        return dump_tasks(task_set.status(is_completed))
 
-@router.post("/", response_model=TaskResponse, status_code=201)
+    return await result_cache.get_or_set(current_user, "tasks_by_status", status, load)
+
+@router.post("/", response_model=TaskResponse, status_code=201, dependencies=[Depends(limit_cheap)])
 async def create_task(
     task_data: TaskCreate,
-    db: AsyncSession = Depends(get_async_session),
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_shard_session),
     current_user: User = Depends(get_current_user)
 ):
-    # Расчет срочности и квадранта
-    is_urgent = calculate_urgency(task_data.deadline_at)
-    quadrant = determine_quadrant(task_data.is_important, is_urgent)
-    
-    new_task = Task(
-        title=task_data.title,
-        description=task_data.description,
-        is_important=task_data.is_important,
-        is_urgent=is_urgent,
-        quadrant=quadrant,
-        deadline_at=task_data.deadline_at,
-        completed=False,
-        user_id=current_user.id  # Привязываем к текущему пользователю
+    async def perform():
+        # Расчет срочности и квадранта
+        is_urgent = calculate_urgency(task_data.deadline_at)
+        quadrant = determine_quadrant(task_data.is_important, is_urgent)
+
+        new_task = Task(
+            title=task_data.title,
+            description=task_data.description,
+            is_important=task_data.is_important,
+            is_urgent=is_urgent,
+            quadrant=quadrant,
+            deadline_at=task_data.deadline_at,
+            completed=False,
+            user_id=current_user.id  # Привязываем к текущему пользователю
+        )
+
+        db.add(new_task)
+        await invalidate_rollups(db, current_user.id, new_task.deadline_at)
+        await db.commit()
+        await db.refresh(new_task)
+        await result_cache.invalidate_user(new_task.user_id)
+        await task_cache.write_through(db)
+        return new_task
+
+    # Повтор с тем же Idempotency-Key получает сохранённый ответ без обращения к БД
+    return await idempotency.run(
+        idempotency_key, current_user, request_fingerprint(request, task_data),
+        perform, dump_task,
+        status_code=201
     )
-    
-    db.add(new_task)
-    await db.commit()
-    await db.refresh(new_task)
-    return new_task
 
 
-@router.put("/{task_id}", response_model=TaskResponse)
+@router.put("/{task_id}", response_model=TaskResponse, dependencies=[Depends(limit_cheap)])
 async def update_task(
     task_id: int,
     task_update: TaskUpdate,
-    db: AsyncSession = Depends(get_async_session),
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_task_shard_session),
     current_user: User = Depends(get_current_user)
 ):
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
-    
-    # Проверка прав доступа
-    if current_user.role != UserRole.ADMIN and task.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Нет доступа к этой задаче"
-        )
-    
-    # Обновляем только переданные поля
-    update_data = task_update.model_dump(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(task, field, value)
-    
-    # Пересчитываем квадрат, если изменились важность или дедлайн
-    if "is_important" in update_data or "deadline_at" in update_data:
-        task.is_urgent = calculate_urgency(task.deadline_at)
-        task.quadrant = determine_quadrant(task.is_important, task.is_urgent)
-    
-    await db.commit()
-    await db.refresh(task)
-    return task
+    async def perform():
+        update_data = task_update.model_dump(exclude_unset=True)
+        if write_coalescer.enabled:
+            # Изменение уйдёт в общую транзакцию вместе с соседними запросами
+            return await write_coalescer.submit_update(
+                shard_map.shard_for_session(db), task_id, current_user, update_data
+            )
+
+        result = await db.execute(select(Task).where(Task.id == task_id))
+        task = check_task_access(result.scalar_one_or_none(), current_user)
+        await apply_task_update(db, task, update_data)
+
+        await db.commit()
+        await db.refresh(task)
+        await result_cache.invalidate_user(task.user_id)
+        await task_cache.write_through(db)
+        return task
+
+    # Повтор с тем же Idempotency-Key получает сохранённый ответ без обращения к БД
+    return await idempotency.run(
+        idempotency_key, current_user, request_fingerprint(request, task_update),
+        perform, dump_task
+    )
 
-@router.delete("/{task_id}", status_code=status.HTTP_200_OK)
+
+@router.delete("/{task_id}", status_code=status.HTTP_200_OK, dependencies=[Depends(limit_cheap)])
 async def delete_task(
     task_id: int,
-    db: AsyncSession = Depends(get_async_session),
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_task_shard_session),
     current_user: User = Depends(get_current_user)
 ):
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
-    
-    # Проверка прав доступа
-    if current_user.role != UserRole.ADMIN and task.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Нет доступа к этой задаче"
-        )
-    
-    deleted_task_info = {
-        "id": task.id,
-        "title": task.title
-    }
-    
-    await db.delete(task)
-    await db.commit()
-    
-    return {
-        "message": "Задача успешно удалена",
-        "id": deleted_task_info["id"],
-        "title": deleted_task_info["title"]
-    }
+    async def perform():
+        result = await db.execute(select(Task).where(Task.id == task_id))
+        task = check_task_access(result.scalar_one_or_none(), current_user)
+
+        deleted_task_info = {
+            "id": task.id,
+            "title": task.title
+        }
+
+        await apply_task_delete(db, task)
+        await db.commit()
+        await result_cache.invalidate_user(task.user_id)
+        await task_cache.write_through(db)
+
+        return {
+            "message": "Задача успешно удалена",
+            "id": deleted_task_info["id"],
+            "title": deleted_task_info["title"]
+        }
+
+    # Повтор с тем же Idempotency-Key получает сохранённый ответ без обращения к БД
+    return await idempotency.run(
+        idempotency_key, current_user, request_fingerprint(request),
+        perform, dump_json
+    )
 
 
-@router.patch("/{task_id}/complete", response_model=TaskResponse)
+@router.patch("/{task_id}/complete", response_model=TaskResponse, dependencies=[Depends(limit_cheap)])
 async def complete_task(
     task_id: int,
-    db: AsyncSession = Depends(get_async_session),
+    request: Request,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    db: AsyncSession = Depends(get_task_shard_session),
     current_user: User = Depends(get_current_user)
 ):
-    result = await db.execute(select(Task).where(Task.id == task_id))
-    task = result.scalar_one_or_none()
-    
-    if not task:
-        raise HTTPException(status_code=404, detail="Задача не найдена")
-    
-    # Проверка прав доступа
-    if current_user.role != UserRole.ADMIN and task.user_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Нет доступа к этой задаче"
-        )
-    
-    task.completed = True
-    task.completed_at = datetime.utcnow()
-    
-    await db.commit()
-    await db.refresh(task)
-    return task
+    async def perform():
+        if write_coalescer.enabled:
+            # Изменение уйдёт в общую транзакцию вместе с соседними запросами
+            return await write_coalescer.submit_complete(
+                shard_map.shard_for_session(db), task_id, current_user
+            )
 
+        result = await db.execute(select(Task).where(Task.id == task_id))
+        task = check_task_access(result.scalar_one_or_none(), current_user)
+        await apply_task_complete(db, task)
 
-@router.get("/today", response_model=List[TaskResponse])
-async def get_tasks_due_today(
-    db: AsyncSession = Depends(get_async_session),
-    current_user: User = Depends(get_current_user)
-):
-    from datetime import datetime, timezone
-    
-    now = datetime.now(timezone.utc)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
-    
-    if current_user.role == UserRole.ADMIN:
-        result = await db.execute(
-            select(Task).where(
-                Task.deadline_at.between(today_start, today_end),
-                Task.completed == False
-            ).order_by(Task.deadline_at)
-        )
-    else:
-        result = await db.execute(
-            select(Task).where(
-                Task.user_id == current_user.id,
-                Task.deadline_at.between(today_start, today_end),
-                Task.completed == False
-            ).order_by(Task.deadline_at)
-        )
-    
-    tasks = result.scalars().all()
-    
-    # Добавляем расчет дней до дедлайна
-    response_tasks = []
-    for task in tasks:
-        days_deadline = calculate_days_until_deadline(task.deadline_at)
-        task_dict = task.to_dict()
-        task_dict['days_until_deadline'] = days_deadline
-        task_dict['status_message'] = "Срок истекает сегодня!"
-        response_tasks.append(TaskResponse(**task_dict))
-    
-    return response_tasks
\ No newline at end of file
+        await db.commit()
+        await db.refresh(task)
+        await result_cache.invalidate_user(task.user_id)
+        await task_cache.write_through(db)
+        return task
+
+    # Повтор с тем же Idempotency-Key получает сохранённый ответ без обращения к БД
+    return await idempotency.run(
+        idempotency_key, current_user, request_fingerprint(request),
+        perform, dump_task
+    )
\ No newline at end of file
@@ -1,16 +1,41 @@
+import asyncio
+import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from datetime import datetime
-from database import get_async_session  # Импортируем зависимость для сессии
+from datetime import datetime, timezone
+from shards import shard_map, Shard
 from models import Task
 from utils import calculate_urgency, determine_quadrant
+from cache import result_cache
+from task_cache import task_cache
+from calendar_rollup import invalidate_rollups
+from app_logging import new_correlation_id
+from digest import run_daily_digest, resume_digest
+from quadrant_history import set_transition_cause
+from auth_utils import AUTH_STATELESS
+from token_epochs import token_epochs, TOKEN_EPOCH_REFRESH_SECONDS
+
+logger = logging.getLogger(__name__)
 
 async def update_task_urgency():
-    print(f"[{datetime.now()}] 🕐 Запуск автоматического обновления срочности задач...")
+    # Все записи лога этого запуска (на всех шардах) связаны одним id
+    new_correlation_id("urgency-")
+    logger.info("Запуск автоматического обновления срочности задач...")
+
+    # Шарды обрабатываются параллельно, ошибка на одном не мешает остальным
+    await asyncio.gather(*(update_shard_urgency(shard) for shard in shard_map.shards))
+
+async def run_daily_jobs():
+    # Сначала пересчёт срочности — дайджест строится по уже обновлённым квадрантам
+    await update_task_urgency()
+    await run_daily_digest()
 
+async def update_shard_urgency(shard: Shard):
     # Создаем новую сессию для этой задачи
-    async for db in get_async_session():
+    async with shard.session() as db:
+        # Смены квадрантов в этой сессии попадут в журнал с причиной urgency
+        set_transition_cause(db, "urgency")
         try:
             # Получаем все незавершённые задачи
             result = await db.execute(
@@ -19,6 +44,10 @@ async def update_task_urgency():
             tasks = result.scalars().all()
 
             updated_count = 0
+            changed_users = set()
+            # Самый ранний прошедший дедлайн среди изменённых задач пользователя
+            past_deadlines = {}
+            now = datetime.now(timezone.utc)
 
             for task in tasks:
                 # Вычисляем новую срочность на основе дедлайна
@@ -30,19 +59,33 @@ async def update_task_urgency():
                     task.is_urgent = new_urgency
                     task.quadrant = new_quadrant
                     updated_count += 1
+                    changed_users.add(task.user_id)
+                    if task.deadline_at is not None and task.deadline_at < now:
+                        previous = past_deadlines.get(task.user_id)
+                        if previous is None or task.deadline_at < previous:
+                            past_deadlines[task.user_id] = task.deadline_at
+
+            for user_id, deadline_at in past_deadlines.items():
+                await invalidate_rollups(db, user_id, deadline_at)
 
             if updated_count > 0:
                 await db.commit()
-                print(f"✅ Обновлено задач: {updated_count} из {len(tasks)}")
+                # Сбрасываем кэш ответов только у затронутых пользователей
+                await result_cache.invalidate_users(changed_users)
+                await task_cache.write_through(db)
+                logger.info(
+                    "Обновлено задач: %s из %s", updated_count, len(tasks),
+                    extra={"shard": shard.index, "updated": updated_count, "checked": len(tasks)}
+                )
             else:
-                print(f"📊 Изменений не требуется. Проверено задач: {len(tasks)}")
+                logger.info(
+                    "Изменений не требуется. Проверено задач: %s", len(tasks),
+                    extra={"shard": shard.index, "updated": 0, "checked": len(tasks)}
+                )
 
-        except Exception as e:
-            print(f"❌ Ошибка при обновлении срочности: {e}")
+        except Exception:
+            logger.exception("Ошибка при обновлении срочности", extra={"shard": shard.index})
             await db.rollback()
-        finally:
-            await db.close()
-        break  # Выходим из цикла async for
 
 
 def start_scheduler():
@@ -50,15 +93,47 @@ def start_scheduler():
 
     # ✅ ОСНОВНАЯ ЗАДАЧА: запуск каждый день в 09:00 утра
     scheduler.add_job(
-        update_task_urgency,
+        run_daily_jobs,
         trigger="cron",
         hour=9,
         minute=0,
         id="update_urgency_daily",
-        name="Ежедневное обновление срочности задач",
+        name="Ежедневное обновление срочности задач и дайджест",
         replace_existing=True
     )
 
+    # Stateless-аутентификация: отзыв токенов из других воркеров доходит за этот интервал
+    if AUTH_STATELESS:
+        scheduler.add_job(
+            token_epochs.refresh,
+            trigger="interval",
+            seconds=TOKEN_EPOCH_REFRESH_SECONDS,
+            id="reload_token_epochs",
+            name="Обновление эпох токенов",
+            replace_existing=True
+        )
+
+    # Рассылка за сегодня прервалась (падение процесса на любом хосте) —
+    # продолжаем с контрольной точки в digest_runs
+    scheduler.add_job(
+        resume_digest,
+        trigger="date",
+        id="resume_digest",
+        name="Продолжение рассылки дайджеста",
+        replace_existing=True
+    )
+
+    # Перечитываем карту перенесённых пользователей (после ребалансировки)
+    if shard_map.is_sharded:
+        scheduler.add_job(
+            shard_map.load_overrides,
+            trigger="interval",
+            minutes=1,
+            id="reload_shard_overrides",
+            name="Обновление карты шардов",
+            replace_existing=True
+        )
+
     # 🧪 ДЛЯ ТЕСТИРОВАНИЯ: запуск каждые 5 минут
     # Раскомментируйте для проверки работы
     #scheduler.add_job(
@@ -72,9 +147,9 @@ def start_scheduler():
 
     # Запускаем планировщик
     scheduler.start()
-    print("✅ Планировщик APScheduler запущен!")
-    print("📅 Задачи:")
-    print("   - Ежедневно в 09:00: обновление срочности")
-    print("   - Каждые 5 минут: тестовое обновление (закомментируйте после теста)")
+    logger.info(
+        "Планировщик APScheduler запущен",
+        extra={"jobs": [job.name for job in scheduler.get_jobs()]}
+    )
 
     return scheduler
\ No newline at end of file
@@ -0,0 +1,100 @@
+# schema_tools.py — миграции, которые нельзя выполнять при запуске приложения
+#
+#   python schema_tools.py cascade-fks  — внешние ключи на users с ON DELETE CASCADE
+#   python schema_tools.py indexes      — недостающие индексы моделей (CONCURRENTLY)
+#
+# Запускаются вручную на всех базах (шардах) после обновления, которое их
+# требует (init_db пишет предупреждение в лог); повторный запуск ничего не меняет.
+import argparse
+import asyncio
+import os
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
+
+from database import CASCADE_USER_FKS, find_missing_indexes
+from shards import shard_map, Shard
+
+load_dotenv()
+
+# Сколько ждать ACCESS EXCLUSIVE для пересоздания ключа. Ожидающая блокировка
+# задерживает все следующие запросы к таблице, поэтому ждём недолго
+SCHEMA_LOCK_TIMEOUT_MS = int(os.getenv("SCHEMA_LOCK_TIMEOUT_MS", "5000"))
+
+_CONSTRAINT_STATE_SQL = text(
+    "SELECT confdeltype::text AS confdeltype, convalidated FROM pg_constraint WHERE conname = :constraint"
+)
+
+
+async def cascade_user_fk(shard: Shard, table: str, constraint: str) -> str:
+    async with shard.engine.connect() as conn:
+        state = (await conn.execute(_CONSTRAINT_STATE_SQL, {"constraint": constraint})).first()
+        await conn.rollback()
+    if state is None:
+        return "нет ключа"
+
+    if state.confdeltype != "c":
+        # 1. Короткая транзакция: NOT VALID не проверяет существующие строки,
+        #    ACCESS EXCLUSIVE держится только на время DROP/ADD
+        async with shard.engine.begin() as conn:
+            await conn.execute(text(f"SET LOCAL lock_timeout = {SCHEMA_LOCK_TIMEOUT_MS}"))
+            await conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {constraint}"))
+            await conn.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {constraint} "
+                "FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE NOT VALID"
+            ))
+
+    # 2. Отдельная транзакция: проверка всей таблицы под SHARE UPDATE EXCLUSIVE,
+    #    чтение и запись в таблицу при этом продолжаются
+    async with shard.engine.begin() as conn:
+        validated = (await conn.execute(_CONSTRAINT_STATE_SQL, {"constraint": constraint})).first().convalidated
+        if not validated:
+            await conn.execute(text(f"ALTER TABLE {table} VALIDATE CONSTRAINT {constraint}"))
+    return "уже был" if state.confdeltype == "c" and state.convalidated else "пересоздан"
+
+
+async def cascade_fks():
+    for shard in shard_map.shards:
+        for table, constraint in CASCADE_USER_FKS:
+            outcome = await cascade_user_fk(shard, table, constraint)
+            print(f"Шард {shard.index}: {constraint} — {outcome}")
+
+
+async def create_missing_indexes(shard: Shard) -> list:
+    # CONCURRENTLY строит индекс без блокировки записи, но не работает в транзакции
+    async with shard.engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        created = []
+        for index, invalid in await find_missing_indexes(conn):
+            if invalid:
+                # Остаток прерванной попытки: IF NOT EXISTS его бы пропустил
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+            statement = str(CreateIndex(index, if_not_exists=True).compile(dialect=postgresql.dialect()))
+            await conn.execute(text(statement.replace(" INDEX IF NOT EXISTS ", " INDEX CONCURRENTLY IF NOT EXISTS ", 1)))
+            created.append(str(index.name))
+        return created
+
+
+async def create_indexes():
+    for shard in shard_map.shards:
+        created = await create_missing_indexes(shard)
+        print(f"Шард {shard.index}: создано индексов {len(created)} {', '.join(created)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграции схемы вне запуска приложения")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("cascade-fks", help="ON DELETE CASCADE для внешних ключей на users")
+    commands.add_parser("indexes", help="Недостающие индексы моделей, CREATE INDEX CONCURRENTLY")
+    args = parser.parse_args()
+
+    if args.command == "indexes":
+        asyncio.run(create_indexes())
+    else:
+        asyncio.run(cascade_fks())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 from pydantic import BaseModel, Field
-from typing import Optional
-from datetime import datetime
-from pydantic import BaseModel, Field
+from typing import Optional, Dict, List
+from datetime import datetime, date
+from pydantic import BaseModel, Field, field_validator
+from recurrence import RecurrenceRule
 
 class TimingStatsResponse(BaseModel):
     completed_on_time: int = Field(
@@ -21,6 +22,18 @@ class TimingStatsResponse(BaseModel):
         description="Количество просроченных незавершенных задач"
     )
 
+class CalendarBucket(BaseModel):
+    start: date = Field(..., description="Первый день корзины (день или понедельник недели)")
+    deadlines: Dict[str, int] = Field(..., description="Количество дедлайнов по квадрантам")
+    completions: Dict[str, int] = Field(..., description="Количество завершённых задач по квадрантам")
+
+class CalendarStatsResponse(BaseModel):
+    date_from: date
+    date_to: date
+    bucket: str
+    timezone: str
+    buckets: List[CalendarBucket]
+
 # Схема для создания задачи (POST)
 class TaskCreate(BaseModel):
     title: str = Field(..., min_length=3, max_length=100)
@@ -51,6 +64,53 @@ class TaskResponse(BaseModel):
     days_until_deadline: Optional[int] = None 
     status_message: Optional[str] = None
     user_id: Optional[int] = None
+    series_id: Optional[int] = None
+
+    class Config:
+        from_attributes = True
+
+# Схема для создания повторяющейся задачи
+class TaskSeriesCreate(BaseModel):
+    title: str = Field(..., min_length=3, max_length=100)
+    description: Optional[str] = Field(None, max_length=500)
+    is_important: bool
+    rrule: str = Field(
+        ...,
+        max_length=255,
+        description="Правило повторения (RRULE): FREQ=DAILY|WEEKLY|MONTHLY, INTERVAL, BYDAY, COUNT, UNTIL",
+        examples=["FREQ=WEEKLY;BYDAY=MO,WE,FR"]
+    )
+    dtstart: datetime = Field(..., description="Дедлайн первого повтора")
+
+    @field_validator("rrule")
+    @classmethod
+    def check_rrule(cls, value: str) -> str:
+        RecurrenceRule.parse(value)
+        return value.strip().upper()
+
+class TaskSeriesResponse(BaseModel):
+    id: int
+    title: str
+    description: Optional[str]
+    is_important: bool
+    rrule: str
+    dtstart: datetime
+    timezone: str
+    last_occurrence_at: Optional[datetime]
+    active: bool
+    next_task: Optional[TaskResponse] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# Повтор в окне дат: созданная задача или ещё не созданный (виртуальный) повтор серии
+class OccurrenceResponse(BaseModel):
+    task_id: Optional[int] = None
+    series_id: Optional[int] = None
+    title: str
+    description: Optional[str]
+    is_important: bool
+    quadrant: str
+    deadline_at: datetime
+    completed: bool
+    is_virtual: bool
\ No newline at end of file
@@ -15,6 +15,7 @@ class UserResponse(BaseModel):
     nickname: str
     email: str
     role: str
+    timezone: str = "UTC"
 
     class Config:
         from_attributes = True
@@ -22,17 +23,33 @@ class UserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = Field(None, description="Срок жизни access-токена в секундах")
+
+class TimezoneUpdateResponse(UserResponse, Token):
+    # Профиль и новая пара токенов: в stateless-режиме пояс берётся из claim "tz"
+    pass
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class RoleUpdateRequest(BaseModel):
+    role: str = Field(..., pattern="^(user|admin)$")
 
 class ChangePasswordRequest(BaseModel):
     old_password: str
     new_password: str = Field(..., min_length=6)
 
+class TimezoneUpdateRequest(BaseModel):
+    timezone: str = Field(..., max_length=64, description="Часовой пояс IANA, например Europe/Moscow")
+
 class AdminUserResponse(BaseModel):
     id: int
     nickname: str
     email: str
     role: str
     task_count: int
+    is_active: bool = True
 
     class Config:
         from_attributes = True
\ No newline at end of file
@@ -0,0 +1,225 @@
+# shard_tools.py — обслуживание шардов из командной строки
+#
+#   python shard_tools.py status              — число задач на каждом шарде
+#   python shard_tools.py move USER_ID SHARD  — перенести пользователя на шард
+#   python shard_tools.py pin                 — закрепить пользователей за шардами,
+#                                               где лежат их данные (после смены конфигурации)
+#   python shard_tools.py align-ids           — выровнять последовательности id задач
+#                                               под число шардов (после смены конфигурации)
+#
+# Перенос не онлайновый: на время переноса пользователь не должен менять задачи.
+# Остальные воркеры узнают о переносе при следующем обновлении карты (раз в минуту).
+import argparse
+import asyncio
+from typing import Dict, List
+
+from sqlalchemy import select, insert, delete, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from calendar_rollup import reset_rollups
+from models.quadrant_history import QuadrantTransition, QuadrantDwell
+from models.series import TaskSeries
+from models.shard import UserShardOverride
+from models.task import Task
+from models.user import User
+from shards import shard_map, ensure_user_on_shard, Shard, ALIGNED_TABLES
+
+MOVE_BATCH_SIZE = 5000
+
+
+async def print_status():
+    async def count(db):
+        result = await db.execute(
+            select(func.count(Task.id), func.count(func.distinct(Task.user_id)))
+        )
+        return result.one()
+
+    for shard, (tasks, users) in zip(shard_map.shards, await shard_map.scatter(count)):
+        print(f"Шард {shard.index}: задач {tasks}, пользователей с задачами {users}")
+    async with shard_map.primary.session() as db:
+        max_user_id = await db.scalar(select(func.max(User.id))) or 0
+    print(f"Максимальный id пользователя: {max_user_id} — новая граница SHARD_RANGES должна быть больше")
+
+
+async def pin_existing_users() -> int:
+    # Запускается с новой конфигурацией шардов до перезапуска воркеров.
+    # Пользователь живёт на неосновном шарде, если там есть копия его строки
+    # (ensure_user_on_shard), иначе — в основной базе. Тех, кого стратегия теперь
+    # направила бы на другой шард, закрепляем через user_shard_overrides.
+    await shard_map.load_overrides()
+    homes: Dict[int, int] = {}
+    for shard in shard_map.shards[1:]:
+        async with shard.session() as db:
+            result = await db.stream(select(User.id).execution_options(yield_per=MOVE_BATCH_SIZE))
+            async for rows in result.partitions():
+                homes.update((row.id, shard.index) for row in rows)
+
+    misrouted: List[dict] = []
+    async with shard_map.primary.session() as db:
+        result = await db.stream(select(User.id).execution_options(yield_per=MOVE_BATCH_SIZE))
+        async for rows in result.partitions():
+            for row in rows:
+                home = homes.get(row.id, 0)
+                if row.id not in shard_map.overrides and shard_map.computed_index(row.id) != home:
+                    misrouted.append({"user_id": row.id, "shard": home})
+
+    async with shard_map.primary.session() as db:
+        for start in range(0, len(misrouted), MOVE_BATCH_SIZE):
+            await db.execute(
+                pg_insert(UserShardOverride)
+                .values(misrouted[start:start + MOVE_BATCH_SIZE])
+                .on_conflict_do_nothing()
+            )
+        await db.commit()
+    shard_map.overrides.update((item["user_id"], item["shard"]) for item in misrouted)
+    return len(misrouted)
+
+
+async def move_user(user_id: int, target_index: int):
+    await shard_map.load_overrides()
+    if not 0 <= target_index < len(shard_map.shards):
+        raise SystemExit(f"Нет шарда с номером {target_index}")
+
+    source = shard_map.shard_for_user(user_id)
+    target = shard_map.shards[target_index]
+    if source.index == target.index:
+        print(f"Пользователь {user_id} уже на шарде {target.index}")
+        return
+
+    async with shard_map.primary.session() as primary_db:
+        user = await primary_db.get(User, user_id)
+    if user is None:
+        raise SystemExit(f"Пользователь {user_id} не найден")
+
+    # 1. Копируем серии и задачи на новый шард порциями (id сохраняются)
+    await ensure_user_on_shard(user, target)
+    copied = 0
+    async with source.session() as source_db, target.session() as target_db:
+        series = (await source_db.execute(
+            select(TaskSeries.__table__).where(TaskSeries.user_id == user_id)
+        )).all()
+        if series:
+            await target_db.execute(insert(TaskSeries.__table__), [dict(row._mapping) for row in series])
+        result = await source_db.stream(
+            select(Task.__table__)
+            .where(Task.user_id == user_id)
+            .execution_options(yield_per=MOVE_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            await target_db.execute(insert(Task.__table__), [dict(row._mapping) for row in rows])
+            copied += len(rows)
+
+        # История квадрантов: агрегаты как есть, журнал — с новыми id на целевом шарде
+        dwell = (await source_db.execute(
+            select(QuadrantDwell.__table__).where(QuadrantDwell.user_id == user_id)
+        )).all()
+        if dwell:
+            await target_db.execute(insert(QuadrantDwell.__table__), [dict(row._mapping) for row in dwell])
+        result = await source_db.stream(
+            select(QuadrantTransition.__table__)
+            .where(QuadrantTransition.user_id == user_id)
+            .execution_options(yield_per=MOVE_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            await target_db.execute(
+                insert(QuadrantTransition.__table__),
+                [{k: v for k, v in row._mapping.items() if k != "id"} for row in rows]
+            )
+        await target_db.commit()
+
+    # 2. Переключаем маршрутизацию пользователя
+    async with shard_map.primary.session() as primary_db:
+        await primary_db.execute(
+            pg_insert(UserShardOverride)
+            .values(user_id=user_id, shard=target.index)
+            .on_conflict_do_update(
+                index_elements=[UserShardOverride.user_id],
+                set_={"shard": target.index, "moved_at": func.now()}
+            )
+        )
+        await primary_db.commit()
+    shard_map.overrides[user_id] = target.index
+
+    # 3. Удаляем данные со старого шарда (агрегаты пересчитаются на новом)
+    async with source.session() as source_db:
+        await reset_rollups(source_db, user_id)
+        await source_db.execute(delete(Task).where(Task.user_id == user_id))
+        await source_db.execute(delete(TaskSeries).where(TaskSeries.user_id == user_id))
+        await source_db.execute(delete(QuadrantTransition).where(QuadrantTransition.user_id == user_id))
+        await source_db.execute(delete(QuadrantDwell).where(QuadrantDwell.user_id == user_id))
+        if source.index != 0:
+            await source_db.execute(delete(User).where(User.id == user_id))
+        await source_db.commit()
+
+    print(f"✅ Пользователь {user_id}: шард {source.index} → {target.index}, задач перенесено: {copied}")
+
+
+async def _max_ids(shard: Shard) -> Dict[str, int]:
+    async with shard.engine.connect() as conn:
+        return {
+            table: (await conn.execute(text(
+                f"SELECT GREATEST((SELECT COALESCE(MAX(id), 0) FROM {table}), "
+                f"(SELECT last_value FROM {table}_id_seq))"
+            ))).scalar()
+            for table in ALIGNED_TABLES
+        }
+
+
+async def _align_sequence(shard: Shard, table: str, shard_count: int, floor: int) -> None:
+    # Последовательность на шарде k выдаёт id ≡ k+1 (mod N), поэтому id задач
+    # (и серий, на которые ссылается tasks.series_id) не пересекаются и не меняются
+    # при переносе между шардами. Отсчёт от максимума по всем шардам: до
+    # подключения нового шарда основная база выдавала id с любым остатком.
+    sequence = f"{table}_id_seq"
+    residue = (shard.index + 1) % shard_count
+    async with shard.engine.begin() as conn:
+        await conn.execute(text(f"ALTER SEQUENCE {sequence} INCREMENT BY {shard_count}"))
+        # Только вперёд: last_value читается в том же запросе, что и setval,
+        # поэтому id, выданные после подсчёта floor, не будут выданы повторно
+        await conn.execute(
+            text(
+                f"SELECT setval('{sequence}', current + 1 + ((:residue - (current + 1)) % :shard_count "
+                f"+ :shard_count) % :shard_count, false) "
+                f"FROM (SELECT GREATEST(last_value, :floor) AS current FROM {sequence}) AS s"
+            ),
+            {"residue": residue, "shard_count": shard_count, "floor": floor}
+        )
+
+
+async def align_shard_ids() -> None:
+    # Запускается один раз после смены числа шардов, до перезапуска воркеров
+    shard_count = len(shard_map.shards)
+    floors: Dict[str, int] = {table: 0 for table in ALIGNED_TABLES}
+    for shard in shard_map.shards:
+        for table, current in (await _max_ids(shard)).items():
+            floors[table] = max(floors[table], current)
+    for shard in shard_map.shards:
+        for table in ALIGNED_TABLES:
+            await _align_sequence(shard, table, shard_count, floors[table])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Обслуживание шардов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Число задач на каждом шарде")
+    move = commands.add_parser("move", help="Перенести пользователя на другой шард")
+    move.add_argument("user_id", type=int)
+    move.add_argument("shard", type=int)
+    commands.add_parser("pin", help="Закрепить пользователей за шардами, где лежат их данные")
+    commands.add_parser("align-ids", help="Выровнять последовательности id задач под число шардов")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        asyncio.run(print_status())
+    elif args.command == "align-ids":
+        asyncio.run(align_shard_ids())
+        print(f"✅ Последовательности id выровнены под {len(shard_map.shards)} шард(а/ов)")
+    elif args.command == "pin":
+        pinned = asyncio.run(pin_existing_users())
+        print(f"✅ Закреплено пользователей: {pinned}")
+    else:
+        asyncio.run(move_user(args.user_id, args.shard))
+
+
+if __name__ == "__main__":
+    main()
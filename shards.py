@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import os
+from bisect import bisect_right
+from typing import AsyncGenerator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from dotenv import load_dotenv
+from fastapi import Depends
+from sqlalchemy import select, func, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from database import (
+    engine, AsyncSessionLocal, init_db, set_statement_timeout, DB_POOL_SIZE, DB_MAX_OVERFLOW
+)
+from dependencies import get_current_user
+from models.shard import UserShardOverride
+from models.task import Task
+from models.user import User, UserRole
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Дополнительные базы (шарды 1..N). Шард 0 — всегда основная база DATABASE_URL,
+# в ней же хранятся пользователи и таблица переносов user_shard_overrides.
+SHARD_DATABASE_URLS = [
+    url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()
+]
+# range (по умолчанию): новый шард получает только новых пользователей — к
+# SHARD_RANGES добавляется граница больше текущего максимального id
+# (python shard_tools.py status), маршруты остальных не меняются.
+# hash: user_id % N — при изменении числа шардов почти все пользователи получают
+# другой шард; перед перезапуском с новой конфигурацией их закрепляют на старых
+# шардах командой python shard_tools.py pin.
+SHARD_STRATEGY = os.getenv("SHARD_STRATEGY", "range")  # range или hash
+# Для range: верхние границы user_id (не включительно) для шардов 0..N-2
+SHARD_RANGES = [
+    int(bound) for bound in os.getenv("SHARD_RANGES", "").split(",") if bound.strip()
+]
+
+T = TypeVar("T")
+
+
+class Shard:
+    def __init__(self, index: int, engine, session_factory: async_sessionmaker):
+        self.index = index
+        self.engine = engine
+        self.session_factory = session_factory
+
+    def session(self) -> AsyncSession:
+        session = self.session_factory()
+        session.info["shard_index"] = self.index
+        return session
+
+    def __repr__(self) -> str:
+        return f"<Shard(index={self.index})>"
+
+
+class ShardMap:
+    def __init__(self, shards: List[Shard], strategy: str = "hash", ranges: Optional[List[int]] = None):
+        if strategy == "range" and len(ranges or []) != len(shards) - 1:
+            raise ValueError("SHARD_RANGES должен содержать по одной границе на каждый шард, кроме последнего")
+        self.shards = shards
+        self.strategy = strategy
+        self.ranges = ranges or []
+        self.overrides: Dict[int, int] = {}
+
+    @property
+    def is_sharded(self) -> bool:
+        return len(self.shards) > 1
+
+    @property
+    def primary(self) -> Shard:
+        return self.shards[0]
+
+    def index_for_user(self, user_id: int) -> int:
+        if user_id in self.overrides:
+            return self.overrides[user_id]
+        return self.computed_index(user_id)
+
+    def computed_index(self, user_id: int) -> int:
+        # Шард по стратегии, без учёта переносов
+        if self.strategy == "range":
+            return bisect_right(self.ranges, user_id)
+        return user_id % len(self.shards)
+
+    def shard_for_user(self, user_id: int) -> Shard:
+        return self.shards[self.index_for_user(user_id)]
+
+    def shard_for_session(self, db: AsyncSession) -> Shard:
+        return self.shards[db.info.get("shard_index", 0)]
+
+    async def load_overrides(self) -> None:
+        if not self.is_sharded:
+            return
+        async with self.primary.session() as db:
+            result = await db.execute(select(UserShardOverride.user_id, UserShardOverride.shard))
+            self.overrides = {row.user_id: row.shard for row in result}
+
+    async def scatter(
+        self,
+        fn: Callable[[AsyncSession], Awaitable[T]],
+        timeout_route: Optional[str] = None
+    ) -> List[T]:
+        # Один и тот же запрос параллельно на всех шардах, результаты по порядку шардов
+        async def run(shard: Shard) -> T:
+            async with shard.session() as db:
+                if timeout_route:
+                    set_statement_timeout(db, timeout_route)
+                return await fn(db)
+        return await asyncio.gather(*(run(shard) for shard in self.shards))
+
+    async def scatter_scalars(self, statement, timeout_route: Optional[str] = None) -> list:
+        async def fetch(db: AsyncSession) -> list:
+            result = await db.execute(statement)
+            return result.scalars().all()
+
+        results = await self.scatter(fetch, timeout_route)
+        return [item for items in results for item in items]
+
+    async def locate_task(self, task_id: int) -> Shard:
+        # Идентификаторы задач уникальны между шардами (см. _align_task_ids)
+        if not self.is_sharded:
+            return self.primary
+
+        async def find(db: AsyncSession) -> bool:
+            result = await db.execute(select(Task.id).where(Task.id == task_id))
+            return result.scalar_one_or_none() is not None
+
+        found = await self.scatter(find)
+        for shard, exists in zip(self.shards, found):
+            if exists:
+                return shard
+        return self.primary
+
+
+def _build_shard_map() -> ShardMap:
+    shards = [Shard(0, engine, AsyncSessionLocal)]
+    for index, url in enumerate(SHARD_DATABASE_URLS, start=1):
+        shard_engine = create_async_engine(
+            url,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            connect_args={"statement_cache_size": 0}
+        )
+        shards.append(Shard(index, shard_engine, async_sessionmaker(
+            bind=shard_engine, autoflush=False, expire_on_commit=False
+        )))
+    return ShardMap(shards, SHARD_STRATEGY, SHARD_RANGES)
+
+
+shard_map = _build_shard_map()
+
+
+# Таблицы, строки которых переносятся между шардами вместе с пользователем
+ALIGNED_TABLES = ("tasks", "task_series")
+
+
+async def _warn_unaligned_ids() -> None:
+    # Выравнивание последовательностей — разовый шаг python shard_tools.py align-ids:
+    # при запуске его делать нельзя, работающие воркеры вставляют строки параллельно
+    shard_count = len(shard_map.shards)
+    for shard in shard_map.shards:
+        async with shard.engine.connect() as conn:
+            result = await conn.execute(
+                text(
+                    "SELECT sequencename FROM pg_sequences "
+                    "WHERE sequencename = ANY(:names) AND increment_by <> :shard_count"
+                ),
+                {"names": [f"{table}_id_seq" for table in ALIGNED_TABLES], "shard_count": shard_count}
+            )
+            unaligned = result.scalars().all()
+        if unaligned:
+            logger.warning(
+                "Последовательности id не выровнены под число шардов: id задач могут совпасть "
+                "на разных шардах. Выполните python shard_tools.py align-ids",
+                extra={"shard": shard.index, "sequences": unaligned}
+            )
+
+
+async def init_shards() -> None:
+    for shard in shard_map.shards:
+        await init_db(shard.engine)
+    if shard_map.is_sharded:
+        await _warn_unaligned_ids()
+    await shard_map.load_overrides()
+
+
+async def ensure_user_on_shard(user: User, shard: Optional[Shard] = None) -> None:
+    # На неосновном шарде нужна копия строки пользователя для внешних ключей
+    shard = shard or shard_map.shard_for_user(user.id)
+    if shard.index == 0:
+        return
+    async with shard.session() as db:
+        if await db.get(User, user.id) is None:
+            db.add(User(
+                id=user.id,
+                nickname=user.nickname,
+                email=user.email,
+                hashed_password="!",
+                role=user.role,
+                timezone=user.timezone
+            ))
+            await db.commit()
+
+
+async def count_tasks_by_user(timeout_route: Optional[str] = None) -> Dict[int, int]:
+    async def fetch(db: AsyncSession) -> list:
+        result = await db.execute(
+            select(Task.user_id, func.count(Task.id).label("task_count")).group_by(Task.user_id)
+        )
+        return result.all()
+
+    task_counts: Dict[int, int] = {}
+    for rows in await shard_map.scatter(fetch, timeout_route):
+        for row in rows:
+            task_counts[row.user_id] = task_counts.get(row.user_id, 0) + row.task_count
+    return task_counts
+
+
+async def get_shard_session(
+    current_user: User = Depends(get_current_user)
+) -> AsyncGenerator[AsyncSession, None]:
+    async with shard_map.shard_for_user(current_user.id).session() as session:
+        yield session
+
+
+def get_shard_session_with_timeout(route: str):
+    # Зависимость: сессия шарда пользователя с таймаутом запросов маршрута
+    async def dependency(
+        current_user: User = Depends(get_current_user)
+    ) -> AsyncGenerator[AsyncSession, None]:
+        async with shard_map.shard_for_user(current_user.id).session() as session:
+            set_statement_timeout(session, route)
+            yield session
+    return dependency
+
+
+async def get_task_shard_session(
+    task_id: int,
+    current_user: User = Depends(get_current_user)
+) -> AsyncGenerator[AsyncSession, None]:
+    # Админ может работать с чужой задачей — ищем шард, где она лежит
+    if current_user.role == UserRole.ADMIN:
+        shard = await shard_map.locate_task(task_id)
+    else:
+        shard = shard_map.shard_for_user(current_user.id)
+    async with shard.session() as session:
+        yield session
@@ -0,0 +1,287 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from cache import result_cache, RESULT_CACHE_TTL
+from metrics import metrics
+from models.task import Task
+
+load_dotenv()
+
+TASK_CACHE_ENABLED = os.getenv("TASK_CACHE_ENABLED", "1") == "1"
+TASK_CACHE_MAX_BYTES = int(os.getenv("TASK_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Пользователи с большим числом задач не кэшируются: их набор вытеснил бы всех остальных
+TASK_CACHE_MAX_USER_TASKS = int(os.getenv("TASK_CACHE_MAX_USER_TASKS", "2000"))
+# Версии в памяти видны только своему воркеру: запись через другой воркер
+# этот набор не сбросит. Набор старше TTL перечитывается из БД, поэтому TTL
+# не больше, чем у кэша ответов, — устаревание не дольше, чем у него
+TASK_CACHE_TTL = min(float(os.getenv("TASK_CACHE_TTL", str(RESULT_CACHE_TTL))), RESULT_CACHE_TTL)
+
+_CHANGES_KEY = "task_cache_changes"
+
+
+class TaskRecord:
+    """Компактная копия строки задачи без состояния ORM.
+
+    Атрибуты совпадают с Task, поэтому запись можно отдать в
+    TaskResponse.model_validate так же, как саму задачу.
+    """
+
+    __slots__ = (
+        "id", "title", "description", "is_important", "is_urgent", "quadrant",
+        "completed", "created_at", "completed_at", "deadline_at", "user_id", "series_id",
+    )
+
+    def __init__(self, task: Task):
+        for name in self.__slots__:
+            setattr(self, name, getattr(task, name))
+
+    def size_bytes(self) -> int:
+        # Булевы значения, None и строки квадрантов общие для всех записей
+        return sys.getsizeof(self) + sum(
+            sys.getsizeof(value)
+            for value in (self.title, self.description, self.created_at,
+                          self.completed_at, self.deadline_at)
+            if value is not None
+        )
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class UserTaskSet:
+    """Все задачи одного пользователя с индексами по квадранту и статусу."""
+
+    __slots__ = ("records", "by_quadrant", "by_status", "version", "loaded_at", "size_bytes")
+
+    def __init__(self, version: int):
+        self.records: Dict[int, TaskRecord] = {}
+        self.by_quadrant: Dict[str, Set[int]] = {}
+        self.by_status: Dict[bool, Set[int]] = {True: set(), False: set()}
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.size_bytes = sys.getsizeof(self)
+
+    def put(self, record: TaskRecord) -> None:
+        self.remove(record.id)
+        self.records[record.id] = record
+        self.by_quadrant.setdefault(record.quadrant, set()).add(record.id)
+        self.by_status[record.completed].add(record.id)
+        self.size_bytes += record.size_bytes()
+
+    def remove(self, task_id: int) -> None:
+        record = self.records.pop(task_id, None)
+        if record is None:
+            return
+        self.by_quadrant[record.quadrant].discard(task_id)
+        self.by_status[record.completed].discard(task_id)
+        self.size_bytes -= record.size_bytes()
+
+    def get(self, task_id: int) -> Optional[TaskRecord]:
+        return self.records.get(task_id)
+
+    def all(self) -> List[TaskRecord]:
+        return self._ordered(self.records)
+
+    def quadrant(self, quadrant: str) -> List[TaskRecord]:
+        return self._ordered(self.by_quadrant.get(quadrant, ()))
+
+    def status(self, completed: bool) -> List[TaskRecord]:
+        return self._ordered(self.by_status[completed])
+
+    def _ordered(self, task_ids: Iterable[int]) -> List[TaskRecord]:
+        return [self.records[task_id] for task_id in sorted(task_ids)]
+
+
+class TaskChanges:
+    # Задачи, записанные сессией: user_id -> {task_id: Task} и удалённые id
+    def __init__(self):
+        self.upserts: Dict[int, Dict[int, Task]] = {}
+        self.deleted: Dict[int, Set[int]] = {}
+
+    def upsert(self, task: Task) -> None:
+        self.deleted.get(task.user_id, set()).discard(task.id)
+        self.upserts.setdefault(task.user_id, {})[task.id] = task
+
+    def delete(self, task: Task) -> None:
+        self.upserts.get(task.user_id, {}).pop(task.id, None)
+        self.deleted.setdefault(task.user_id, set()).add(task.id)
+
+    def merge(self, other: "TaskChanges") -> None:
+        for tasks in other.upserts.values():
+            for task in tasks.values():
+                self.upsert(task)
+        for user_id, task_ids in other.deleted.items():
+            for task_id in task_ids:
+                self.upserts.get(user_id, {}).pop(task_id, None)
+                self.deleted.setdefault(user_id, set()).add(task_id)
+
+    def user_ids(self) -> Set[int]:
+        return set(self.upserts) | set(self.deleted)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_task_changes(session, flush_context):
+    # Запоминаем записанные задачи, чтобы после commit обновить рабочий набор
+    changes = session.info.get(_CHANGES_KEY)
+    if changes is None:
+        changes = session.info[_CHANGES_KEY] = TaskChanges()
+    for obj in chain(session.new, session.dirty):
+        if isinstance(obj, Task) and obj.user_id is not None:
+            changes.upsert(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Task) and obj.user_id is not None:
+            changes.delete(obj)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_task_changes(session):
+    session.info.pop(_CHANGES_KEY, None)
+
+
+class TaskWorkingSetCache:
+    """Рабочий набор задач активных пользователей в памяти воркера.
+
+    Согласованность держится на версиях кэша ответов (cache.result_cache):
+    набор действителен, пока версия пользователя не изменилась. Обработчики
+    после commit и сброса версии вызывают write_through — если с момента
+    загрузки набора версию сдвинула только эта запись, изменения применяются
+    к набору, иначе он выбрасывается и будет перечитан из БД.
+    """
+
+    def __init__(self, enabled: bool = TASK_CACHE_ENABLED,
+                 max_bytes: int = TASK_CACHE_MAX_BYTES,
+                 max_user_tasks: int = TASK_CACHE_MAX_USER_TASKS,
+                 ttl: float = TASK_CACHE_TTL):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_user_tasks = max_user_tasks
+        self.ttl = ttl
+        self.size_bytes = 0
+        self._sets: "OrderedDict[int, UserTaskSet]" = OrderedDict()
+
+    async def _fresh(self, user_id: int) -> Optional[UserTaskSet]:
+        task_set = self._sets.get(user_id)
+        if task_set is None:
+            return None
+        if (
+            task_set.version != await result_cache.user_version(user_id)
+            or time.monotonic() - task_set.loaded_at > self.ttl
+        ):
+            self._drop(user_id)
+            return None
+        self._sets.move_to_end(user_id)
+        return task_set
+
+    async def peek(self, user_id: int) -> Optional[UserTaskSet]:
+        # Набор из памяти без обращения к БД (None, если его нет или он устарел)
+        if not self.enabled:
+            return None
+        task_set = await self._fresh(user_id)
+        metrics.inc("task_cache.hit" if task_set is not None else "task_cache.miss")
+        return task_set
+
+    async def user_tasks(self, db: AsyncSession, user_id: int) -> UserTaskSet:
+        task_set = await self.peek(user_id)
+        if task_set is not None:
+            return task_set
+
+        # Версию читаем до запроса: запись, случившаяся во время чтения, сдвинет
+        # её, и загруженный набор не пройдёт следующую проверку
+        version = await result_cache.user_version(user_id)
+        result = await db.execute(select(Task).where(Task.user_id == user_id).order_by(Task.id))
+        task_set = UserTaskSet(version)
+        for task in result.scalars().all():
+            task_set.put(TaskRecord(task))
+
+        if self.enabled and len(task_set.records) <= self.max_user_tasks:
+            self._store(user_id, task_set)
+        return task_set
+
+    def take_changes(self, db: AsyncSession) -> TaskChanges:
+        return db.info.pop(_CHANGES_KEY, None) or TaskChanges()
+
+    async def write_through(self, db: AsyncSession) -> None:
+        # Вызывается после commit и result_cache.invalidate_*
+        await self.apply_changes(self.take_changes(db))
+
+    async def apply_changes(self, changes: TaskChanges) -> None:
+        if not self.enabled:
+            return
+        for user_id in changes.user_ids():
+            task_set = self._sets.get(user_id)
+            if task_set is None:
+                continue
+            version = await result_cache.user_version(user_id)
+            upserts = changes.upserts.get(user_id, {}).values()
+            # Истёкший атрибут строки — её значения неизвестны; связи (owner) не в счёт
+            if task_set.version + 1 != version or any(
+                inspect(task).expired_attributes.intersection(TaskRecord.__slots__) for task in upserts
+            ):
+                # Между загрузкой и этой записью были другие изменения
+                self._drop(user_id)
+                metrics.inc("task_cache.write_through_dropped")
+                continue
+
+            self.size_bytes -= task_set.size_bytes
+            for task_id in changes.deleted.get(user_id, ()):
+                task_set.remove(task_id)
+            for task in upserts:
+                task_set.put(TaskRecord(task))
+            task_set.version = version
+            self.size_bytes += task_set.size_bytes
+            metrics.inc("task_cache.write_through")
+            if len(task_set.records) > self.max_user_tasks:
+                self._drop(user_id)
+        self._evict()
+
+    def discard(self, user_id: int) -> None:
+        self._drop(user_id)
+
+    def _store(self, user_id: int, task_set: UserTaskSet) -> None:
+        if task_set.size_bytes > self.max_bytes:
+            return
+        self._drop(user_id)
+        self._sets[user_id] = task_set
+        self.size_bytes += task_set.size_bytes
+        self._evict()
+
+    def _evict(self) -> None:
+        # Вытесняем наборы давно не обращавшихся пользователей (LRU)
+        while self._sets and self.size_bytes > self.max_bytes:
+            self._drop(next(iter(self._sets)))
+            metrics.inc("task_cache.evicted")
+
+    def _drop(self, user_id: int) -> None:
+        task_set = self._sets.pop(user_id, None)
+        if task_set is not None:
+            self.size_bytes -= task_set.size_bytes
+
+    def stats(self) -> dict:
+        hits = metrics.get("task_cache.hit")
+        misses = metrics.get("task_cache.miss")
+        total = hits + misses
+        return {
+            "enabled": self.enabled,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "evicted": metrics.get("task_cache.evicted"),
+            "write_through": metrics.get("task_cache.write_through"),
+            "write_through_dropped": metrics.get("task_cache.write_through_dropped"),
+            "users": len(self._sets),
+            "tasks": sum(len(task_set.records) for task_set in self._sets.values()),
+            "size_bytes": self.size_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+
+task_cache = TaskWorkingSetCache()
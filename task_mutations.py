@@ -0,0 +1,128 @@
+from datetime import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from calendar_rollup import invalidate_rollups
+from models.series import TaskSeries
+from models.task import Task
+from models.user import User, UserRole
+from recurrence import RecurrenceRule
+from utils import calculate_urgency, determine_quadrant
+
+# Общие шаги изменения задачи: их используют и обработчики в routers/tasks.py,
+# и пакетная запись в write_coalescer.py, чтобы поведение не расходилось
+
+
+def check_task_access(task: Optional[Task], current_user: User) -> Task:
+    if not task:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+
+    # Проверка прав доступа
+    if current_user.role != UserRole.ADMIN and task.user_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Нет доступа к этой задаче"
+        )
+    return task
+
+
+async def materialize_next_occurrence(db: AsyncSession, series: TaskSeries) -> Optional[Task]:
+    # Создаёт задачу для следующего повтора серии; None, если правило исчерпано
+    try:
+        rule = RecurrenceRule.parse(series.rrule)
+    except ValueError:
+        # Правило, сохранённое до появления ограничений (например, огромный INTERVAL)
+        series.active = False
+        return None
+    occurrence_at = rule.next_after(series.dtstart, ZoneInfo(series.timezone), series.last_occurrence_at)
+    if occurrence_at is None:
+        series.active = False
+        return None
+
+    is_urgent = calculate_urgency(occurrence_at)
+    task = Task(
+        title=series.title,
+        description=series.description,
+        is_important=series.is_important,
+        is_urgent=is_urgent,
+        quadrant=determine_quadrant(series.is_important, is_urgent),
+        deadline_at=occurrence_at,
+        completed=False,
+        user_id=series.user_id,
+        series_id=series.id
+    )
+    db.add(task)
+    series.last_occurrence_at = occurrence_at
+    await invalidate_rollups(db, series.user_id, occurrence_at)
+    # Сессии без autoflush: следующая проверка в той же транзакции должна видеть задачу
+    await db.flush()
+    return task
+
+
+async def _advance_series(db: AsyncSession, task: Task) -> None:
+    # Блокировка строки серии: два одновременных завершения не создадут два повтора
+    result = await db.execute(
+        select(TaskSeries).where(TaskSeries.id == task.series_id).with_for_update()
+    )
+    series = result.scalar_one_or_none()
+    if series is None or not series.active:
+        return
+
+    # Следующий повтор нужен, только если у серии не осталось открытой задачи
+    result = await db.execute(
+        select(Task.id).where(
+            Task.series_id == series.id,
+            Task.completed == False,
+            Task.id != task.id
+        ).limit(1)
+    )
+    if result.scalar_one_or_none() is None:
+        await materialize_next_occurrence(db, series)
+
+
+async def apply_task_update(db: AsyncSession, task: Task, update_data: dict) -> Task:
+    # Обновляем только переданные поля
+    was_completed = task.completed
+    old_moments = (task.deadline_at, task.completed_at)
+    for field, value in update_data.items():
+        setattr(task, field, value)
+
+    # Пересчитываем квадрат, если изменились важность или дедлайн
+    if "is_important" in update_data or "deadline_at" in update_data:
+        task.is_urgent = calculate_urgency(task.deadline_at)
+        task.quadrant = determine_quadrant(task.is_important, task.is_urgent)
+
+    # Изменение уже закрытых дней календаря сбрасывает их агрегаты
+    if update_data.keys() & {"is_important", "deadline_at", "completed"}:
+        await invalidate_rollups(db, task.user_id, *old_moments, task.deadline_at, task.completed_at)
+
+    if task.series_id is not None and task.completed and not was_completed:
+        await _advance_series(db, task)
+    return task
+
+
+async def apply_task_complete(db: AsyncSession, task: Task) -> Task:
+    was_completed = task.completed
+    old_completed_at = task.completed_at
+    task.completed = True
+    task.completed_at = datetime.utcnow()
+    if was_completed:
+        # Повторное завершение переносит дату — день прежнего завершения пересчитывается
+        await invalidate_rollups(db, task.user_id, old_completed_at)
+    # Завершение повтора серии создаёт следующий
+    if task.series_id is not None and not was_completed:
+        await _advance_series(db, task)
+    return task
+
+
+async def apply_task_delete(db: AsyncSession, task: Task) -> None:
+    await db.delete(task)
+    await invalidate_rollups(db, task.user_id, task.deadline_at, task.completed_at)
+    # Удалённый открытый повтор пропускается: серия переходит к следующему,
+    # как при завершении (остановить серию — DELETE /tasks/recurring/{id})
+    if task.series_id is not None and not task.completed:
+        await _advance_series(db, task)
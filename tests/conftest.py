@@ -0,0 +1,127 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def _test_database_url() -> str:
+    # Своя база (TEST_DATABASE_URL) или временный PostgreSQL из пакета pgserver
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        return url
+    try:
+        import pgserver
+    except ImportError:
+        pytest.exit("Для тестов нужен TEST_DATABASE_URL или пакет pgserver", returncode=1)
+    server = pgserver.get_server(tempfile.mkdtemp(prefix="todo-test-pg-"), cleanup_mode="stop")
+    server.psql("CREATE DATABASE todo_test;")
+    server.psql("CREATE DATABASE todo_test_shard;")
+    # Сервер останавливается при завершении процесса
+    globals()["_pg_server"] = server
+    return server.get_uri("todo_test").replace("postgresql://", "postgresql+asyncpg://", 1)
+
+
+# Модули приложения читают настройки при импорте, поэтому окружение
+# задаётся до импорта main и остальных
+TEST_DATABASE_URL = _test_database_url()
+os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+os.environ.setdefault("TEST_SHARD_DATABASE_URL", TEST_DATABASE_URL.replace("/todo_test?", "/todo_test_shard?"))
+os.environ["RATE_LIMIT_ENABLED"] = "0"
+os.environ["DIGEST_ENABLED"] = "0"
+
+import httpx  # noqa: E402
+from sqlalchemy import String, cast, func, insert, literal, select, text, update  # noqa: E402
+
+from cache import set_cache_backend, InMemoryCacheBackend  # noqa: E402
+from database import Base, engine  # noqa: E402
+from idempotency import set_idempotency_store, InMemoryIdempotencyStore  # noqa: E402
+from main import app  # noqa: E402
+from models.task import Task  # noqa: E402
+from models.user import User, UserRole  # noqa: E402
+from rate_limit import set_rate_limit_backend, InMemoryRateLimitBackend  # noqa: E402
+from shards import shard_map, init_shards  # noqa: E402
+from task_cache import task_cache  # noqa: E402
+from token_epochs import token_epochs  # noqa: E402
+
+_schema_ready = False
+
+
+@pytest.fixture
+async def db_ready():
+    # Схема создаётся один раз, перед каждым тестом таблицы очищаются
+    global _schema_ready
+    if not _schema_ready:
+        await init_shards()
+        _schema_ready = True
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    async with engine.begin() as conn:
+        await conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+
+    set_cache_backend(InMemoryCacheBackend())
+    set_idempotency_store(InMemoryIdempotencyStore())
+    set_rate_limit_backend(InMemoryRateLimitBackend())
+    task_cache._sets.clear()
+    task_cache.size_bytes = 0
+    token_epochs._epochs.clear()
+    token_epochs._inactive.clear()
+    shard_map.overrides.clear()
+    yield
+    # Пул соединений привязан к циклу событий теста
+    app.dependency_overrides.clear()
+    for shard in shard_map.shards:
+        await shard.engine.dispose()
+
+
+@pytest.fixture
+async def client(db_ready):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test/api/v3") as client:
+        yield client
+
+
+async def register_user(client: httpx.AsyncClient, nickname: str, admin: bool = False):
+    # Регистрирует пользователя, возвращает его id и заголовки с access-токеном
+    email = f"{nickname}@example.com"
+    response = await client.post("/auth/register", json={
+        "nickname": nickname, "email": email, "password": "secret123"
+    })
+    assert response.status_code == 201, response.text
+    user_id = response.json()["id"]
+    if admin:
+        async with shard_map.primary.session() as db:
+            await db.execute(update(User).where(User.id == user_id).values(role=UserRole.ADMIN))
+            await db.commit()
+    response = await client.post("/auth/login", data={"username": email, "password": "secret123"})
+    assert response.status_code == 200, response.text
+    return user_id, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def add_tasks(user_id: int, count: int = 1, title: str = "задача", quadrant: str = "Q4", **fields) -> list:
+    # Вставляет задачи напрямую в основной шард, минуя API: для больших объёмов
+    # и задач с произвольными датами. При count > 1 к названию добавляется номер.
+    # Возвращает id созданных задач
+    values = {
+        "is_important": quadrant in ("Q1", "Q2"),
+        "is_urgent": quadrant in ("Q1", "Q3"),
+        "completed": False,
+        **fields,
+        "quadrant": quadrant,
+        "user_id": user_id,
+    }
+    series = func.generate_series(1, count).table_valued("n").render_derived()
+    title_expr = literal(title) if count == 1 else literal(title + " ") + cast(series.c.n, String)
+    columns = [Task.__table__.c[name] for name in values]
+    source = select(
+        title_expr, *(literal(value, column.type) for column, value in zip(columns, values.values()))
+    ).select_from(series)
+    async with shard_map.primary.session() as db:
+        result = await db.execute(
+            insert(Task).from_select([Task.__table__.c.title, *columns], source).returning(Task.id)
+        )
+        ids = list(result.scalars().all())
+        await db.commit()
+    return ids
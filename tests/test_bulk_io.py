@@ -0,0 +1,61 @@
+import json
+
+import bulk_io
+from conftest import register_user
+
+
+def _ndjson(*rows: dict) -> bytes:
+    return "\n".join(json.dumps(row, ensure_ascii=False) for row in rows).encode("utf-8")
+
+
+async def test_import_in_batches_and_export(client, monkeypatch):
+    monkeypatch.setattr(bulk_io, "IMPORT_BATCH_SIZE", 2)
+    _, headers = await register_user(client, "porter")
+    body = _ndjson(*({"title": f"задача {n}", "is_important": n == 0} for n in range(5)))
+
+    response = await client.post("/tasks/import?format=ndjson", headers=headers, content=body)
+    assert response.status_code == 201
+    assert response.json()["imported"] == 5
+
+    exported = (await client.get("/tasks/export?format=ndjson", headers=headers)).text.splitlines()
+    rows = [json.loads(line) for line in exported]
+    assert [(row["title"], row["quadrant"]) for row in rows] == [
+        ("задача 0", "Q2"), ("задача 1", "Q4"), ("задача 2", "Q4"), ("задача 3", "Q4"), ("задача 4", "Q4")
+    ]
+
+
+async def test_csv_import(client):
+    _, headers = await register_user(client, "csv")
+    body = "title,description,is_important\nпервая,,true\nвторая,текст,false\n".encode("utf-8")
+    response = await client.post("/tasks/import", headers={**headers, "content-type": "text/csv"}, content=body)
+    assert response.status_code == 201
+    tasks = (await client.get("/tasks", headers=headers)).json()
+    assert sorted((task["title"], task["description"]) for task in tasks) == [("вторая", "текст"), ("первая", None)]
+
+
+async def test_invalid_rows_cancel_whole_import(client):
+    _, headers = await register_user(client, "careless")
+    body = _ndjson({"title": "верная", "is_important": False}, {"is_important": True}) + b"\n{broken"
+
+    response = await client.post("/tasks/import?format=ndjson", headers=headers, content=body)
+    assert response.status_code == 422
+    assert [error["line"] for error in response.json()["detail"]["errors"]] == [2, 3]
+    assert (await client.get("/tasks", headers=headers)).json() == []
+
+
+async def test_oversized_body_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(bulk_io, "IMPORT_MAX_BYTES", 100)
+    _, headers = await register_user(client, "greedy")
+    body = _ndjson(*({"title": f"задача {n}", "is_important": False} for n in range(10)))
+
+    response = await client.post("/tasks/import?format=ndjson", headers=headers, content=body)
+    assert response.status_code == 413
+
+    # Без Content-Length размер проверяется по мере чтения тела
+    async def chunks():
+        for start in range(0, len(body), 64):
+            yield body[start:start + 64]
+
+    response = await client.post("/tasks/import?format=ndjson", headers=headers, content=chunks())
+    assert response.status_code == 413
+    assert (await client.get("/tasks", headers=headers)).json() == []
@@ -0,0 +1,81 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select, update
+
+from calendar_rollup import get_calendar, invalidate_rollups
+from models.rollup import CalendarRollup
+from models.task import Task
+from shards import shard_map
+from conftest import add_tasks, register_user
+
+
+def _days_ago(days: int) -> datetime:
+    return datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0) - timedelta(days=days)
+
+
+def _completions(buckets: list) -> dict:
+    return {
+        str(bucket["start"]): sum(bucket["completions"].values())
+        for bucket in buckets
+        if sum(bucket["completions"].values())
+    }
+
+
+async def _calendar(user_id: int, days: int = 7) -> list:
+    today = datetime.now(timezone.utc).date()
+    async with shard_map.primary.session() as db:
+        return await get_calendar(db, user_id, "UTC", today - timedelta(days=days), today, "day")
+
+
+async def test_concurrent_first_requests_fill_rollups_once(client):
+    user_id, _ = await register_user(client, "calendar")
+    await add_tasks(user_id, quadrant="Q2", deadline_at=_days_ago(3))
+    await add_tasks(user_id, quadrant="Q2", completed=True, completed_at=_days_ago(2))
+
+    results = await asyncio.gather(*(_calendar(user_id) for _ in range(8)))
+    assert all(result == results[0] for result in results)
+
+    async with shard_map.primary.session() as db:
+        rows = (await db.execute(select(CalendarRollup).where(CalendarRollup.user_id == user_id))).scalars().all()
+    assert sorted((row.day, row.deadlines, row.completions) for row in rows) == [
+        (_days_ago(3).date(), 1, 0),
+        (_days_ago(2).date(), 0, 1),
+    ]
+
+
+async def test_fill_waits_for_uncommitted_invalidation(client):
+    user_id, _ = await register_user(client, "calendar2")
+    [task_id] = await add_tasks(user_id, quadrant="Q2", deadline_at=_days_ago(3))
+
+    async with shard_map.primary.session() as writer:
+        # Запись сбросила агрегаты, но ещё не закоммичена; первое заполнение
+        # должно дождаться её, иначе запишет в агрегаты устаревшие счётчики
+        await invalidate_rollups(writer, user_id, _days_ago(2))
+        await writer.execute(
+            update(Task).where(Task.id == task_id).values(completed=True, completed_at=_days_ago(2))
+        )
+        reader = asyncio.create_task(_calendar(user_id))
+        await asyncio.sleep(0.2)
+        assert not reader.done()
+        await writer.commit()
+
+    assert _completions(await reader) == {_days_ago(2).date().isoformat(): 1}
+
+
+async def test_completing_again_moves_completion_out_of_closed_day(client):
+    user_id, headers = await register_user(client, "calendar3")
+    response = await client.post("/tasks/", headers=headers, json={"title": "Отчёт", "is_important": True})
+    task_id = response.json()["id"]
+    await client.patch(f"/tasks/{task_id}/complete", headers=headers)
+    async with shard_map.primary.session() as db:
+        await db.execute(update(Task).where(Task.id == task_id).values(completed_at=_days_ago(3)))
+        await db.commit()
+
+    params = {"from": _days_ago(5).date().isoformat(), "to": _days_ago(0).date().isoformat()}
+    response = await client.get("/stats/calendar", params=params, headers=headers)
+    assert _completions(response.json()["buckets"]) == {_days_ago(3).date().isoformat(): 1}
+
+    await client.patch(f"/tasks/{task_id}/complete", headers=headers)
+    response = await client.get("/stats/calendar", params=params, headers=headers)
+    assert _completions(response.json()["buckets"]) == {_days_ago(0).date().isoformat(): 1}
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import text
+
+import digest
+from digest import DigestOutbox, set_digest_outbox, run_daily_digest, digest_pending, resume_digest
+from shards import shard_map
+from conftest import add_tasks, register_user
+
+
+class MemoryOutbox(DigestOutbox):
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, recipient: dict, digest: dict) -> None:
+        self.sent.append((recipient["email"], digest))
+
+
+@pytest.fixture
+def outbox(db_ready, monkeypatch):
+    monkeypatch.setattr(digest, "DIGEST_ENABLED", True)
+    previous = digest.digest_outbox
+    outbox = MemoryOutbox()
+    set_digest_outbox(outbox)
+    yield outbox
+    set_digest_outbox(previous)
+
+
+def _in_days(days: int) -> datetime:
+    return datetime.now(timezone.utc) + timedelta(days=days)
+
+
+async def test_digest_is_sent_once_per_day(client, outbox):
+    user_id, _ = await register_user(client, "reader")
+    await register_user(client, "idle")
+    await add_tasks(user_id, title="горит", quadrant="Q1", deadline_at=_in_days(1))
+    await add_tasks(user_id, title="опоздал", quadrant="Q2", deadline_at=_in_days(-1))
+
+    await run_daily_digest()
+    assert [email for email, _ in outbox.sent] == ["reader@example.com"]
+    _, sent = outbox.sent[0]
+    assert [item["title"] for item in sent["q1"]] == ["горит"]
+    assert [item["title"] for item in sent["overdue"]] == ["опоздал"]
+
+    # Контрольная точка в основной базе: другой хост, запустивший рассылку позже,
+    # видит её завершённой
+    async with shard_map.primary.session() as db:
+        row = (await db.execute(text("SELECT users, sent, completed FROM digest_runs"))).one()
+    assert tuple(row) == (2, 1, True)
+    assert not await digest_pending()
+    await run_daily_digest()
+    assert len(outbox.sent) == 1
+
+
+async def test_interrupted_run_is_resumed_after_checkpoint(client, outbox):
+    first_id, _ = await register_user(client, "early")
+    second_id, _ = await register_user(client, "late")
+    for user_id in (first_id, second_id):
+        await add_tasks(user_id, title="горит", quadrant="Q1", deadline_at=_in_days(1))
+    # Процесс на другом хосте упал после первой пачки
+    async with shard_map.primary.session() as db:
+        await db.execute(text(
+            "INSERT INTO digest_runs (run_date, last_user_id, users, sent, completed) "
+            "VALUES ((now() AT TIME ZONE 'UTC')::date, :last_user_id, 1, 1, false)"
+        ), {"last_user_id": first_id})
+        await db.commit()
+
+    assert await digest_pending()
+    await resume_digest()
+    assert [email for email, _ in outbox.sent] == ["late@example.com"]
+    async with shard_map.primary.session() as db:
+        row = (await db.execute(text("SELECT users, sent, completed FROM digest_runs"))).one()
+    assert tuple(row) == (2, 2, True)
+
+
+async def test_second_process_skips_while_lock_is_held(client, outbox):
+    user_id, _ = await register_user(client, "reader2")
+    await add_tasks(user_id, title="горит", quadrant="Q1", deadline_at=_in_days(1))
+
+    # Другой процесс (или хост) уже формирует дайджест
+    async with shard_map.primary.engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:namespace, 0)"), {"namespace": digest.DIGEST_LOCK_NAMESPACE})
+        await run_daily_digest()
+        assert outbox.sent == []
+        await conn.execute(text("SELECT pg_advisory_unlock(:namespace, 0)"), {"namespace": digest.DIGEST_LOCK_NAMESPACE})
+        await conn.commit()
+
+    await run_daily_digest()
+    assert len(outbox.sent) == 1
+
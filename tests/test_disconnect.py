@@ -0,0 +1,54 @@
+import asyncio
+
+from disconnect import DisconnectCancelMiddleware
+from metrics import metrics
+
+
+async def _call(method: str, path: str, respond_first: bool = False) -> str:
+    # Клиент отключается, пока приложение ещё работает; возвращает, чем оно закончилось
+    outcome = "running"
+
+    async def slow_app(scope, receive, send):
+        nonlocal outcome
+        try:
+            if respond_first:
+                await send({"type": "http.response.start", "status": 200, "headers": []})
+                await send({"type": "http.response.body", "body": b"[]"})
+            await asyncio.sleep(0.1)
+            outcome = "finished"
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(0.01)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    scope = {"type": "http", "method": method, "path": path}
+    await DisconnectCancelMiddleware(slow_app)(scope, receive, send)
+    return outcome
+
+
+async def test_read_is_cancelled_on_disconnect():
+    assert await _call("GET", "/api/v3/tasks") == "cancelled"
+
+
+async def test_cleanup_after_full_response_is_not_cancelled():
+    cancelled = metrics.get("requests.cancelled_on_disconnect")
+    assert await _call("GET", "/api/v3/tasks", respond_first=True) == "finished"
+    assert metrics.get("requests.cancelled_on_disconnect") == cancelled
+
+
+async def test_writes_are_not_cancelled():
+    assert await _call("POST", "/api/v3/tasks/") == "finished"
+
+
+async def test_calendar_fills_rollups_and_is_not_cancelled():
+    assert await _call("GET", "/api/v3/stats/calendar") == "finished"
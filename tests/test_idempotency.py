@@ -0,0 +1,71 @@
+import asyncio
+
+from idempotency import InMemoryIdempotencyStore, IdempotencyRecord
+from conftest import register_user
+
+
+async def _titles(client, headers) -> list:
+    return [task["title"] for task in (await client.get("/tasks", headers=headers)).json()]
+
+
+async def test_retry_replays_saved_response(client):
+    _, headers = await register_user(client, "retrier")
+    keyed = {**headers, "Idempotency-Key": "create-1"}
+    payload = {"title": "один раз", "is_important": False}
+
+    first = await client.post("/tasks/", headers=keyed, json=payload)
+    retry = await client.post("/tasks/", headers=keyed, json=payload)
+    assert (first.status_code, retry.status_code) == (201, 201)
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert await _titles(client, headers) == ["один раз"]
+
+
+async def test_concurrent_retries_create_one_task(client):
+    _, headers = await register_user(client, "impatient")
+    keyed = {**headers, "Idempotency-Key": "create-2"}
+    payload = {"title": "параллельно", "is_important": True}
+
+    responses = await asyncio.gather(*(client.post("/tasks/", headers=keyed, json=payload) for _ in range(5)))
+    assert len({response.json()["id"] for response in responses}) == 1
+    assert await _titles(client, headers) == ["параллельно"]
+
+
+async def test_key_reused_with_other_body_is_rejected(client):
+    _, headers = await register_user(client, "sloppy")
+    keyed = {**headers, "Idempotency-Key": "create-3"}
+    await client.post("/tasks/", headers=keyed, json={"title": "первая", "is_important": False})
+
+    response = await client.post("/tasks/", headers=keyed, json={"title": "другая", "is_important": False})
+    assert response.status_code == 422
+    assert await _titles(client, headers) == ["первая"]
+
+
+async def test_client_errors_are_replayed_and_keys_are_per_user(client):
+    _, headers = await register_user(client, "owner")
+    _, other = await register_user(client, "other")
+    task_id = (await client.post("/tasks/", headers=headers, json={"title": "моя", "is_important": False})).json()["id"]
+
+    # Тот же ключ у другого пользователя — отдельный запрос
+    foreign = await client.delete(f"/tasks/{task_id}", headers={**other, "Idempotency-Key": "delete-1"})
+    assert foreign.status_code == 403
+    replayed = await client.delete(f"/tasks/{task_id}", headers={**other, "Idempotency-Key": "delete-1"})
+    assert (replayed.status_code, replayed.headers["Idempotent-Replayed"]) == (403, "true")
+
+    own = await client.delete(f"/tasks/{task_id}", headers={**headers, "Idempotency-Key": "delete-1"})
+    assert own.status_code == 200
+    assert await _titles(client, headers) == []
+
+
+async def test_store_evicts_expired_and_oldest(monkeypatch):
+    store = InMemoryIdempotencyStore(max_entries=2)
+    now = 1000.0
+    monkeypatch.setattr("idempotency.time.time", lambda: now)
+    for key, expires_at in (("a", 1500.0), ("b", 2000.0), ("c", 2000.0)):
+        await store.put(key, IdempotencyRecord("f", 200, b"{}", expires_at))
+    assert await store.get("a") is None
+
+    now = 1800.0
+    assert await store.get("b") is not None
+    now = 2100.0
+    assert await store.get("c") is None
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+from conftest import add_tasks, register_user
+
+
+async def _add_tasks(user_id: int, rows: list) -> None:
+    # rows: (название, квадрант, дедлайн через N дней или None, завершена)
+    now = datetime.now(timezone.utc)
+    for title, quadrant, days, completed in rows:
+        deadline_at = None if days is None else now + timedelta(days=days)
+        await add_tasks(user_id, title=title, quadrant=quadrant, completed=completed, deadline_at=deadline_at)
+
+
+async def _titles(client, headers, **params) -> list:
+    response = await client.get("/tasks/next", headers=headers, params=params)
+    assert response.status_code == 200
+    return [task["title"] for task in response.json()]
+
+
+async def test_next_orders_by_quadrant_then_deadline(client):
+    user_id, headers = await register_user(client, "focused")
+    await _add_tasks(user_id, [
+        ("q2 без срока", "Q2", None, False),
+        ("q2 через 5", "Q2", 5, False),
+        ("q1 через 2", "Q1", 2, False),
+        ("q1 через 1", "Q1", 1, False),
+        ("q1 сделана", "Q1", 0, True),
+        ("q4 через 1", "Q4", 1, False),
+    ])
+
+    assert await _titles(client, headers) == [
+        "q1 через 1", "q1 через 2", "q2 через 5", "q2 без срока", "q4 через 1"
+    ]
+    assert await _titles(client, headers, k=2) == ["q1 через 1", "q1 через 2"]
+    assert await _titles(client, headers, quadrant="Q2") == ["q2 через 5", "q2 без срока"]
+    assert await _titles(client, headers, horizon_days=3) == ["q1 через 1", "q1 через 2", "q4 через 1"]
+
+
+async def test_admin_sees_top_k_of_all_users(client):
+    first_id, first = await register_user(client, "first")
+    second_id, _ = await register_user(client, "second")
+    _, admin = await register_user(client, "boss", admin=True)
+    await _add_tasks(first_id, [("первый q2", "Q2", 1, False), ("первый q1", "Q1", 3, False)])
+    await _add_tasks(second_id, [("второй q1", "Q1", 1, False)])
+
+    assert await _titles(client, admin, k=2) == ["второй q1", "первый q1"]
+    assert await _titles(client, first) == ["первый q1", "первый q2"]
@@ -0,0 +1,102 @@
+import json
+
+from sqlalchemy import func, select, text
+
+import routers.auth
+import user_deletion
+from models.quadrant_history import QuadrantTransition
+from shards import shard_map
+from conftest import register_user
+
+
+async def _transitions(user_id: int) -> list:
+    async with shard_map.primary.session() as db:
+        result = await db.execute(
+            select(QuadrantTransition.from_quadrant, QuadrantTransition.to_quadrant, QuadrantTransition.cause)
+            .where(QuadrantTransition.user_id == user_id)
+            .order_by(QuadrantTransition.id)
+        )
+        return [tuple(row) for row in result.all()]
+
+
+async def test_transitions_and_dwell_follow_task_lifecycle(client):
+    user_id, headers = await register_user(client, "lifecycle")
+    task = (await client.post("/tasks/", headers=headers, json={"title": "отчёт", "is_important": False})).json()
+    await client.put(f"/tasks/{task['id']}", headers=headers, json={"is_important": True})
+    await client.patch(f"/tasks/{task['id']}/complete", headers=headers)
+
+    assert await _transitions(user_id) == [
+        (None, "Q4", "create"), ("Q4", "Q2", "update"), ("Q2", None, "complete")
+    ]
+    quadrants = (await client.get("/stats/quadrants/dwell", headers=headers)).json()["quadrants"]
+    assert [(q["quadrant"], q["exits"], list(q["exits_to"])) for q in quadrants] == [
+        ("Q2", 1, ["completed"]), ("Q4", 1, ["Q2"])
+    ]
+
+
+async def test_imported_tasks_get_create_transitions(client):
+    user_id, headers = await register_user(client, "importer")
+    body = "\n".join(json.dumps({"title": f"задача {n}", "is_important": n % 2 == 0}) for n in range(3))
+    response = await client.post("/tasks/import?format=ndjson", headers=headers, content=body.encode("utf-8"))
+    assert response.status_code == 201
+
+    assert sorted(await _transitions(user_id)) == [
+        (None, "Q2", "create"), (None, "Q2", "create"), (None, "Q4", "create")
+    ]
+    # Время в квадранте считается с момента импорта
+    task_id = (await client.get("/tasks", headers=headers)).json()[0]["id"]
+    await client.patch(f"/tasks/{task_id}/complete", headers=headers)
+    async with shard_map.primary.session() as db:
+        dwell = await db.scalar(text(
+            "SELECT sum(dwell_seconds) FROM task_quadrant_dwell WHERE user_id = :user_id"
+        ), {"user_id": user_id})
+    assert 0 <= dwell < 60
+
+
+async def test_deletion_job_removes_log_in_batches(client, monkeypatch):
+    monkeypatch.setattr(routers.auth, "USER_DELETE_SYNC_LIMIT", 0)
+    monkeypatch.setattr(user_deletion, "USER_DELETE_BATCH_SIZE", 2)
+    user_id, headers = await register_user(client, "historian")
+    _, admin = await register_user(client, "admin", admin=True)
+    task = (await client.post("/tasks/", headers=headers, json={"title": "туда-сюда", "is_important": False})).json()
+    for n in range(4):
+        await client.put(f"/tasks/{task['id']}", headers=headers, json={"is_important": n % 2 == 0})
+    assert len(await _transitions(user_id)) == 5
+
+    batches = []
+    original = user_deletion._delete_in_batches
+
+    async def counting(user_id, statement):
+        async for deleted in original(user_id, statement):
+            if statement is user_deletion._DELETE_TRANSITION_BATCH:
+                batches.append(deleted)
+            yield deleted
+
+    monkeypatch.setattr(user_deletion, "_delete_in_batches", counting)
+    assert (await client.delete(f"/auth/admin/users/{user_id}", headers=admin)).status_code == 202
+    await user_deletion._running[user_id]
+
+    assert batches == [2, 2, 1]
+    async with shard_map.primary.session() as db:
+        left = await db.scalar(select(func.count()).select_from(QuadrantTransition).where(
+            QuadrantTransition.user_id == user_id
+        ))
+    assert left == 0
+
+
+async def test_tasks_from_before_the_log_count_dwell_from_creation(client):
+    user_id, headers = await register_user(client, "oldtimer")
+    task = (await client.post("/tasks/", headers=headers, json={"title": "давняя", "is_important": False})).json()
+    # Задача создана до появления колонки: quadrant_changed_at не заполнен
+    async with shard_map.primary.session() as db:
+        await db.execute(text(
+            "UPDATE tasks SET quadrant_changed_at = NULL, created_at = now() - interval '2 hours' WHERE id = :id"
+        ), {"id": task["id"]})
+        await db.commit()
+
+    await client.put(f"/tasks/{task['id']}", headers=headers, json={"is_important": True})
+    async with shard_map.primary.session() as db:
+        dwell = await db.scalar(text(
+            "SELECT dwell_seconds FROM task_quadrant_dwell WHERE user_id = :user_id AND quadrant = 'Q4'"
+        ), {"user_id": user_id})
+    assert 7190 < dwell < 7300
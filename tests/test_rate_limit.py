@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+
+import rate_limit
+from rate_limit import ConcurrencyLimitMiddleware, InMemoryRateLimitBackend
+from conftest import register_user
+
+
+async def test_bucket_allows_burst_then_asks_to_wait():
+    backend = InMemoryRateLimitBackend()
+    for _ in range(3):
+        assert await backend.take("cheap:1", rate=1, capacity=3) == 0
+    retry_after = await backend.take("cheap:1", rate=1, capacity=3)
+    assert 0 < retry_after <= 1
+    # Бюджеты разных пользователей независимы
+    assert await backend.take("cheap:2", rate=1, capacity=3) == 0
+
+
+async def test_bucket_evicts_least_recently_used_keys():
+    backend = InMemoryRateLimitBackend(max_keys=2)
+    await backend.take("a", 1, 1)
+    await backend.take("b", 1, 1)
+    await backend.take("c", 1, 1)
+    assert list(backend._buckets) == ["b", "c"]
+
+
+async def test_expensive_route_returns_429_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_ENABLED", True)
+    monkeypatch.setattr(rate_limit, "EXPENSIVE_RATE", 0.01)
+    monkeypatch.setattr(rate_limit, "EXPENSIVE_BURST", 2)
+    _, headers = await register_user(client, "limited")
+
+    statuses = [(await client.get("/tasks", headers=headers)).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+    response = await client.get("/tasks", headers=headers)
+    assert int(response.headers["Retry-After"]) >= 1
+    # Дешёвые запросы считаются в отдельном бюджете
+    assert (await client.get("/tasks/quadrant/Q1", headers=headers)).status_code == 200
+
+
+async def test_concurrency_limit_rejects_with_503():
+    release = asyncio.Event()
+
+    async def slow_app(scope, receive, send):
+        await release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    limited = ConcurrencyLimitMiddleware(slow_app, limit=1, queue_timeout=0.05)
+    transport = httpx.ASGITransport(app=limited)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        first = asyncio.create_task(client.get("/"))
+        await asyncio.sleep(0.01)
+        second = await client.get("/")
+        release.set()
+        assert (await first).status_code == 200
+    assert second.status_code == 503
+    assert "Retry-After" in second.headers
@@ -0,0 +1,156 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+from sqlalchemy import text
+
+from recurrence import RecurrenceRule
+from shards import shard_map
+from conftest import register_user
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+
+def _utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_daily_keeps_local_time_across_dst():
+    rule = RecurrenceRule.parse("FREQ=DAILY;COUNT=3")
+    # 28.03.2026 09:00 по Берлину (UTC+1), с 29.03 — летнее время (UTC+2)
+    assert list(rule.occurrences(_utc(2026, 3, 28, 8), BERLIN)) == [
+        _utc(2026, 3, 28, 8), _utc(2026, 3, 29, 7), _utc(2026, 3, 30, 7)
+    ]
+
+
+def test_weekly_by_day_and_until():
+    rule = RecurrenceRule.parse("RRULE:FREQ=WEEKLY;BYDAY=FR,MO;UNTIL=20270113")
+    # 04.01.2027 — понедельник
+    assert list(rule.occurrences(_utc(2027, 1, 4, 10), timezone.utc)) == [
+        _utc(2027, 1, 4, 10), _utc(2027, 1, 8, 10), _utc(2027, 1, 11, 10)
+    ]
+
+
+def test_monthly_skips_short_months():
+    rule = RecurrenceRule.parse("FREQ=MONTHLY")
+    assert rule.between(_utc(2027, 1, 31, 12), timezone.utc, _utc(2027, 1, 1), _utc(2027, 6, 1), 10) == [
+        _utc(2027, 1, 31, 12), _utc(2027, 3, 31, 12), _utc(2027, 5, 31, 12)
+    ]
+
+
+def test_next_after_with_count_and_interval():
+    rule = RecurrenceRule.parse("FREQ=DAILY;INTERVAL=2;COUNT=3")
+    start = _utc(2027, 1, 1, 9)
+    assert rule.next_after(start, timezone.utc, None) == start
+    assert rule.next_after(start, timezone.utc, _utc(2027, 1, 3, 9)) == _utc(2027, 1, 5, 9)
+    assert rule.next_after(start, timezone.utc, _utc(2027, 1, 5, 9)) is None
+
+
+@pytest.mark.parametrize("value", [
+    "FREQ=YEARLY", "FREQ=DAILY;BYDAY=MO", "FREQ=DAILY;COUNT=2;UNTIL=20270101",
+    "FREQ=WEEKLY;BYDAY=XX", "FREQ=DAILY;INTERVAL=0", "FREQ=DAILY;BYHOUR=9",
+    "FREQ=DAILY;INTERVAL=99999999", "FREQ=DAILY;COUNT=10001",
+])
+def test_invalid_rules_are_rejected(value):
+    with pytest.raises(ValueError):
+        RecurrenceRule.parse(value)
+
+
+def test_rule_past_datetime_range_is_exhausted():
+    # Правила, сохранённые до ограничений INTERVAL, не падают с OverflowError
+    start = _utc(2027, 1, 1, 9)
+    daily = RecurrenceRule(freq="DAILY", interval=99999999)
+    assert list(daily.occurrences(start, timezone.utc)) == [start]
+    assert daily.next_after(start, timezone.utc, start) is None
+    monthly = RecurrenceRule(freq="MONTHLY", interval=100000)
+    assert monthly.between(start, timezone.utc, start, _utc(9999, 1, 1), 10) == [start]
+
+
+async def test_huge_interval_is_rejected_by_api(client):
+    _, headers = await register_user(client, "overflow")
+    response = await client.post("/tasks/recurring", headers=headers, json={
+        "title": "никогда", "is_important": False,
+        "rrule": "FREQ=DAILY;INTERVAL=99999999", "dtstart": "2027-01-01T09:00:00Z"
+    })
+    assert response.status_code == 422
+
+
+async def test_stored_rule_out_of_bounds_stops_series(client):
+    user_id, headers = await register_user(client, "legacy")
+    series = (await client.post("/tasks/recurring", headers=headers, json={
+        "title": "старая серия", "is_important": False,
+        "rrule": "FREQ=DAILY", "dtstart": "2027-01-01T09:00:00Z"
+    })).json()
+    # Серия, созданная до ограничения INTERVAL
+    async with shard_map.primary.session() as db:
+        await db.execute(text("UPDATE task_series SET rrule = 'FREQ=DAILY;INTERVAL=99999999'"))
+        await db.commit()
+
+    response = await client.get("/tasks/occurrences", headers=headers, params={
+        "from": "2027-01-01T00:00:00Z", "to": "2027-01-05T00:00:00Z"
+    })
+    assert [item["is_virtual"] for item in response.json()] == [False]
+    response = await client.patch(f"/tasks/{series['next_task']['id']}/complete", headers=headers)
+    assert response.status_code == 200
+    async with shard_map.primary.session() as db:
+        assert await db.scalar(text("SELECT active FROM task_series")) is False
+
+
+async def test_completing_occurrence_creates_next_one(client):
+    _, headers = await register_user(client, "routine")
+    response = await client.post("/tasks/recurring", headers=headers, json={
+        "title": "планёрка", "is_important": True,
+        "rrule": "FREQ=WEEKLY;COUNT=2", "dtstart": "2027-01-04T09:00:00Z"
+    })
+    assert response.status_code == 201
+    series = response.json()
+    first = series["next_task"]
+    assert first["deadline_at"].startswith("2027-01-04T09:00:00")
+
+    await client.patch(f"/tasks/{first['id']}/complete", headers=headers)
+    # Повторное завершение не создаёт лишний повтор
+    await client.patch(f"/tasks/{first['id']}/complete", headers=headers)
+    open_tasks = [task for task in (await client.get("/tasks", headers=headers)).json() if not task["completed"]]
+    assert [task["deadline_at"][:19] for task in open_tasks] == ["2027-01-11T09:00:00"]
+
+    # COUNT=2 исчерпан: после второго повтора новых задач нет
+    await client.patch(f"/tasks/{open_tasks[0]['id']}/complete", headers=headers)
+    tasks = (await client.get("/tasks", headers=headers)).json()
+    assert len(tasks) == 2 and all(task["completed"] for task in tasks)
+
+
+async def test_deleting_open_occurrence_advances_series(client):
+    _, headers = await register_user(client, "skipper")
+    series = (await client.post("/tasks/recurring", headers=headers, json={
+        "title": "отчёт", "is_important": False,
+        "rrule": "FREQ=DAILY;COUNT=2", "dtstart": "2027-01-01T09:00:00Z"
+    })).json()
+
+    assert (await client.delete(f"/tasks/{series['next_task']['id']}", headers=headers)).status_code == 200
+    tasks = (await client.get("/tasks", headers=headers)).json()
+    assert [task["deadline_at"][:10] for task in tasks] == ["2027-01-02"]
+
+    # Последний повтор удалён — серия исчерпана, виртуальных повторов больше нет
+    await client.delete(f"/tasks/{tasks[0]['id']}", headers=headers)
+    assert (await client.get("/tasks", headers=headers)).json() == []
+    response = await client.get("/tasks/occurrences", headers=headers, params={
+        "from": "2027-01-01T00:00:00Z", "to": "2027-01-10T00:00:00Z"
+    })
+    assert response.json() == []
+
+
+async def test_occurrences_include_virtual_repeats(client):
+    _, headers = await register_user(client, "planner")
+    series = (await client.post("/tasks/recurring", headers=headers, json={
+        "title": "зарядка", "is_important": False,
+        "rrule": "FREQ=DAILY", "dtstart": "2027-01-01T07:00:00Z"
+    })).json()
+
+    response = await client.get("/tasks/occurrences", headers=headers, params={
+        "from": "2027-01-01T00:00:00Z", "to": "2027-01-04T00:00:00Z"
+    })
+    occurrences = response.json()
+    assert [(item["deadline_at"][:10], item["is_virtual"]) for item in occurrences] == [
+        ("2027-01-01", False), ("2027-01-02", True), ("2027-01-03", True)
+    ]
+    assert occurrences[0]["task_id"] == series["next_task"]["id"]
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+from metrics import metrics
+from conftest import register_user
+
+
+def _later_today() -> str:
+    now = datetime.now(timezone.utc)
+    end_of_day = now.replace(hour=23, minute=59, second=59, microsecond=0)
+    return min(now + timedelta(minutes=5), end_of_day).isoformat()
+
+
+async def test_today_is_routed_and_cached(client):
+    _, headers = await register_user(client, "today")
+    response = await client.post("/tasks/", headers=headers, json={
+        "title": "Сдать отчёт", "is_important": True, "deadline_at": _later_today()
+    })
+    assert response.status_code == 201
+
+    hits = metrics.get("result_cache.hit")
+    first = await client.get("/tasks/today", headers=headers)
+    assert first.status_code == 200
+    assert [task["title"] for task in first.json()] == ["Сдать отчёт"]
+
+    second = await client.get("/tasks/today", headers=headers)
+    assert second.json() == first.json()
+    assert metrics.get("result_cache.hit") == hits + 1
+
+
+async def test_write_invalidates_cached_today(client):
+    _, headers = await register_user(client, "today2")
+    assert (await client.get("/tasks/today", headers=headers)).json() == []
+
+    await client.post("/tasks/", headers=headers, json={
+        "title": "Позвонить", "is_important": False, "deadline_at": _later_today()
+    })
+    assert [task["title"] for task in (await client.get("/tasks/today", headers=headers)).json()] == ["Позвонить"]
+
+
+async def test_cache_is_per_user(client):
+    _, alice = await register_user(client, "alice")
+    _, bob = await register_user(client, "bobby")
+    await client.post("/tasks/", headers=alice, json={
+        "title": "Только для Алисы", "is_important": True, "deadline_at": _later_today()
+    })
+    assert len((await client.get("/tasks/quadrant/Q1", headers=alice)).json()) == 1
+    assert (await client.get("/tasks/quadrant/Q1", headers=bob)).json() == []
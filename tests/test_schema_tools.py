@@ -0,0 +1,67 @@
+from sqlalchemy import text
+
+from database import engine
+from database import init_db
+from schema_tools import cascade_user_fk, create_missing_indexes
+from shards import shard_map
+
+
+async def _state():
+    async with engine.connect() as conn:
+        return (await conn.execute(text(
+            "SELECT confdeltype::text, convalidated FROM pg_constraint WHERE conname = 'tasks_user_id_fkey'"
+        ))).one()
+
+
+async def test_cascade_fk_is_added_not_valid_then_validated(db_ready):
+    # База, созданная до удаления пользователей: ключ без каскада
+    async with engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE tasks DROP CONSTRAINT tasks_user_id_fkey"))
+        await conn.execute(text(
+            "ALTER TABLE tasks ADD CONSTRAINT tasks_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(id)"
+        ))
+    assert tuple(await _state()) == ("a", True)
+
+    assert await cascade_user_fk(shard_map.primary, "tasks", "tasks_user_id_fkey") == "пересоздан"
+    assert tuple(await _state()) == ("c", True)
+    assert await cascade_user_fk(shard_map.primary, "tasks", "tasks_user_id_fkey") == "уже был"
+
+
+async def test_interrupted_migration_only_validates(db_ready):
+    # Первый шаг прошёл, до VALIDATE дело не дошло
+    async with engine.begin() as conn:
+        await conn.execute(text("ALTER TABLE tasks DROP CONSTRAINT tasks_user_id_fkey"))
+        await conn.execute(text(
+            "ALTER TABLE tasks ADD CONSTRAINT tasks_user_id_fkey FOREIGN KEY (user_id) "
+            "REFERENCES users(id) ON DELETE CASCADE NOT VALID"
+        ))
+    assert tuple(await _state()) == ("c", False)
+
+    await cascade_user_fk(shard_map.primary, "tasks", "tasks_user_id_fkey")
+    assert tuple(await _state()) == ("c", True)
+
+
+async def _index_state(name: str):
+    async with engine.connect() as conn:
+        return (await conn.execute(text(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+        ), {"name": name})).scalar()
+
+
+async def test_missing_indexes_are_built_concurrently_not_at_startup(db_ready, caplog):
+    async with engine.begin() as conn:
+        await conn.execute(text("DROP INDEX ix_tasks_open_next"))
+        await conn.execute(text("DROP INDEX ix_tasks_open_user_next"))
+        # Остаток прерванного CREATE INDEX CONCURRENTLY
+        await conn.execute(text("UPDATE pg_index SET indisvalid = false WHERE indexrelid = 'ix_tasks_series_id'::regclass"))
+
+    # Запуск приложения только предупреждает
+    await init_db()
+    assert await _index_state("ix_tasks_open_next") is None
+    assert "schema_tools.py indexes" in caplog.text
+
+    created = await create_missing_indexes(shard_map.primary)
+    assert sorted(created) == ["ix_tasks_open_next", "ix_tasks_open_user_next", "ix_tasks_series_id"]
+    for name in created:
+        assert await _index_state(name) is True
+    assert await create_missing_indexes(shard_map.primary) == []
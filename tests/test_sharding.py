@@ -0,0 +1,161 @@
+import os
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import shard_tools
+from database import Base, init_db
+from models.quadrant_history import QuadrantTransition
+from models.shard import UserShardOverride
+from models.task import Task
+from models.user import User
+from shards import Shard, ShardMap, shard_map, init_shards
+from conftest import register_user
+
+_shard_schema_ready = False
+
+
+@pytest.fixture
+async def add_shard(db_ready):
+    # Подключает вторую тестовую базу к общей карте шардов, как новый шард 1
+    global _shard_schema_ready
+    engine = create_async_engine(os.environ["TEST_SHARD_DATABASE_URL"], connect_args={"statement_cache_size": 0})
+    shard = Shard(1, engine, async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False))
+    if not _shard_schema_ready:
+        await init_db(engine)
+        _shard_schema_ready = True
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    async with engine.begin() as conn:
+        await conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    saved = shard_map.strategy, shard_map.ranges
+
+    async def connect(strategy: str, ranges=None) -> Shard:
+        shard_map.shards.append(shard)
+        shard_map.strategy, shard_map.ranges = strategy, ranges or []
+        await shard_tools.align_shard_ids()
+        return shard
+
+    yield connect
+    if shard in shard_map.shards:
+        shard_map.shards.remove(shard)
+        await shard_tools.align_shard_ids()
+    shard_map.strategy, shard_map.ranges = saved
+    await engine.dispose()
+
+
+def _routes(strategy: str, shard_count: int, ranges=None) -> list:
+    routing = ShardMap([Shard(index, None, None) for index in range(shard_count)], strategy, ranges)
+    return [routing.index_for_user(user_id) for user_id in (1, 99, 100, 150, 5000)]
+
+
+def test_new_range_shard_keeps_existing_routes():
+    assert _routes("range", 2, [100]) == [0, 0, 1, 1, 1]
+    # Третий шард с границей выше текущего максимума: прежние маршруты не меняются
+    assert _routes("range", 3, [100, 1000]) == [0, 0, 1, 1, 2]
+    # Для сравнения: при hash добавление шарда меняет маршрут большинства
+    assert _routes("hash", 2) == [1, 1, 0, 0, 0]
+    assert _routes("hash", 3) == [1, 0, 1, 0, 2]
+
+
+def test_range_bounds_must_match_shards():
+    with pytest.raises(ValueError):
+        ShardMap([Shard(0, None, None), Shard(1, None, None)], "range", [])
+
+
+async def _task_count(shard: Shard, user_id: int) -> int:
+    async with shard.session() as db:
+        return await db.scalar(select(func.count(Task.id)).where(Task.user_id == user_id))
+
+
+async def _create_task(client, headers, title: str) -> int:
+    response = await client.post("/tasks/", headers=headers, json={"title": title, "is_important": True})
+    assert response.status_code == 201
+    return response.json()["id"]
+
+
+async def test_new_users_go_to_new_range_shard(client, add_shard):
+    old_id, old_headers = await register_user(client, "veteran")
+    await _create_task(client, old_headers, "до шардирования")
+
+    shard = await add_shard("range", [old_id + 1])
+    new_id, new_headers = await register_user(client, "newcomer")
+    await _create_task(client, new_headers, "на новом шарде")
+
+    assert (await _task_count(shard_map.primary, old_id), await _task_count(shard, old_id)) == (1, 0)
+    assert (await _task_count(shard_map.primary, new_id), await _task_count(shard, new_id)) == (0, 1)
+    assert [task["title"] for task in (await client.get("/tasks", headers=old_headers)).json()] == ["до шардирования"]
+    assert [task["title"] for task in (await client.get("/tasks", headers=new_headers)).json()] == ["на новом шарде"]
+
+
+async def test_pin_keeps_existing_users_on_their_shard(client, add_shard):
+    users = [await register_user(client, f"user{n}") for n in range(4)]
+    for user_id, headers in users:
+        await _create_task(client, headers, f"задача {user_id}")
+
+    # hash с двумя шардами отправил бы нечётные id на пустой шард 1
+    await add_shard("hash")
+    assert await shard_tools.pin_existing_users() == 2
+    async with shard_map.primary.session() as db:
+        pinned = (await db.execute(select(UserShardOverride.user_id, UserShardOverride.shard))).all()
+    assert sorted(map(tuple, pinned)) == [(1, 0), (3, 0)]
+
+    for user_id, headers in users:
+        tasks = (await client.get("/tasks", headers=headers)).json()
+        assert [task["title"] for task in tasks] == [f"задача {user_id}"]
+    # Повторный запуск ничего не добавляет
+    assert await shard_tools.pin_existing_users() == 0
+
+
+async def test_move_user_between_shards(client, add_shard):
+    user_id, headers = await register_user(client, "mover")
+    task_ids = [await _create_task(client, headers, f"задача {n}") for n in range(3)]
+    await client.patch(f"/tasks/{task_ids[0]}/complete", headers=headers)
+    shard = await add_shard("range", [1_000_000])
+
+    await shard_tools.move_user(user_id, 1)
+    assert shard_map.index_for_user(user_id) == 1
+    assert (await _task_count(shard_map.primary, user_id), await _task_count(shard, user_id)) == (0, 3)
+    async with shard.session() as db:
+        transitions = await db.scalar(select(func.count()).select_from(QuadrantTransition))
+    assert transitions == 4
+    # id задач сохраняются, API видит их на новом шарде
+    assert sorted(task["id"] for task in (await client.get("/tasks", headers=headers)).json()) == task_ids
+    await _create_task(client, headers, "после переноса")
+    assert await _task_count(shard, user_id) == 4
+
+    await shard_tools.move_user(user_id, 0)
+    assert (await _task_count(shard_map.primary, user_id), await _task_count(shard, user_id)) == (4, 0)
+    async with shard.session() as db:
+        assert await db.get(User, user_id) is None
+
+
+async def _next_ids(shard: Shard) -> tuple:
+    async with shard.engine.begin() as conn:
+        return (
+            await conn.scalar(text("SELECT nextval('tasks_id_seq')")),
+            await conn.scalar(text("SELECT nextval('task_series_id_seq')")),
+        )
+
+
+async def test_align_ids_only_moves_sequences_forward(db_ready, add_shard, caplog):
+    # Воркер с прежней конфигурацией успел выдать id после подсчёта максимума
+    async with shard_map.primary.engine.begin() as conn:
+        await conn.execute(text("SELECT setval('tasks_id_seq', 1000)"))
+    shard = await add_shard("range", [1_000_000])
+
+    primary_task, primary_series = await _next_ids(shard_map.primary)
+    shard_task, shard_series = await _next_ids(shard)
+    assert primary_task > 1000 and primary_task % 2 == 1
+    assert shard_task > 1000 and shard_task % 2 == 0
+    assert (primary_series % 2, shard_series % 2) == (1, 0)
+
+    # Повторный запуск не откатывает последовательности назад
+    await shard_tools.align_shard_ids()
+    assert (await _next_ids(shard_map.primary))[0] > primary_task
+
+    # Запуск приложения только предупреждает о невыровненных последовательностях
+    async with shard.engine.begin() as conn:
+        await conn.execute(text("ALTER SEQUENCE tasks_id_seq INCREMENT BY 1"))
+    await init_shards()
+    assert "shard_tools.py align-ids" in caplog.text
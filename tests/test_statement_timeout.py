@@ -0,0 +1,26 @@
+import database
+from conftest import add_tasks, register_user
+
+
+async def test_search_is_routed(client):
+    _, headers = await register_user(client, "searcher")
+    await client.post("/tasks/", headers=headers, json={"title": "Купить молоко", "is_important": False})
+
+    response = await client.get("/tasks/search", params={"q": "молоко"}, headers=headers)
+    assert response.status_code == 200
+    assert [task["title"] for task in response.json()] == ["Купить молоко"]
+    assert (await client.get("/tasks/search", params={"q": "хлеб"}, headers=headers)).status_code == 404
+
+
+async def test_search_timeout_returns_503(client, monkeypatch):
+    user_id, headers = await register_user(client, "slowsearch")
+    await add_tasks(user_id, count=200_000, description="описание " * 20)
+    monkeypatch.setitem(database.STATEMENT_TIMEOUTS_MS, "tasks_search", 1)
+
+    response = await client.get("/tasks/search", params={"q": "нет такого"}, headers=headers)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+    # Таймаут задаётся SET LOCAL и не остаётся на соединении в пуле
+    monkeypatch.setitem(database.STATEMENT_TIMEOUTS_MS, "tasks_search", 5000)
+    assert (await client.get("/tasks/search", params={"q": "задача 7"}, headers=headers)).status_code == 200
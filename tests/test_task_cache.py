@@ -0,0 +1,62 @@
+from sqlalchemy import update
+
+from cache import RESULT_CACHE_TTL
+from metrics import metrics
+from models.task import Task
+from shards import shard_map
+from task_cache import task_cache, TASK_CACHE_TTL
+from conftest import register_user
+
+
+async def _titles(client, headers) -> list:
+    return [task["title"] for task in (await client.get("/tasks", headers=headers)).json()]
+
+
+def test_ttl_does_not_exceed_result_cache_ttl():
+    assert TASK_CACHE_TTL <= RESULT_CACHE_TTL
+
+
+async def test_writes_go_through_to_working_set(client):
+    user_id, headers = await register_user(client, "cached")
+    response = await client.post("/tasks/", headers=headers, json={"title": "первая", "is_important": False})
+    task_id = response.json()["id"]
+    assert await _titles(client, headers) == ["первая"]
+
+    write_through = metrics.get("task_cache.write_through")
+    await client.put(f"/tasks/{task_id}", headers=headers, json={"title": "изменённая"})
+    assert metrics.get("task_cache.write_through") == write_through + 1
+    assert await _titles(client, headers) == ["изменённая"]
+    assert (await client.get(f"/tasks/{task_id}", headers=headers)).json()["title"] == "изменённая"
+
+    await client.delete(f"/tasks/{task_id}", headers=headers)
+    assert await _titles(client, headers) == []
+    assert (await task_cache.peek(user_id)) is not None
+
+
+async def test_write_from_another_worker_is_seen_after_ttl(client, monkeypatch):
+    user_id, headers = await register_user(client, "cached2")
+    response = await client.post("/tasks/", headers=headers, json={"title": "старое", "is_important": False})
+    task_id = response.json()["id"]
+    assert await _titles(client, headers) == ["старое"]
+
+    # Другой воркер меняет задачу: версии этого воркера не сдвигаются
+    async with shard_map.primary.session() as db:
+        await db.execute(update(Task).where(Task.id == task_id).values(title="новое"))
+        await db.commit()
+    assert await _titles(client, headers) == ["старое"]
+
+    monkeypatch.setattr(task_cache, "ttl", 0)
+    assert await _titles(client, headers) == ["новое"]
+
+
+async def test_eviction_keeps_cache_within_budget(client, monkeypatch):
+    _, alice = await register_user(client, "alice")
+    _, bob = await register_user(client, "bobby")
+    for headers in (alice, bob):
+        await client.post("/tasks/", headers=headers, json={"title": "x" * 90, "is_important": False})
+
+    await _titles(client, alice)
+    monkeypatch.setattr(task_cache, "max_bytes", task_cache.size_bytes + 100)
+    await _titles(client, bob)
+    assert task_cache.stats()["users"] == 1
+    assert task_cache.size_bytes <= task_cache.max_bytes
@@ -0,0 +1,110 @@
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import func, update
+
+from auth_utils import decode_access_token
+from dependencies import get_current_db_user, get_token_principal
+from main import app
+from models.rollup import CalendarRollupState
+from models.user import User
+from shards import shard_map
+from token_epochs import TokenEpochs
+from conftest import register_user
+
+
+@pytest.fixture
+def stateless(client):
+    # Обработчики задач проверяют только токен и карту эпох, как при AUTH_STATELESS=1
+    app.dependency_overrides[get_current_db_user] = get_token_principal
+    return client
+
+
+async def _another_worker() -> TokenEpochs:
+    # Воркер, который не видел отзыва и знает о нём только из БД
+    epochs = TokenEpochs()
+    await epochs.refresh()
+    return epochs
+
+
+async def test_deleted_user_token_is_rejected(stateless):
+    user_id, headers = await register_user(stateless, "doomed")
+    _, admin = await register_user(stateless, "admin", admin=True)
+    assert (await stateless.get("/tasks", headers=headers)).status_code == 200
+
+    response = await stateless.delete(f"/auth/admin/users/{user_id}", headers=admin)
+    assert response.status_code == 200
+    assert (await stateless.get("/tasks", headers=headers)).status_code == 401
+    assert (await stateless.post("/tasks/", headers=headers, json={
+        "title": "после удаления", "is_important": False
+    })).status_code == 401
+
+    # Строки пользователя больше нет, но другие воркеры узнают об удалении из deleted_users
+    other = await _another_worker()
+    assert not other.is_current(user_id, 1)
+    assert not other.is_current(user_id, 0)
+
+
+async def test_old_tombstones_are_not_loaded(stateless, monkeypatch):
+    user_id, _ = await register_user(stateless, "doomed2")
+    _, admin = await register_user(stateless, "admin2", admin=True)
+    await stateless.delete(f"/auth/admin/users/{user_id}", headers=admin)
+
+    monkeypatch.setattr("token_epochs.ACCESS_TOKEN_EXPIRE_MINUTES", 0)
+    assert (await _another_worker()).is_current(user_id, 0)
+
+
+async def test_epoch_bump_revokes_tokens_in_other_workers(stateless):
+    user_id, headers = await register_user(stateless, "rotated")
+    assert (await _another_worker()).is_current(user_id, 0)
+
+    async with shard_map.primary.session() as db:
+        await db.execute(update(User).where(User.id == user_id).values(token_epoch=1, token_epoch_changed_at=func.now()))
+        await db.commit()
+    other = await _another_worker()
+    assert not other.is_current(user_id, 0)
+    assert other.is_current(user_id, 1)
+
+
+async def test_old_epoch_changes_are_not_loaded(stateless):
+    user_id, _ = await register_user(stateless, "rotated2")
+    async with shard_map.primary.session() as db:
+        await db.execute(update(User).where(User.id == user_id).values(
+            token_epoch=1, token_epoch_changed_at=func.now() - timedelta(days=1)
+        ))
+        await db.commit()
+
+    # Токены до давней смены эпохи уже истекли — пользователь не читается из БД
+    other = await _another_worker()
+    assert user_id not in other._epochs
+    assert other.is_current(user_id, 1)
+
+
+async def test_deactivated_user_cannot_refresh(stateless):
+    user_id, _ = await register_user(stateless, "sleepy")
+    _, admin = await register_user(stateless, "admin3", admin=True)
+    response = await stateless.post("/auth/login", data={"username": "sleepy@example.com", "password": "secret123"})
+    refresh_token = response.json()["refresh_token"]
+    assert (await stateless.post("/auth/refresh", json={"refresh_token": refresh_token})).status_code == 200
+
+    await stateless.patch(f"/auth/admin/users/{user_id}/deactivate", headers=admin)
+    assert (await stateless.post("/auth/refresh", json={"refresh_token": refresh_token})).status_code == 401
+
+
+async def test_timezone_change_returns_tokens_with_new_zone(client):
+    user_id, headers = await register_user(client, "traveller")
+    response = await client.patch("/auth/timezone", headers=headers, json={"timezone": "Asia/Tokyo"})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["id"], body["timezone"]) == (user_id, "Asia/Tokyo")
+    assert decode_access_token(body["access_token"])["tz"] == "Asia/Tokyo"
+
+    # Stateless-запрос с новым токеном строит агрегаты сразу в новом поясе
+    app.dependency_overrides[get_current_db_user] = get_token_principal
+    new_headers = {"Authorization": f"Bearer {body['access_token']}"}
+    today = date.today()
+    params = {"from": (today - timedelta(days=10)).isoformat(), "to": today.isoformat()}
+    response = await client.get("/stats/calendar", headers=new_headers, params=params)
+    assert response.status_code == 200
+    async with shard_map.primary.session() as db:
+        assert (await db.get(CalendarRollupState, user_id)).timezone == "Asia/Tokyo"
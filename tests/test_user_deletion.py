@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, update
+
+import routers.auth
+import user_deletion
+from models.task import Task
+from models.user import User
+from shards import shard_map
+from user_deletion import DeletionJob, deletion_jobs, resume_deletion_jobs, start_deletion_job
+from conftest import add_tasks, register_user
+
+
+async def _exists(user_id: int) -> tuple:
+    async with shard_map.primary.session() as db:
+        user = await db.get(User, user_id)
+        tasks = await db.scalar(select(func.count(Task.id)).where(Task.user_id == user_id))
+    return user is not None, tasks
+
+
+async def _wait_for_jobs() -> None:
+    await asyncio.wait_for(asyncio.gather(*user_deletion._running.values()), 10)
+
+
+async def test_small_user_is_deleted_synchronously(client):
+    user_id, _ = await register_user(client, "small")
+    _, admin = await register_user(client, "admin", admin=True)
+    await add_tasks(user_id, count=3)
+
+    response = await client.delete(f"/auth/admin/users/{user_id}", headers=admin)
+    assert response.status_code == 200
+    assert response.json()["deleted_tasks"] == 3
+    assert await _exists(user_id) == (False, 0)
+
+
+async def test_large_user_is_deleted_in_batches(client, monkeypatch):
+    monkeypatch.setattr(routers.auth, "USER_DELETE_SYNC_LIMIT", 2)
+    monkeypatch.setattr(user_deletion, "USER_DELETE_BATCH_SIZE", 2)
+    user_id, headers = await register_user(client, "large")
+    _, admin = await register_user(client, "admin2", admin=True)
+    await add_tasks(user_id, count=5)
+
+    response = await client.delete(f"/auth/admin/users/{user_id}", headers=admin)
+    assert response.status_code == 202
+    # Вход заблокирован сразу, ещё до удаления задач
+    assert (await client.get("/tasks", headers=headers)).status_code == 401
+
+    await _wait_for_jobs()
+    assert await _exists(user_id) == (False, 0)
+    progress = (await client.get(f"/auth/admin/users/{user_id}/deletion", headers=admin)).json()
+    assert (progress["status"], progress["deleted_tasks"], progress["progress"]) == ("completed", 5, 1.0)
+
+
+async def test_interrupted_deletion_is_resumed_at_startup(client):
+    user_id, _ = await register_user(client, "interrupted")
+    await add_tasks(user_id, count=4)
+    # Воркер остановился после деактивации, не успев удалить задачи
+    async with shard_map.primary.session() as db:
+        await db.execute(update(User).where(User.id == user_id).values(
+            is_active=False, deletion_requested_at=datetime.now(timezone.utc)
+        ))
+        await db.commit()
+
+    assert await resume_deletion_jobs() == 1
+    await _wait_for_jobs()
+    assert await _exists(user_id) == (False, 0)
+
+
+async def test_deactivated_user_is_not_resumed(client):
+    user_id, _ = await register_user(client, "deactivated")
+    _, admin = await register_user(client, "admin3", admin=True)
+    await add_tasks(user_id, count=2)
+    await client.patch(f"/auth/admin/users/{user_id}/deactivate", headers=admin)
+
+    assert await resume_deletion_jobs() == 0
+    assert await _exists(user_id) == (True, 2)
+
+
+async def test_finished_jobs_are_evicted(db_ready, monkeypatch):
+    monkeypatch.setattr(user_deletion, "USER_DELETE_JOBS_KEPT", 2)
+    deletion_jobs.clear()
+    for user_id in range(1001, 1006):
+        start_deletion_job(DeletionJob(user_id=user_id, total_tasks=0))
+        await _wait_for_jobs()
+    assert list(deletion_jobs) == [1004, 1005]
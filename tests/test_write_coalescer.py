@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+import routers.tasks
+from dependencies import Principal
+from metrics import metrics
+from models.user import UserRole
+from shards import shard_map
+from task_cache import task_cache
+from write_coalescer import WriteCoalescer
+from conftest import register_user
+
+
+@pytest.fixture
+async def coalescer(monkeypatch):
+    coalescer = WriteCoalescer(enabled=True, max_delay_ms=50)
+    coalescer.start()
+    monkeypatch.setattr(routers.tasks, "write_coalescer", coalescer)
+    yield coalescer
+    await coalescer.stop()
+
+
+async def _create_tasks(client, headers, count: int) -> list:
+    ids = []
+    for n in range(count):
+        response = await client.post("/tasks/", headers=headers, json={"title": f"задача {n}", "is_important": False})
+        ids.append(response.json()["id"])
+    return ids
+
+
+async def test_concurrent_writes_share_one_transaction(client, coalescer):
+    _, headers = await register_user(client, "coalesce")
+    task_ids = await _create_tasks(client, headers, 5)
+    batches = metrics.get("write_coalescer.batches")
+
+    responses = await asyncio.gather(*(
+        client.patch(f"/tasks/{task_id}/complete", headers=headers) for task_id in task_ids
+    ))
+    assert [response.status_code for response in responses] == [200] * 5
+    assert all(response.json()["completed"] for response in responses)
+    # Окно в 50 мс: при медленном планировщике запросы могут разойтись по двум пачкам
+    assert batches < metrics.get("write_coalescer.batches") < batches + 5
+
+    # Сброс кэша после общего commit: список сразу показывает изменения
+    tasks = (await client.get("/tasks", headers=headers)).json()
+    assert all(task["completed"] for task in tasks)
+
+
+async def test_each_caller_gets_its_own_error(client, coalescer):
+    user_id, headers = await register_user(client, "coalesce2")
+    _, other = await register_user(client, "stranger")
+    [task_id] = await _create_tasks(client, headers, 1)
+
+    own, foreign, missing = await asyncio.gather(
+        client.put(f"/tasks/{task_id}", headers=headers, json={"title": "новое"}),
+        client.put(f"/tasks/{task_id}", headers=other, json={"title": "чужое"}),
+        client.put("/tasks/999999", headers=headers, json={"title": "нет"}),
+    )
+    assert (own.status_code, foreign.status_code, missing.status_code) == (200, 403, 404)
+    assert own.json()["title"] == "новое"
+
+
+async def test_flush_error_fails_batch_and_worker_survives(client, coalescer, monkeypatch):
+    user_id, headers = await register_user(client, "coalesce3")
+    first, second = await _create_tasks(client, headers, 2)
+    principal = Principal(user_id, UserRole.USER, "UTC")
+    shard = shard_map.shard_for_user(user_id)
+
+    original = task_cache.apply_changes
+
+    async def broken_apply_changes(changes):
+        raise RuntimeError("кэш недоступен")
+
+    monkeypatch.setattr(task_cache, "apply_changes", broken_apply_changes)
+    with pytest.raises(RuntimeError, match="кэш недоступен"):
+        await asyncio.wait_for(coalescer.submit_complete(shard, first, principal), 5)
+
+    monkeypatch.setattr(task_cache, "apply_changes", original)
+    task = await asyncio.wait_for(coalescer.submit_complete(shard, second, principal), 5)
+    assert task.completed
@@ -0,0 +1,79 @@
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Set
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from auth_utils import ACCESS_TOKEN_EXPIRE_MINUTES
+from database import AsyncSessionLocal
+from models.deleted_user import DeletedUser
+from models.user import User
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Как часто перечитывать эпохи из БД: столько в худшем случае живёт
+# отозванный токен в других воркерах
+TOKEN_EPOCH_REFRESH_SECONDS = int(os.getenv("TOKEN_EPOCH_REFRESH_SECONDS", "30"))
+
+
+class TokenEpochs:
+    """Эпохи токенов пользователей для проверки без запроса к БД.
+
+    Токен несёт эпоху пользователя на момент выдачи (claim "ep"). Смена
+    пароля, роли или деактивация увеличивают users.token_epoch, и все ранее
+    выданные токены перестают проходить проверку. Старые токены живут не
+    дольше access-токена, поэтому в памяти хранятся только пользователи, чья
+    эпоха менялась за это время (users.token_epoch_changed_at), и недавно
+    удалённые. Для остальных эпоха в токене не проверяется: новый токен
+    после давней смены эпохи выдаётся только через БД (вход или /refresh).
+    """
+
+    def __init__(self):
+        self._epochs: Dict[int, int] = {}
+        self._inactive: Set[int] = set()
+
+    def is_current(self, user_id: int, epoch: int) -> bool:
+        if user_id in self._inactive:
+            return False
+        current = self._epochs.get(user_id)
+        return current is None or current == epoch
+
+    def remember(self, user: User) -> None:
+        # Изменение в этом воркере действует сразу, в остальных — после refresh()
+        self._epochs[user.id] = user.token_epoch or 0
+        if user.is_active:
+            self._inactive.discard(user.id)
+        else:
+            self._inactive.add(user.id)
+
+    async def refresh(self) -> None:
+        # Токены, выданные до более раннего изменения, уже истекли
+        changed_since = datetime.now(timezone.utc) - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        async with AsyncSessionLocal() as db:
+            # Индекс по token_epoch_changed_at: читаются только недавно изменённые
+            result = await db.execute(
+                select(User.id, User.token_epoch, User.is_active)
+                .where(User.token_epoch_changed_at > changed_since)
+            )
+            rows = result.all()
+            # Строки удалённого пользователя уже нет, но его токены ещё действуют по сроку
+            result = await db.execute(
+                select(DeletedUser.user_id).where(DeletedUser.deleted_at > changed_since)
+            )
+            deleted = set(result.scalars().all())
+        self._epochs = {row.id: row.token_epoch for row in rows}
+        self._inactive = {row.id for row in rows if not row.is_active} | deleted
+        logger.debug("Эпохи токенов обновлены", extra={"users": len(rows)})
+
+
+token_epochs = TokenEpochs()
+
+
+def bump_token_epoch(user: User) -> None:
+    # Отзывает все выданные пользователю токены (после commit вызвать token_epochs.remember)
+    user.token_epoch = (user.token_epoch or 0) + 1
+    user.token_epoch_changed_at = datetime.now(timezone.utc)
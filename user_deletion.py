@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Dict, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, func, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from auth_utils import ACCESS_TOKEN_EXPIRE_MINUTES
+from cache import result_cache
+from models.deleted_user import DeletedUser
+from models.shard import UserShardOverride
+from models.task import Task
+from models.user import User
+from shards import shard_map
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Пользователи с большим числом задач удаляются в фоне порциями,
+# чтобы одна транзакция не держала блокировки на миллионах строк
+USER_DELETE_SYNC_LIMIT = int(os.getenv("USER_DELETE_SYNC_LIMIT", "1000"))
+USER_DELETE_BATCH_SIZE = int(os.getenv("USER_DELETE_BATCH_SIZE", "5000"))
+# Сколько завершённых удалений хранить для GET /admin/users/{id}/deletion
+USER_DELETE_JOBS_KEPT = int(os.getenv("USER_DELETE_JOBS_KEPT", "1000"))
+
+# После перезапуска удаление продолжают все воркеры сразу: SKIP LOCKED
+# делит строки между ними, вместо того чтобы ждать чужих блокировок
+_DELETE_TASK_BATCH = text(
+    "DELETE FROM tasks WHERE id IN ("
+    "SELECT id FROM tasks WHERE user_id = :user_id LIMIT :batch_size FOR UPDATE SKIP LOCKED)"
+)
+# Журнал переходов больше задач в разы: его тоже удаляем порциями, а не каскадом
+# вместе со строкой пользователя
+_DELETE_TRANSITION_BATCH = text(
+    "DELETE FROM task_quadrant_transitions WHERE id IN ("
+    "SELECT id FROM task_quadrant_transitions WHERE user_id = :user_id "
+    "LIMIT :batch_size FOR UPDATE SKIP LOCKED)"
+)
+
+
+@dataclass
+class DeletionJob:
+    user_id: int
+    total_tasks: int
+    deleted_tasks: int = 0
+    status: str = "running"  # running, completed, failed, interrupted
+    error: Optional[str] = None
+    started_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "status": self.status,
+            "total_tasks": self.total_tasks,
+            "deleted_tasks": self.deleted_tasks,
+            "progress": round(self.deleted_tasks / self.total_tasks, 4) if self.total_tasks else 1.0,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# Прогресс фоновых удалений (в памяти воркера, который их выполняет)
+deletion_jobs: "OrderedDict[int, DeletionJob]" = OrderedDict()
+# Выполняющиеся задачи asyncio: ссылка нужна, чтобы их не собрал сборщик мусора
+_running: Dict[int, asyncio.Task] = {}
+
+
+async def count_user_tasks(user_id: int) -> int:
+    async with shard_map.shard_for_user(user_id).session() as db:
+        result = await db.execute(select(func.count(Task.id)).where(Task.user_id == user_id))
+        return result.scalar() or 0
+
+
+async def delete_user_rows(user_id: int) -> None:
+    # Оставшиеся задачи и агрегаты удаляет БД через ON DELETE CASCADE
+    shard = shard_map.shard_for_user(user_id)
+    if shard.index != 0:
+        async with shard.session() as db:
+            await db.execute(delete(User).where(User.id == user_id))
+            await db.commit()
+    async with shard_map.primary.session() as db:
+        await db.execute(delete(UserShardOverride).where(UserShardOverride.user_id == user_id))
+        await db.execute(delete(User).where(User.id == user_id))
+        # Отметка для token_epochs других воркеров; старые отметки уже не нужны —
+        # выданные до них access-токены истекли
+        expired_before = datetime.now(timezone.utc) - timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        await db.execute(delete(DeletedUser).where(DeletedUser.deleted_at < expired_before))
+        # Удаление могли довести до конца сразу несколько воркеров
+        await db.execute(pg_insert(DeletedUser).values(user_id=user_id).on_conflict_do_nothing())
+        await db.commit()
+    shard_map.overrides.pop(user_id, None)
+    await result_cache.invalidate_user(user_id)
+
+
+async def _delete_in_batches(user_id: int, statement) -> AsyncIterator[int]:
+    shard = shard_map.shard_for_user(user_id)
+    while True:
+        async with shard.session() as db:
+            result = await db.execute(statement, {"user_id": user_id, "batch_size": USER_DELETE_BATCH_SIZE})
+            await db.commit()
+        if result.rowcount == 0:
+            return
+        yield result.rowcount
+        # Отдаём цикл событий и соединение другим запросам между порциями
+        await asyncio.sleep(0)
+
+
+async def run_deletion_job(job: DeletionJob) -> None:
+    try:
+        async for deleted in _delete_in_batches(job.user_id, _DELETE_TASK_BATCH):
+            job.deleted_tasks += deleted
+        async for _ in _delete_in_batches(job.user_id, _DELETE_TRANSITION_BATCH):
+            pass
+
+        await delete_user_rows(job.user_id)
+        job.status = "completed"
+        logger.info(
+            "Пользователь удалён",
+            extra={"user_id": job.user_id, "deleted_tasks": job.deleted_tasks}
+        )
+    except asyncio.CancelledError:
+        # Остановка приложения: удаление продолжит resume_deletion_jobs при запуске
+        job.status = "interrupted"
+        raise
+    except Exception as e:
+        job.status = "failed"
+        job.error = str(e)
+        logger.exception("Ошибка фонового удаления пользователя", extra={"user_id": job.user_id})
+    finally:
+        job.finished_at = datetime.now(timezone.utc)
+
+
+def start_deletion_job(job: DeletionJob) -> None:
+    # Удаление идёт отдельной задачей asyncio, а не BackgroundTask запроса:
+    # оно не занимает слот ConcurrencyLimitMiddleware всё время работы
+    deletion_jobs[job.user_id] = job
+    deletion_jobs.move_to_end(job.user_id)
+    finished = [user_id for user_id, kept in deletion_jobs.items() if kept.status != "running"]
+    for user_id in finished[:max(len(deletion_jobs) - USER_DELETE_JOBS_KEPT, 0)]:
+        del deletion_jobs[user_id]
+
+    task = asyncio.create_task(run_deletion_job(job))
+    _running[job.user_id] = task
+    task.add_done_callback(lambda _: _running.pop(job.user_id, None))
+
+
+async def resume_deletion_jobs() -> int:
+    # Удаления, прерванные перезапуском: пользователь уже деактивирован, но ещё не удалён
+    async with shard_map.primary.session() as db:
+        result = await db.execute(select(User.id).where(User.deletion_requested_at.is_not(None)))
+        user_ids = result.scalars().all()
+    for user_id in user_ids:
+        if user_id in _running:
+            continue
+        start_deletion_job(DeletionJob(user_id=user_id, total_tasks=await count_user_tasks(user_id)))
+    if user_ids:
+        logger.info("Продолжены незавершённые удаления пользователей", extra={"users": len(user_ids)})
+    return len(user_ids)
+
+
+async def stop_deletion_jobs() -> None:
+    tasks = list(_running.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
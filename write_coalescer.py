@@ -0,0 +1,194 @@
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from app_logging import correlation_id
+from cache import result_cache
+from metrics import metrics
+from models.task import Task
+from models.user import User
+from shards import Shard
+from task_cache import task_cache, TaskChanges
+from task_mutations import check_task_access, apply_task_update, apply_task_complete
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+WRITE_COALESCING_ENABLED = os.getenv("WRITE_COALESCING", "0") == "1"
+WRITE_COALESCE_MAX_DELAY_MS = float(os.getenv("WRITE_COALESCE_MAX_DELAY_MS", "5"))
+WRITE_COALESCE_MAX_BATCH = int(os.getenv("WRITE_COALESCE_MAX_BATCH", "200"))
+
+
+@dataclass
+class _Operation:
+    kind: str  # "update" или "complete"
+    shard: Shard
+    task_id: int
+    current_user: User
+    update_data: dict = field(default_factory=dict)
+    future: Optional[asyncio.Future] = None
+    # Запись выполняет фоновая задача, поэтому id запроса сохраняем явно
+    correlation_id: Optional[str] = None
+
+
+class WriteCoalescer:
+    """Групповая запись изменений задач (group commit).
+
+    Обработчики кладут изменения в очередь, а фоновая задача раз в несколько
+    миллисекунд (или по набору N операций) применяет их в одной транзакции.
+    Каждый вызывающий получает свой результат или свою ошибку.
+    """
+
+    def __init__(self, enabled: bool = WRITE_COALESCING_ENABLED,
+                 max_delay_ms: float = WRITE_COALESCE_MAX_DELAY_MS,
+                 max_batch: int = WRITE_COALESCE_MAX_BATCH):
+        self.enabled = enabled
+        self.max_delay = max_delay_ms / 1000
+        self.max_batch = max_batch
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if not self.enabled or self._worker is not None:
+            return
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+        # None в очереди — сигнал дописать накопленное и завершиться
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+
+    async def submit_update(self, shard: Shard, task_id: int, current_user: User, update_data: dict) -> Task:
+        return await self._submit(_Operation("update", shard, task_id, current_user, update_data))
+
+    async def submit_complete(self, shard: Shard, task_id: int, current_user: User) -> Task:
+        return await self._submit(_Operation("complete", shard, task_id, current_user))
+
+    async def _submit(self, operation: _Operation) -> Task:
+        if self._worker is None:
+            raise RuntimeError("WriteCoalescer не запущен")
+        operation.future = asyncio.get_running_loop().create_future()
+        operation.correlation_id = correlation_id.get()
+        await self._queue.put(operation)
+        return await operation.future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            operation = await self._queue.get()
+            if operation is None:
+                break
+            batch = [operation]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    operation = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if operation is None:
+                    stopping = True
+                    break
+                batch.append(operation)
+
+            try:
+                await self._flush(batch)
+            except Exception as e:
+                # Например, не удалось сбросить кэши после commit: ошибку получают
+                # ожидающие этой пачки, а воркер продолжает обслуживать очередь
+                metrics.inc("write_coalescer.flush_errors")
+                logger.exception(
+                    "Ошибка групповой записи",
+                    extra={"request_ids": [operation.correlation_id for operation in batch]}
+                )
+                for operation in batch:
+                    if not operation.future.done():
+                        operation.future.set_exception(e)
+
+    async def _flush(self, batch: List[_Operation]) -> None:
+        # Одна транзакция на каждый шард, затронутый пачкой
+        by_shard: Dict[int, List[_Operation]] = {}
+        for operation in batch:
+            by_shard.setdefault(operation.shard.index, []).append(operation)
+        changes = TaskChanges()
+        groups = await asyncio.gather(*(self._flush_shard(ops, changes) for ops in by_shard.values()))
+        results = [item for group in groups for item in group]
+
+        await result_cache.invalidate_users(
+            result.user_id for _, result in results if isinstance(result, Task)
+        )
+        await task_cache.apply_changes(changes)
+        for operation, result in results:
+            if operation.future.done():
+                continue
+            if isinstance(result, Exception):
+                operation.future.set_exception(result)
+            else:
+                operation.future.set_result(result)
+
+    async def _flush_shard(self, batch: List[_Operation], changes: TaskChanges) -> list:
+        metrics.inc("write_coalescer.batches")
+        metrics.inc("write_coalescer.operations", len(batch))
+        try:
+            return await self._apply_in_transaction(batch, changes)
+        except Exception:
+            # Общий commit не прошёл — выполняем операции по одной,
+            # чтобы ошибка одной не досталась остальным
+            metrics.inc("write_coalescer.fallbacks")
+            logger.warning(
+                "Групповая запись не удалась, повтор по одной операции",
+                exc_info=True,
+                extra={
+                    "shard": batch[0].shard.index,
+                    "operations": len(batch),
+                    "request_ids": [operation.correlation_id for operation in batch],
+                }
+            )
+            results = []
+            for operation in batch:
+                try:
+                    results.extend(await self._apply_in_transaction([operation], changes))
+                except Exception as e:
+                    results.append((operation, e))
+            return results
+
+    async def _apply_in_transaction(self, batch: List[_Operation], changes: TaskChanges) -> list:
+        results = []
+        async with batch[0].shard.session() as db:
+            task_ids = {operation.task_id for operation in batch}
+            result = await db.execute(select(Task).where(Task.id.in_(task_ids)))
+            tasks = {task.id: task for task in result.scalars().all()}
+
+            # Операции применяются по порядку поступления, как и без группировки
+            for operation in batch:
+                try:
+                    task = check_task_access(tasks.get(operation.task_id), operation.current_user)
+                    if operation.kind == "update":
+                        await apply_task_update(db, task, operation.update_data)
+                    else:
+                        await apply_task_complete(db, task)
+                    results.append((operation, task))
+                except Exception as e:
+                    results.append((operation, e))
+
+            await db.commit()
+            # Записанные задачи попадут в рабочие наборы после сброса версий
+            changes.merge(task_cache.take_changes(db))
+        return results
+
+
+write_coalescer = WriteCoalescer()